@@ -0,0 +1,159 @@
+# api/case_partitions.py
+# -*- coding: utf-8 -*-
+"""
+case_records 依 client_id 做 LIST 分割
+- 每個租戶一個分割表 case_records_p_<client>；其餘（含 client_id 為 NULL）落在 case_records_p_default
+- 第一次寫入某租戶時自動建立分割（schema_registry 保證每個程序只做一次）
+- 尚未執行 api/scripts/partition_case_records.py 的資料庫維持舊行為（不分割）
+"""
+
+import hashlib
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import text
+
+try:
+    from api.schema_registry import _engine_key, schema_registry
+except ImportError:
+    from schema_registry import _engine_key, schema_registry  # type: ignore
+
+PARENT = "case_records"
+DEFAULT_PARTITION = "case_records_p_default"
+# 分割後的唯一鍵（分割鍵必須包含在唯一約束內）；models_cases.CaseRecord 新建的表也用這組
+PARTITIONED_CONFLICT_COLS = ["client_id", "case_type", "case_id"]
+LEGACY_CONFLICT_COLS = ["case_type", "case_id"]
+
+SAFE = re.compile(r"[^a-z0-9_]")
+
+_lock = threading.Lock()
+_partitioned: Dict[str, bool] = {}  # engine URL -> case_records 是否為分割表
+_conflict_cols: Dict[str, List[str]] = {}  # engine URL -> ON CONFLICT 目標欄位
+
+
+def partition_name(client_id: str) -> str:
+    """識別字上限 63 字元；清洗後可能撞名，因此附上短雜湊。"""
+    digest = hashlib.md5(client_id.encode("utf-8")).hexdigest()[:8]
+    return f"case_records_p_{SAFE.sub('_', client_id.lower())[:36]}_{digest}"
+
+
+def _literal(value: str) -> str:
+    # DDL 的 FOR VALUES IN (...) 不能用 bind 參數
+    return "'" + value.replace("'", "''") + "'"
+
+
+def is_partitioned(bind) -> bool:
+    key = _engine_key(bind)
+    with _lock:
+        if key in _partitioned:
+            return _partitioned[key]
+    engine = getattr(bind, "engine", bind)
+    with engine.connect() as conn:
+        kind = conn.execute(text("""
+            SELECT c.relkind FROM pg_class c
+            WHERE c.oid = to_regclass(:name)
+        """), {"name": PARENT}).scalar()
+    with _lock:
+        _partitioned[key] = kind == "p"
+    return kind == "p"
+
+
+def conflict_columns(bind) -> List[str]:
+    """
+    ON CONFLICT 目標欄位；依目前 case_records 佈局決定。
+    分割表、或由 CaseRecord 模型 create_all 建立（唯一鍵含 client_id）的表用三欄；
+    只有舊的 (case_type, case_id) 唯一鍵時才用兩欄。
+    """
+    if is_partitioned(bind):
+        return PARTITIONED_CONFLICT_COLS
+    key = _engine_key(bind)
+    with _lock:
+        if key in _conflict_cols:
+            return _conflict_cols[key]
+    engine = getattr(bind, "engine", bind)
+    with engine.connect() as conn:
+        has_tenant_key = conn.execute(text("""
+            SELECT 1 FROM pg_index i
+            WHERE i.indrelid = to_regclass(:name) AND i.indisunique AND i.indnatts = 3
+              AND (SELECT array_agg(a.attname::text ORDER BY a.attname)
+                   FROM pg_attribute a
+                   WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey))
+                  = ARRAY['case_id', 'case_type', 'client_id']
+            LIMIT 1
+        """), {"name": PARENT}).first() is not None
+    cols = PARTITIONED_CONFLICT_COLS if has_tenant_key else LEGACY_CONFLICT_COLS
+    with _lock:
+        _conflict_cols[key] = cols
+    return cols
+
+
+def create_partition(conn, client_id: str) -> bool:
+    """
+    在同一交易內建立租戶分割；已存在則略過。回傳是否新建。
+    預設分割若已有該租戶資料，先搬進新表再 ATTACH（否則 ATTACH 會失敗）。
+    """
+    name = partition_name(client_id)
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:n))"), {"n": name})
+    if conn.execute(text("SELECT to_regclass(:n)"), {"n": name}).scalar():
+        return False
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS, PRIMARY KEY (id))"))
+    moved, keep = 0, False
+    if conn.execute(text("SELECT to_regclass(:n)"), {"n": DEFAULT_PARTITION}).scalar():
+        # 搬移時的 DELETE 會觸發 case_stage_events 清除（連同 reminded_on），先記下已提醒的紀錄
+        keep = conn.execute(text("SELECT to_regproc('resync_case_stage_events')")).scalar() is not None
+        if keep:
+            conn.execute(text("""
+                CREATE TEMP TABLE _case_partition_reminded ON COMMIT DROP AS
+                SELECT case_pk, stage, reminded_on, reminded_at FROM case_stage_events
+                WHERE client_id = :cid AND reminded_on IS NOT NULL
+            """), {"cid": client_id})
+        moved = conn.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE client_id = :cid RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), {"cid": client_id}).rowcount
+    conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES IN ({_literal(client_id)})"))
+    if keep:
+        if moved:
+            # 搬完重算該租戶，再把提醒紀錄放回去（id 不變，case_pk 對得上），已發過的不會重發
+            conn.execute(text("SELECT resync_case_stage_events(:cid)"), {"cid": client_id})
+            conn.execute(text("""
+                UPDATE case_stage_events e
+                SET reminded_on = r.reminded_on, reminded_at = r.reminded_at
+                FROM _case_partition_reminded r
+                WHERE e.case_pk = r.case_pk AND e.stage = r.stage
+            """))
+        # 同一交易可能連續建立多個分割（轉換工具），用完即刪
+        conn.execute(text("DROP TABLE _case_partition_reminded"))
+    return True
+
+
+def ensure_case_partition(bind, client_id: Optional[str]) -> None:
+    """寫入前呼叫；未分割的資料庫或 client_id 為空時不做事。"""
+    if not client_id or not is_partitioned(bind):
+        return
+    engine = getattr(bind, "engine", bind)
+
+    def _create():
+        with engine.begin() as conn:
+            create_partition(conn, client_id)
+
+    schema_registry.ensure(engine, f"case_partition:{client_id}", _create, tag=client_id)
+
+
+def ensure_case_partitions(bind, client_ids: Iterable[Optional[str]]) -> None:
+    for cid in {c for c in client_ids if c}:
+        ensure_case_partition(bind, cid)
+
+
+def _on_rearm(tag: Optional[str]) -> None:
+    # 全部重新檢查時（例如剛跑完遷移工具）連同佈局判斷一起清掉
+    if tag is None:
+        with _lock:
+            _partitioned.clear()
+            _conflict_cols.clear()
+
+
+schema_registry.add_listener(_on_rearm)
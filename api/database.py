@@ -3,11 +3,16 @@
 
 import os
 from contextlib import contextmanager
-from typing import Generator, Optional
+from typing import AsyncGenerator, Generator, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+try:
+    from api.pool_metrics import InstrumentedQueuePool, pool_monitor
+except ImportError:
+    from pool_metrics import InstrumentedQueuePool, pool_monitor  # type: ignore
 
 try:
     from dotenv import load_dotenv
@@ -31,21 +36,25 @@ ENGINE = create_engine(
     pool_size=5,         # 可依流量調整
     max_overflow=5,      # 避免瞬間爆量
     pool_recycle=1800,   # 30 分鐘回收一次
+    poolclass=InstrumentedQueuePool,
 )
+pool_monitor.attach(ENGINE, "control")
 
 # ---- Engine / Session / Base ----
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300, future=True)
+engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300, future=True,
+                       poolclass=InstrumentedQueuePool)
+pool_monitor.attach(engine, "control_orm")
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 Base = declarative_base()
 
-# ---- Resolve tenant DSN from primary DB ----
+# ---- Resolve tenant DSN from primary DB（經 TTL 快取）----
 def get_tenant_db_url(client_id: str) -> Optional[str]:
-    with engine.connect() as conn:
-        row = conn.execute(
-            text("""SELECT tenant_db_url FROM login_users WHERE client_id=:cid LIMIT 1"""),
-            {"cid": client_id},
-        ).fetchone()
-        return row[0] if row else None
+    try:
+        from api.tenant_meta import get_tenant_meta
+    except ImportError:
+        from tenant_meta import get_tenant_meta  # type: ignore
+    meta = get_tenant_meta(client_id)
+    return meta.tenant_db_url if meta else None
 
 # ---- Context manager for manual usage (with ...): supports tenant ----
 @contextmanager
@@ -54,9 +63,12 @@ def get_db_cm(client_id: Optional[str] = None) -> Generator:
         tenant_url = get_tenant_db_url(client_id)
         if not tenant_url:
             raise RuntimeError(f"No tenant_db_url configured for client_id={client_id}")
-        tenant_engine = create_engine(tenant_url, pool_pre_ping=True, pool_recycle=300, future=True)
-        Session = sessionmaker(bind=tenant_engine, autocommit=False, autoflush=False, future=True)
-        db = Session()
+        # 共用租戶 engine 註冊表，避免每次呼叫都新建連線池
+        try:
+            from api.tenant_db import tenant_engines
+        except ImportError:
+            from tenant_db import tenant_engines  # type: ignore
+        db = tenant_engines.get_sessionmaker(client_id, tenant_url)()
     else:
         db = SessionLocal()
     try:
@@ -72,6 +84,55 @@ def get_db() -> Generator:
     finally:
         db.close()
 
+# ---- Async engine（asyncpg）：LINE 熱路徑用，避免佔用 threadpool / 卡住 event loop ----
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "5"))
+ASYNC_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "5"))
+
+_async_engine = None
+_AsyncSessionLocal = None
+
+def _to_asyncpg_url(url: str):
+    """psycopg2 URL → asyncpg URL；asyncpg 不認得 sslmode，改成 connect_args['ssl']。"""
+    parts = urlsplit(url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1))
+    qs = dict(parse_qsl(parts.query, keep_blank_values=True))
+    connect_args = {}
+    sslmode = qs.pop("sslmode", None)
+    if sslmode and sslmode != "disable":
+        connect_args["ssl"] = "require" if sslmode in ("require", "prefer", "allow") else sslmode
+    options = qs.pop("options", "")
+    if options.startswith("-csearch_path="):
+        connect_args["server_settings"] = {"search_path": options.split("=", 1)[1]}
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(qs), parts.fragment)), connect_args
+
+def get_async_engine():
+    """第一次呼叫才建立（asyncpg 為選配套件，未安裝時不影響同步路徑）。"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        url, connect_args = _to_asyncpg_url(DATABASE_URL)
+        _async_engine = create_async_engine(
+            url,
+            pool_pre_ping=True,
+            pool_size=ASYNC_POOL_SIZE,
+            max_overflow=ASYNC_MAX_OVERFLOW,
+            pool_recycle=300,
+            connect_args=connect_args,
+        )
+        pool_monitor.attach(_async_engine.sync_engine, "control_async")
+        # expire_on_commit=False：commit 後仍可讀取 ORM 屬性（async 下不能 lazy load）
+        _AsyncSessionLocal = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+# ---- FastAPI dependency (async)：primary DB only ----
+async def get_async_db() -> AsyncGenerator:
+    get_async_engine()
+    async with _AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_async_engine() -> None:
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
 def get_database_info():
     try:
         masked = str(engine.url)
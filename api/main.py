@@ -28,6 +28,24 @@ from api.routes.file_routes import router as file_router
 from api.routes.lawyer_routes import router as lawyer_router, router_user as user_router
 from api.routes.line_routes import line_router
 from api.routes.pending_routes import router as pending_router
+from api.routes.transfer_routes import router as transfer_router
+from api.routes.user_routes import router as user_cases_router
+from api.database import dispose_async_engine
+from api.pool_metrics import pool_monitor
+from api.schema_registry import schema_registry
+from api.services.case_list_cache import case_list_cache
+from api.services.case_lookup import case_lookup_cache
+from api.services.line_identity import line_identity
+from api.services.session_store import session_store, start_session_sweeper, stop_session_sweeper
+from api.services.file_transfer import file_hash_cache
+from api.services.engagement_service import engagement_tracker, start_engagement_flusher, stop_engagement_flusher
+from api.services.line_service import line_push, start_line_push, stop_line_push
+from api.services.plan_expiry import plan_expiry, start_plan_expiry, stop_plan_expiry
+from api.services.storage import storage_stats
+from api.services.stage_reminders import stage_reminder_stats, start_stage_reminders, stop_stage_reminders
+from api.utils.render_cache import render_cache
+from api.tenant_db import tenant_engines
+from api.tenant_meta import plan_status_cache, secret_code_map, tenant_meta_cache
 
 # Optional routes
 try:
@@ -55,7 +73,8 @@ app.include_router(routes_search.router, prefix="/api/cases", tags=["Cases"])
 
 # Standardize critical endpoints used by LINE / n8n
 app.include_router(line_router, prefix="/api")                 # => /api/lawyer/verify-secret, /api/line/resolve-route
-app.include_router(user_router, prefix="/api/user", tags=["user"])  # => /api/user/my-cases
+app.include_router(user_router, prefix="/api/user", tags=["user"])
+app.include_router(user_cases_router)                           # => /api/user/register, /api/user/my-cases
 
 # Other routers (preserve original behavior)
 app.include_router(case_upload_router, tags=["cases"])
@@ -64,6 +83,7 @@ app.include_router(cases_router)
 app.include_router(lawyer_router)
 app.include_router(file_router)
 app.include_router(pending_router)
+app.include_router(transfer_router)                             # => /download/{transfer_id}
 if cases_query_router:
     app.include_router(cases_query_router)
 
@@ -103,8 +123,51 @@ async def system_info():
             "ENVIRONMENT": os.getenv("ENVIRONMENT", "development"),
             "DB_SET": bool(os.getenv("DATABASE_URL")),
         },
+        "tenant_engines": tenant_engines.stats(),
+        "tenant_meta": tenant_meta_cache.stats(),
+        "plan_status": plan_status_cache.stats(),
+        "plan_expiry": plan_expiry.stats(),
+        "secret_codes": secret_code_map.stats(),
+        "line_identity": line_identity.stats(),
+        "schema_registry": schema_registry.stats(),
+        "case_lookup": case_lookup_cache.stats(),
+        "case_list": case_list_cache.stats(),
+        "render_cache": render_cache.stats(),
+        "user_sessions": session_store.stats(),
+        "engagement": engagement_tracker.stats(),
+        "line_push": line_push.stats(),
+        "stage_reminders": stage_reminder_stats(),
+        "storage": storage_stats(),
+        "file_hashes": file_hash_cache.stats(),
     }
 
+@app.get("/system/pools")
+async def system_pools():
+    """各 engine / 租戶連線池的借出、閒置、溢出與等待時間統計。"""
+    return {
+        **pool_monitor.snapshot(),
+        "tenant_registry": tenant_engines.stats(),
+        "time": datetime.now().isoformat(),
+    }
+
+@app.on_event("startup")
+async def _start_background_tasks():
+    start_session_sweeper()
+    start_engagement_flusher()
+    start_line_push()
+    start_stage_reminders()
+    start_plan_expiry()
+
+@app.on_event("shutdown")
+async def _dispose_engines():
+    await stop_session_sweeper()
+    await stop_stage_reminders()
+    await stop_plan_expiry()
+    await stop_engagement_flusher()
+    await stop_line_push()
+    tenant_engines.dispose_all()
+    await dispose_async_engine()
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
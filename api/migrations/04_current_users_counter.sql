@@ -0,0 +1,54 @@
+-- api/migrations/04_current_users_counter.sql
+-- 目的：login_users.current_users 由觸發器隨 client_line_users 增減維護（只計 is_active = TRUE）
+-- bind-user / check-client-plan / 方案狀態查詢直接讀這個欄位，不再 COUNT(*)
+-- 可重複執行；部署時由 api/scripts/migrate.py（seat_counter 步驟）套用，API 程序只檢查是否已安裝
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION sync_login_users_current_users()
+RETURNS TRIGGER AS $$
+BEGIN
+  -- 啟用狀態與所屬事務所都沒變（例如重新綁定同一人）→ 不動計數
+  IF TG_OP = 'UPDATE'
+     AND OLD.client_id = NEW.client_id
+     AND (OLD.is_active IS TRUE) = (NEW.is_active IS TRUE) THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.is_active IS TRUE THEN
+    UPDATE login_users
+       SET current_users = GREATEST(COALESCE(current_users, 0) - 1, 0)
+     WHERE client_id = OLD.client_id;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.is_active IS TRUE THEN
+    UPDATE login_users
+       SET current_users = COALESCE(current_users, 0) + 1
+     WHERE client_id = NEW.client_id;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_client_line_users_seats ON client_line_users;
+CREATE TRIGGER trg_client_line_users_seats
+AFTER INSERT OR DELETE OR UPDATE OF is_active, client_id ON client_line_users
+FOR EACH ROW
+EXECUTE FUNCTION sync_login_users_current_users();
+
+-- 以現有綁定重算一次（期間擋住綁定寫入，避免與觸發器重複計算）
+LOCK TABLE client_line_users IN SHARE ROW EXCLUSIVE MODE;
+UPDATE login_users l
+   SET current_users = COALESCE(c.n, 0)
+  FROM login_users l2
+  LEFT JOIN (
+    SELECT client_id, COUNT(*) AS n
+      FROM client_line_users
+     WHERE is_active IS TRUE
+     GROUP BY client_id
+  ) c ON c.client_id = l2.client_id
+ WHERE l.id = l2.id
+   AND l.current_users IS DISTINCT FROM COALESCE(c.n, 0);
+
+COMMIT;
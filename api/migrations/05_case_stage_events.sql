@@ -0,0 +1,222 @@
+-- api/migrations/05_case_stage_events.sql
+-- 目的：把 case_records.progress_stages（JSONB）裡的階段日期展開成可索引的 case_stage_events
+-- 伺服器端期日提醒與事務所行事曆直接以 stage_date 範圍查詢，不再讀整張 case_records 逐筆解析
+-- 顯示用欄位（當事人、案號、法院…）一併複製，查詢時不必再 JOIN 回 case_records
+-- 由 case_records 的觸發器維護；可重複執行，由部署時的 api/scripts/migrate.py（stage_events 步驟）套用
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS case_stage_events (
+  case_pk     bigint      NOT NULL,           -- case_records.id（分割搬移時不變）
+  client_id   text,
+  case_id     text        NOT NULL,
+  stage       text        NOT NULL,
+  stage_date  date        NOT NULL,
+  stage_time  text,                           -- HH:MM；沒有時間為 NULL
+  case_type   text,
+  client      text,
+  case_number text,
+  court       text,
+  division    text,
+  reminded_on date,                           -- 已針對哪一個 stage_date 發過提醒；改期後自動重新提醒
+  reminded_at timestamptz,
+  PRIMARY KEY (case_pk, stage)
+);
+
+CREATE INDEX IF NOT EXISTS ix_case_stage_events_date   ON case_stage_events (stage_date);
+CREATE INDEX IF NOT EXISTS ix_case_stage_events_client ON case_stage_events (client_id, stage_date);
+
+-- 日期：2025-08-14 / 2025/8/14 / 2025.08.14 / 2025年8月14日 / 民國 114/08/14
+CREATE OR REPLACE FUNCTION case_stage_parse_date(v text)
+RETURNS date AS $$
+DECLARE
+  m text[];
+BEGIN
+  IF v IS NULL THEN
+    RETURN NULL;
+  END IF;
+  v := translate(v, '０１２３４５６７８９／－．', '0123456789/-.');
+  m := regexp_match(v, '(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})');
+  IF m IS NULL THEN
+    m := regexp_match(v, '(?:^|[^\d])(\d{2,3})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})');
+    IF m IS NULL THEN
+      RETURN NULL;
+    END IF;
+    m[1] := (m[1]::int + 1911)::text;
+  END IF;
+  RETURN make_date(m[1]::int, m[2]::int, m[3]::int);
+EXCEPTION WHEN others THEN
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- 時間：14:30 / 下午2點30分 / 9.15（只取日期以外的部分）→ HH:MM
+CREATE OR REPLACE FUNCTION case_stage_parse_time(v text)
+RETURNS text AS $$
+DECLARE
+  m text[];
+  h int;
+BEGIN
+  IF v IS NULL THEN
+    RETURN NULL;
+  END IF;
+  v := translate(v, '０１２３４５６７８９：．', '0123456789:.');
+  v := regexp_replace(v, '\d{2,4}\s*[-/.年]\s*\d{1,2}\s*[-/.月]\s*\d{1,2}\s*日?', '');
+  m := regexp_match(v, '(上午|下午|AM|PM|am|pm)?\s*([0-2]?\d)\s*[:.點時点时]\s*([0-5]?\d)?', 'i');
+  IF m IS NULL THEN
+    RETURN NULL;
+  END IF;
+  h := m[2]::int;
+  IF lower(coalesce(m[1], '')) IN ('pm', '下午') AND h < 12 THEN
+    h := h + 12;
+  ELSIF lower(coalesce(m[1], '')) IN ('am', '上午') AND h = 12 THEN
+    h := 0;
+  END IF;
+  IF h > 23 THEN
+    RETURN NULL;
+  END IF;
+  RETURN lpad(h::text, 2, '0') || ':' || lpad(coalesce(m[3], '0'), 2, '0');
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- progress_stages 支援 {階段: 日期字串} / {階段: {date, time, ...}} / [{stage, date, ...}]，
+-- 以及外層包一層 stages / items / data；時間另可來自 progress_times {階段: 時間}
+CREATE OR REPLACE FUNCTION case_stage_events_rows(p_stages jsonb, p_times jsonb)
+RETURNS TABLE (stage text, stage_date date, stage_time text) AS $$
+  WITH src AS (
+    SELECT COALESCE(p_stages -> 'stages', p_stages -> 'items', p_stages -> 'data', p_stages) AS j
+  ), kv AS (
+    SELECT e.key AS stage, e.value AS v
+    FROM src, jsonb_each(CASE WHEN jsonb_typeof(src.j) = 'object' THEN src.j ELSE '{}'::jsonb END) e
+    UNION ALL
+    SELECT COALESCE(e ->> 'stage', e ->> 'name', e ->> 'label', e ->> 'phase', e ->> 'title'), e
+    FROM src, jsonb_array_elements(CASE WHEN jsonb_typeof(src.j) = 'array' THEN src.j ELSE '[]'::jsonb END) e
+    WHERE jsonb_typeof(e) = 'object'
+  ), raw AS (
+    SELECT btrim(kv.stage) AS stage,
+           CASE jsonb_typeof(kv.v)
+             WHEN 'string' THEN kv.v #>> '{}'
+             WHEN 'object' THEN COALESCE(kv.v ->> 'date', kv.v ->> 'at', kv.v ->> 'datetime',
+                                         kv.v ->> 'schedule_date', kv.v ->> 'updated_at')
+           END AS raw_date,
+           CASE WHEN jsonb_typeof(kv.v) = 'object'
+                THEN COALESCE(kv.v ->> 'progress_time', kv.v ->> 'time', kv.v ->> 'schedule_time',
+                              kv.v ->> 'court_time', kv.v ->> 'hearing_time', kv.v ->> '開庭時間', kv.v ->> '時間')
+           END AS raw_time,
+           CASE WHEN jsonb_typeof(p_times) = 'object' THEN p_times ->> kv.stage END AS times_time
+    FROM kv
+    WHERE kv.stage IS NOT NULL AND btrim(kv.stage) <> ''
+  )
+  SELECT DISTINCT ON (raw.stage)
+         raw.stage,
+         case_stage_parse_date(raw.raw_date),
+         COALESCE(case_stage_parse_time(raw.raw_time), case_stage_parse_time(raw.times_time),
+                  case_stage_parse_time(raw.raw_date))
+  FROM raw
+  WHERE case_stage_parse_date(raw.raw_date) IS NOT NULL
+  ORDER BY raw.stage
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION sync_case_stage_events()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    DELETE FROM case_stage_events WHERE case_pk = OLD.id;
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP = 'UPDATE'
+     AND NEW.progress_stages IS NOT DISTINCT FROM OLD.progress_stages
+     AND NEW.progress_times  IS NOT DISTINCT FROM OLD.progress_times
+     AND (NEW.client_id, NEW.case_id, NEW.case_type, NEW.client, NEW.case_number, NEW.court, NEW.division)
+         IS NOT DISTINCT FROM
+         (OLD.client_id, OLD.case_id, OLD.case_type, OLD.client, OLD.case_number, OLD.court, OLD.division) THEN
+    RETURN NULL;
+  END IF;
+
+  DELETE FROM case_stage_events e
+   WHERE e.case_pk = NEW.id
+     AND NOT EXISTS (SELECT 1 FROM case_stage_events_rows(NEW.progress_stages, NEW.progress_times) r
+                     WHERE r.stage = e.stage);
+
+  INSERT INTO case_stage_events (case_pk, client_id, case_id, stage, stage_date, stage_time,
+                                 case_type, client, case_number, court, division)
+  SELECT NEW.id, NEW.client_id, NEW.case_id, r.stage, r.stage_date, r.stage_time,
+         NEW.case_type, NEW.client, NEW.case_number, NEW.court, NEW.division
+  FROM case_stage_events_rows(NEW.progress_stages, NEW.progress_times) r
+  ON CONFLICT (case_pk, stage) DO UPDATE
+  SET client_id   = EXCLUDED.client_id,
+      case_id     = EXCLUDED.case_id,
+      stage_date  = EXCLUDED.stage_date,
+      stage_time  = EXCLUDED.stage_time,
+      case_type   = EXCLUDED.case_type,
+      client      = EXCLUDED.client,
+      case_number = EXCLUDED.case_number,
+      court       = EXCLUDED.court,
+      division    = EXCLUDED.division
+  WHERE (case_stage_events.client_id, case_stage_events.case_id, case_stage_events.stage_date,
+         case_stage_events.stage_time, case_stage_events.case_type, case_stage_events.client,
+         case_stage_events.case_number, case_stage_events.court, case_stage_events.division)
+        IS DISTINCT FROM
+        (EXCLUDED.client_id, EXCLUDED.case_id, EXCLUDED.stage_date, EXCLUDED.stage_time, EXCLUDED.case_type,
+         EXCLUDED.client, EXCLUDED.case_number, EXCLUDED.court, EXCLUDED.division);
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 以 case_records 重算（p_client_id 為 NULL 代表全部）；保留 reminded_on
+-- 建立租戶分割時資料是先刪後搬，api/case_partitions.py 搬完會以該租戶呼叫一次
+CREATE OR REPLACE FUNCTION resync_case_stage_events(p_client_id text DEFAULT NULL)
+RETURNS void AS $$
+BEGIN
+  CREATE TEMP TABLE IF NOT EXISTS _case_stage_events_sync
+    (LIKE case_stage_events) ON COMMIT DROP;
+  TRUNCATE _case_stage_events_sync;
+
+  INSERT INTO _case_stage_events_sync (case_pk, client_id, case_id, stage, stage_date, stage_time,
+                                       case_type, client, case_number, court, division)
+  SELECT c.id, c.client_id, c.case_id, r.stage, r.stage_date, r.stage_time,
+         c.case_type, c.client, c.case_number, c.court, c.division
+  FROM case_records c
+  CROSS JOIN LATERAL case_stage_events_rows(c.progress_stages, c.progress_times) r
+  WHERE p_client_id IS NULL OR c.client_id = p_client_id;
+
+  DELETE FROM case_stage_events e
+   WHERE (p_client_id IS NULL OR e.client_id = p_client_id)
+     AND NOT EXISTS (SELECT 1 FROM _case_stage_events_sync s
+                     WHERE s.case_pk = e.case_pk AND s.stage = e.stage);
+
+  INSERT INTO case_stage_events (case_pk, client_id, case_id, stage, stage_date, stage_time,
+                                 case_type, client, case_number, court, division)
+  SELECT case_pk, client_id, case_id, stage, stage_date, stage_time,
+         case_type, client, case_number, court, division
+  FROM _case_stage_events_sync
+  ON CONFLICT (case_pk, stage) DO UPDATE
+  SET client_id   = EXCLUDED.client_id,
+      case_id     = EXCLUDED.case_id,
+      stage_date  = EXCLUDED.stage_date,
+      stage_time  = EXCLUDED.stage_time,
+      case_type   = EXCLUDED.case_type,
+      client      = EXCLUDED.client,
+      case_number = EXCLUDED.case_number,
+      court       = EXCLUDED.court,
+      division    = EXCLUDED.division;
+
+  DROP TABLE _case_stage_events_sync;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_case_stage_events ON case_records;
+CREATE TRIGGER trg_case_stage_events
+AFTER INSERT OR DELETE
+   OR UPDATE OF progress_stages, progress_times, client_id, case_id, case_type, client, case_number, court, division
+   ON case_records
+FOR EACH ROW
+EXECUTE FUNCTION sync_case_stage_events();
+
+-- 以現有資料重算一次（期間擋住案件寫入，避免與觸發器交錯）
+LOCK TABLE case_records IN SHARE ROW EXCLUSIVE MODE;
+SELECT resync_case_stage_events(NULL);
+
+COMMIT;
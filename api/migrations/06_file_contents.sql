@@ -0,0 +1,66 @@
+-- api/migrations/06_file_contents.sql
+-- 目的：案件檔案改為內容定址（同一事務所內以 SHA-256 去重）
+-- file_contents 一筆代表 S3 上的一份內容（key = <租戶前綴>/blobs/sha256/<ab>/<sha256>/<隨機碼>，每次認領一個新 key）；
+-- file_blobs 是「某案件附了某檔名」，以 (client_id, sha256) 參照內容，ref_count 由觸發器維護
+-- 可重複執行；部署時由 api/scripts/migrate.py（file_blobs 步驟，api/models_files.install_file_blobs）套用
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS file_contents (
+  id           bigserial    PRIMARY KEY,
+  client_id    varchar(50)  NOT NULL,
+  sha256       varchar(64)  NOT NULL,
+  size_bytes   bigint       NOT NULL,
+  s3_key       varchar(512) NOT NULL,
+  content_type varchar(100),
+  ref_count    integer      NOT NULL DEFAULT 0,
+  created_at   timestamptz  NOT NULL DEFAULT now(),
+  UNIQUE (client_id, sha256)
+);
+
+CREATE INDEX IF NOT EXISTS ix_file_contents_unreferenced ON file_contents (created_at) WHERE ref_count <= 0;
+
+CREATE OR REPLACE FUNCTION sync_file_contents_refs()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'UPDATE'
+     AND OLD.client_id = NEW.client_id
+     AND OLD.sha256 IS NOT DISTINCT FROM NEW.sha256 THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.sha256 IS NOT NULL THEN
+    UPDATE file_contents SET ref_count = ref_count - 1
+     WHERE client_id = OLD.client_id AND sha256 = OLD.sha256;
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.sha256 IS NOT NULL THEN
+    UPDATE file_contents SET ref_count = ref_count + 1
+     WHERE client_id = NEW.client_id AND sha256 = NEW.sha256;
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_file_blobs_refs ON file_blobs;
+CREATE TRIGGER trg_file_blobs_refs
+AFTER INSERT OR DELETE OR UPDATE OF client_id, sha256 ON file_blobs
+FOR EACH ROW
+EXECUTE FUNCTION sync_file_contents_refs();
+
+-- 既有檔案（uuid 路徑）各自登錄成內容，沿用原本的 key；重算 ref_count
+LOCK TABLE file_blobs IN SHARE ROW EXCLUSIVE MODE;
+
+INSERT INTO file_contents (client_id, sha256, size_bytes, s3_key, content_type)
+SELECT DISTINCT ON (client_id, sha256) client_id, sha256, size_bytes, s3_key, content_type
+FROM file_blobs
+WHERE sha256 IS NOT NULL
+ORDER BY client_id, sha256, id
+ON CONFLICT (client_id, sha256) DO NOTHING;
+
+UPDATE file_contents c
+   SET ref_count = COALESCE((SELECT count(*) FROM file_blobs b
+                             WHERE b.client_id = c.client_id AND b.sha256 = c.sha256), 0);
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- api/migrations/07_case_stage_events_claim.sql
+-- 目的：期日提醒改為「先認領、交易外發送、再回寫」，不再於 FOR UPDATE 交易內等 LINE API
+-- claimed_until：認領租約到期時間；發送中的列其他程序會略過，程序中途掛掉則租約到期後重新提醒
+-- 新增可為 NULL 的欄位不重寫整張表；可重複執行，由部署時的 api/scripts/migrate.py（stage_events 步驟）套用
+
+BEGIN;
+
+ALTER TABLE case_stage_events ADD COLUMN IF NOT EXISTS claimed_until timestamptz;
+
+COMMIT;
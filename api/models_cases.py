@@ -24,12 +24,12 @@ class CaseRecord(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
 
-    # 核心唯一鍵
+    # 核心唯一鍵：(client_id, case_type, case_id)，與分割後的 case_records 一致
     case_type = Column(String, nullable=False)
     case_id   = Column(String, nullable=False)
 
-    # ✅ 新增：租戶/事務所識別
-    client_id = Column(String, index=True)   # 可為空；之後上傳時會自動寫入
+    # ✅ 新增：租戶/事務所識別（分割鍵；必填，NULL 在唯一鍵中不會去重）
+    client_id = Column(String, nullable=False, index=True)
 
     # 其餘欄位（依你的實際欄位保持不變）
     client         = Column(String)   # 當事人姓名
@@ -44,13 +44,14 @@ class CaseRecord(Base):
     progress_date  = Column(String)
     created_date   = Column(String)
     updated_date   = Column(String)
+    updated_at     = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())  # 渲染快取以此判斷版本
 
     progress_stages = Column(JSONB)
     progress_notes  = Column(JSONB)
     progress_times  = Column(JSONB)
 
     __table_args__ = (
-        UniqueConstraint('case_type', 'case_id', name='ux_case_records_type_case'),
+        UniqueConstraint('client_id', 'case_type', 'case_id', name='ux_case_records_p_client_type_case'),
         Index('ix_case_records_case_type', 'case_type'),
         Index('ix_case_records_case_id', 'case_id'),
         Index('ix_case_records_client_id', 'client_id'),
@@ -4,10 +4,13 @@
 from sqlalchemy import (
     Column, Integer, String, Boolean, DateTime, Text, func, Enum as SAEnum
 )
+from sqlalchemy.orm import validates
 try:
     from api.database import Base
+    from api.tenant_meta import normalize_secret_code
 except ImportError:
     from database import Base  # type: ignore
+    from tenant_meta import normalize_secret_code  # type: ignore
 
 # 與資料庫端 ENUM 對齊
 PlanTypeEnum = SAEnum(
@@ -46,6 +49,11 @@ class LoginUser(Base):
     last_login = Column(DateTime(timezone=True), nullable=True)
     secret_code = Column(String(32), unique=True, nullable=True)
 
+    @validates("secret_code")
+    def _normalize_secret_code(self, key, value):
+        # 寫入時即正規化，查詢可直接用等號走唯一索引
+        return normalize_secret_code(value)
+
 
 class ClientLineUsers(Base):
     __tablename__ = "client_line_users"
@@ -59,9 +67,9 @@ class ClientLineUsers(Base):
 
 
 # === Pending (unbound) LINE users: model + helpers ============================
-from typing import Optional, Dict
+from typing import Optional
 from datetime import datetime, timezone, timedelta
-from sqlalchemy import Column, BigInteger, String, DateTime, func, create_engine
+from sqlalchemy import Column, BigInteger, String, DateTime, func
 from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.engine import Engine
 
@@ -76,30 +84,21 @@ class PendingLineUser(Base):
     created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
 
-# ---- Tenant engine/session cache（避免每次新建連線）----
-_TENANT_ENGINES: Dict[str, Engine] = {}
-_TENANT_SESSIONMAKERS: Dict[str, sessionmaker] = {}
-
-def _normalize_pg_url(url: str) -> str:
-    return url.replace("postgres://", "postgresql://", 1) if url and url.startswith("postgres://") else url
+# ---- Tenant engine/session：統一走 api.tenant_db 的註冊表（LRU + 連線預算）----
+from api.tenant_db import tenant_engines  # noqa: E402
+from api.schema_registry import schema_registry  # noqa: E402
+from api.services.line_identity import invalidate_line_identity  # noqa: E402
 
 def get_tenant_engine(client_id: str, tenant_db_url: str) -> Engine:
-    if client_id in _TENANT_ENGINES:
-        return _TENANT_ENGINES[client_id]
-    # 小連線池，避免多租戶爆連線
-    engine = create_engine(_normalize_pg_url(tenant_db_url), pool_pre_ping=True, pool_size=1, max_overflow=0)
-    _TENANT_ENGINES[client_id] = engine
-    return engine
+    return tenant_engines.get_engine(client_id, tenant_db_url)
 
 def get_tenant_sessionmaker(client_id: str, tenant_db_url: str) -> sessionmaker:
-    if client_id in _TENANT_SESSIONMAKERS:
-        return _TENANT_SESSIONMAKERS[client_id]
-    eng = get_tenant_engine(client_id, tenant_db_url)
-    sm = sessionmaker(bind=eng, autoflush=False, autocommit=False)
-    _TENANT_SESSIONMAKERS[client_id] = sm
-    # 若你之後導入 Alembic，可移除此行；目前先確保租戶 DB 有這張表
-    PendingLineUser.__table__.create(bind=eng, checkfirst=True)
-    return sm
+    def _create_pending_table(eng: Engine) -> None:
+        # 若你之後導入 Alembic，可移除此行；目前先確保租戶 DB 有這張表（每程序一次）
+        schema_registry.ensure(eng, "pending_line_users",
+                               lambda: PendingLineUser.__table__.create(bind=eng, checkfirst=True),
+                               tag=client_id)
+    return tenant_engines.get_sessionmaker(client_id, tenant_db_url, on_create=_create_pending_table)
 
 # 寫中央 DB（當下無法判斷屬於哪個事務所時）
 def track_pending_central(db: Session, *, line_user_id: str, expected_name: Optional[str] = None) -> PendingLineUser:
@@ -111,6 +110,7 @@ def track_pending_central(db: Session, *, line_user_id: str, expected_name: Opti
         u = PendingLineUser(line_user_id=line_user_id, expected_name=expected_name)
         db.add(u)
     db.commit(); db.refresh(u)
+    invalidate_line_identity(line_user_id)
     return u
 
 # 寫指定事務所（tenant）DB
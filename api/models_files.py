@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 # api/models_files.py
-from sqlalchemy import Column, Integer, String, DateTime, JSON, Index, func
+from pathlib import Path
+
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, JSON, Index, UniqueConstraint, func
 
 try:
     from api.database import Base
@@ -15,8 +17,9 @@ class FileBlob(Base):
     case_id   = Column(String(100), nullable=False, index=True)
     filename     = Column(String(255), nullable=False)
     content_type = Column(String(100), nullable=True)
-    size_bytes   = Column(Integer, nullable=False)
-    s3_key       = Column(String(512), nullable=False)
+    size_bytes   = Column(BigInteger, nullable=False)  # > 2 GiB 的影音檔超出 integer
+    s3_key       = Column(String(512), nullable=False, index=True)
+    sha256       = Column(String(64), nullable=True, index=True)
     uploaded_by  = Column(String(100), nullable=True)
     uploaded_at  = Column(DateTime, server_default=func.now(), nullable=False)
 
@@ -24,3 +27,109 @@ class FileBlob(Base):
     meta = Column("metadata", JSON, nullable=True)
 
 Index("ix_file_blobs_client_case", FileBlob.client_id, FileBlob.case_id)
+
+
+class FileContent(Base):
+    """內容定址的實體檔案（同事務所同 SHA-256 只存一份）；ref_count 由 file_blobs 觸發器維護"""
+    __tablename__ = "file_contents"
+    __table_args__ = (UniqueConstraint("client_id", "sha256"),)
+    id = Column(BigInteger, primary_key=True)
+    client_id    = Column(String(50), nullable=False)
+    sha256       = Column(String(64), nullable=False)
+    size_bytes   = Column(BigInteger, nullable=False)
+    s3_key       = Column(String(512), nullable=False)
+    content_type = Column(String(100), nullable=True)
+    ref_count    = Column(Integer, nullable=False, server_default="0")
+    created_at   = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+MIGRATION = Path(__file__).resolve().parent / "migrations" / "06_file_contents.sql"
+
+
+_INSTALLED_SQL = """
+    SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_file_blobs_refs' AND NOT tgisinternal)
+       AND EXISTS (SELECT 1 FROM information_schema.columns
+                   WHERE table_schema = current_schema() AND table_name = 'file_blobs'
+                     AND column_name = 'size_bytes' AND data_type = 'bigint')
+"""
+
+
+def _installed(engine) -> bool:
+    with engine.connect() as conn:
+        return bool(conn.exec_driver_sql(_INSTALLED_SQL).scalar())
+
+
+def install_file_blobs(engine) -> None:
+    """
+    部署時執行（api/scripts/migrate.py 的 file_blobs 步驟）：建表、補上後來加的欄位與索引，
+    套用內容定址 migration（會鎖 file_blobs 回填 file_contents）；已完成的部分略過
+    """
+    try:
+        from api.online_index import ensure_index
+    except ImportError:
+        from online_index import ensure_index  # type: ignore
+
+    FileBlob.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ALTER TABLE file_blobs ADD COLUMN IF NOT EXISTS sha256 varchar(64)")
+        # 舊表 size_bytes 為 integer；改型別會重寫整張表，只在還不是 bigint 時做
+        size_type = conn.exec_driver_sql("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'file_blobs' AND column_name = 'size_bytes'
+        """).scalar()
+        if size_type != "bigint":
+            conn.exec_driver_sql("ALTER TABLE file_blobs ALTER COLUMN size_bytes TYPE bigint")
+        installed = conn.exec_driver_sql(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'trg_file_blobs_refs' AND NOT tgisinternal"
+        ).first()
+    ensure_index(engine, "ix_file_blobs_sha256", "file_blobs", "(sha256)")
+    ensure_index(engine, "ix_file_blobs_s3_key", "file_blobs", "(s3_key)")
+    if not installed:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql(MIGRATION.read_text(encoding="utf-8"))
+
+
+def ensure_file_blobs(engine) -> None:
+    """只確認遷移已套用（每個程序查一次）；未套用丟 MigrationMissing"""
+    try:
+        from api.schema_registry import schema_registry
+    except ImportError:
+        from schema_registry import schema_registry  # type: ignore
+
+    schema_registry.require(engine, "file_blobs", lambda: _installed(engine), "file_blobs")
+
+
+class FileTransfer(Base):
+    """LINE / 客戶下載連結（SecureFileTransfer 建立）；存在 DB，重啟與多個 worker 都看得到"""
+    __tablename__ = "file_transfers"
+    transfer_id    = Column(String(64), primary_key=True)
+    file_path      = Column(String(1024), nullable=False)
+    file_name      = Column(String(255), nullable=False)
+    size_bytes     = Column(BigInteger, nullable=False)
+    mtime_ns       = Column(BigInteger, nullable=False)   # 建立連結時的檔案版本；檔案被改過就不再用舊雜湊
+    file_hash      = Column(String(64), nullable=True)    # 第一次有人要才計算（services/file_transfer.py）
+    download_count = Column(Integer, nullable=False, server_default="0")
+    expires_at     = Column(DateTime(timezone=True), nullable=False)
+    created_at     = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+Index("ix_file_transfers_expires_at", FileTransfer.expires_at)
+
+
+def install_file_transfers(engine) -> None:
+    """部署時執行（api/scripts/migrate.py 的 file_transfers 步驟）"""
+    FileTransfer.__table__.create(bind=engine, checkfirst=True)
+
+
+def _file_transfers_exist(engine) -> bool:
+    with engine.connect() as conn:
+        return bool(conn.exec_driver_sql("SELECT to_regclass('file_transfers') IS NOT NULL").scalar())
+
+
+def ensure_file_transfers(engine) -> None:
+    """只確認表已建立（每個程序查一次）；未建立丟 MigrationMissing"""
+    try:
+        from api.schema_registry import schema_registry
+    except ImportError:
+        from schema_registry import schema_registry  # type: ignore
+
+    schema_registry.require(engine, "file_transfers", lambda: _file_transfers_exist(engine), "file_transfers")
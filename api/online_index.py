@@ -0,0 +1,73 @@
+# api/online_index.py
+# -*- coding: utf-8 -*-
+"""
+不擋寫入的索引建立（部署時由 api/scripts/migrate.py 與 tenant_bootstrap 呼叫，不在請求路徑上跑）
+- 一般表：CREATE INDEX CONCURRENTLY（交易外執行）
+- 分割表：父表 CREATE INDEX ON ONLY（只登錄、不建），各分割 CONCURRENTLY 建好後 ATTACH；
+  全部掛上後父表索引自動轉為 valid
+- 先前失敗 / 中斷留下的 INVALID 索引會先 DROP 再重建（IF NOT EXISTS 會永遠略過它）
+"""
+
+import hashlib
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+_STATE_SQL = text("""
+    SELECT i.indisvalid
+    FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.oid = to_regclass(:name)
+""")
+_RELKIND_SQL = text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)")
+_PARTITIONS_SQL = text("""
+    SELECT c.relname FROM pg_inherits h JOIN pg_class c ON c.oid = h.inhrelid
+    WHERE h.inhparent = to_regclass(:t)
+    ORDER BY c.relname
+""")
+
+
+def _index_state(conn, name: str) -> Optional[bool]:
+    """None：不存在；True / False：是否 valid"""
+    return conn.execute(_STATE_SQL, {"name": name}).scalar()
+
+
+def _build_plain(conn, name: str, table: str, body: str) -> bool:
+    state = _index_state(conn, name)
+    if state:
+        return False
+    if state is False:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(text(f"CREATE INDEX CONCURRENTLY {name} ON {table} {body}"))
+    return True
+
+
+def ensure_index(engine: Engine, name: str, table: str, body: str) -> bool:
+    """
+    body 是 ON <table> 之後的部分，例如 "(case_id)" 或 "USING gin (client public.gin_trgm_ops)"。
+    表不存在時略過；回傳是否有建立 / 重建。
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        relkind = conn.execute(_RELKIND_SQL, {"t": table}).scalar()
+        if relkind is None:
+            return False
+        if relkind != "p":
+            return _build_plain(conn, name, table, body)
+
+        if _index_state(conn, name):
+            return False
+        # ON ONLY 只建父表的空殼索引（不掃資料、瞬間完成），之後逐一掛上各分割
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {body}"))
+        partitions: List[str] = conn.execute(_PARTITIONS_SQL, {"t": table}).scalars().all()
+        for part in partitions:
+            # ATTACH PARTITION 時 PG 會自動替新分割建好並掛上索引；已掛上的略過
+            attached = conn.execute(text("""
+                SELECT 1 FROM pg_inherits h JOIN pg_index i ON i.indexrelid = h.inhrelid
+                WHERE h.inhparent = to_regclass(:parent) AND i.indrelid = to_regclass(:part)
+            """), {"parent": name, "part": part}).first()
+            if attached:
+                continue
+            child = f"{name[:50]}_{hashlib.md5(part.encode('utf-8')).hexdigest()[:8]}"
+            _build_plain(conn, child, part, body)
+            conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {child}"))
+        return True
@@ -0,0 +1,179 @@
+# api/pool_metrics.py
+# -*- coding: utf-8 -*-
+"""
+連線池觀測（/system/pools）
+- 每個 engine 以名稱註冊（control / control_orm / tenant:<client_id>）
+- 借出/歸還/新建/失效 透過 SQLAlchemy pool events 計數
+- 取得連線的等待時間與逾時由 InstrumentedQueuePool 量測（pool events 沒有「開始等待」事件）
+- 逾時與慢速取得會寫出結構化 log（logger: api.pools）
+- /system/pools 沒有驗證，租戶以 client_id 的短雜湊呈現；POOL_METRICS_SHOW_TENANTS=1 才顯示原名（內部除錯用）
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("api.pools")
+
+POOL_SLOW_CHECKOUT_MS = float(os.getenv("POOL_SLOW_CHECKOUT_MS", "200"))
+POOL_METRICS_SHOW_TENANTS = os.getenv("POOL_METRICS_SHOW_TENANTS", "0").strip().lower() in ("1", "true", "yes", "on")
+# 等待時間直方圖上界（毫秒）；最後一格為 +Inf
+WAIT_BUCKETS_MS: List[float] = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000]
+
+
+def _tenant_label(client_id: str) -> str:
+    return hashlib.md5(client_id.encode("utf-8")).hexdigest()[:10]
+
+
+def log_event(event_name: str, **fields: Any) -> None:
+    """以單行 JSON 輸出，方便 Heroku log drain 解析。"""
+    logger.info(json.dumps({"event": event_name, **fields}, ensure_ascii=False, default=str))
+
+
+class _PoolStats:
+    def __init__(self, name: str, tenant: Optional[str]):
+        self.name = name
+        self.tenant = tenant
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {
+            "connects": 0, "checkouts": 0, "checkins": 0, "invalidations": 0, "timeouts": 0,
+        }
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.wait_sum_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.pool = None  # 目前綁定的 pool（engine.dispose 後會換新）
+
+    def observe_wait(self, ms: float) -> None:
+        with self.lock:
+            self.wait_buckets[bisect_left(WAIT_BUCKETS_MS, ms)] += 1
+            self.wait_sum_ms += ms
+            if ms > self.wait_max_ms:
+                self.wait_max_ms = ms
+
+    def incr(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        pool = self.pool
+        live: Dict[str, Any] = {}
+        if isinstance(pool, QueuePool):
+            live = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(0, pool.overflow()),
+                "timeout_seconds": pool.timeout(),
+            }
+        with self.lock:
+            observed = sum(self.wait_buckets)
+            hist = {f"le_{b:g}ms": n for b, n in zip(WAIT_BUCKETS_MS, self.wait_buckets)}
+            hist["le_inf"] = self.wait_buckets[-1]
+            return {
+                "name": self.name,
+                "tenant": self.tenant,
+                **live,
+                **self.counters,
+                "wait_ms": {
+                    "count": observed,
+                    "avg": round(self.wait_sum_ms / observed, 3) if observed else 0.0,
+                    "max": round(self.wait_max_ms, 3),
+                    "histogram": hist,
+                },
+            }
+
+
+class PoolMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _PoolStats] = {}
+
+    def attach(self, engine: Engine, name: str, tenant: Optional[str] = None) -> None:
+        """註冊 engine；同名重複註冊會改綁到新的 pool。"""
+        stats = _PoolStats(name, tenant)
+        pool = engine.pool
+        stats.pool = pool
+        pool._law_pool_stats = stats  # 給 InstrumentedQueuePool 回報等待時間用
+
+        @event.listens_for(pool, "connect")
+        def _on_connect(dbapi_conn, conn_record):
+            stats.incr("connects")
+
+        @event.listens_for(pool, "checkout")
+        def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+            stats.incr("checkouts")
+
+        @event.listens_for(pool, "checkin")
+        def _on_checkin(dbapi_conn, conn_record):
+            stats.incr("checkins")
+
+        @event.listens_for(pool, "invalidate")
+        def _on_invalidate(dbapi_conn, conn_record, exception):
+            stats.incr("invalidations")
+
+        @event.listens_for(engine, "engine_disposed")
+        def _on_disposed(eng):
+            # dispose 會以 recreate() 換新 pool，事件會被帶過去，只需更新參照
+            stats.pool = eng.pool
+            eng.pool._law_pool_stats = stats
+
+        with self._lock:
+            self._stats[name] = stats
+
+    def detach(self, name: str) -> None:
+        with self._lock:
+            self._stats.pop(name, None)
+
+    def snapshot(self, show_tenants: bool = POOL_METRICS_SHOW_TENANTS) -> Dict[str, Any]:
+        with self._lock:
+            items = list(self._stats.values())
+        engines = [s.snapshot() for s in items if s.tenant is None]
+        tenants = [s.snapshot() for s in items if s.tenant is not None]
+        if not show_tenants:
+            # 端點公開可讀，不列出 client_id
+            for t in tenants:
+                t["tenant"] = _tenant_label(t["tenant"])
+                t["name"] = f"tenant:{t['tenant']}"
+        totals = {
+            "checked_out": sum(p.get("checked_out", 0) for p in engines + tenants),
+            "idle": sum(p.get("idle", 0) for p in engines + tenants),
+            "timeouts": sum(p["timeouts"] for p in engines + tenants),
+        }
+        return {"engines": engines, "tenants": tenants, "totals": totals}
+
+
+pool_monitor = PoolMonitor()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool 加上取得連線的等待時間與逾時統計。"""
+
+    def _do_get(self):
+        stats: Optional[_PoolStats] = getattr(self, "_law_pool_stats", None)
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            if stats is not None:
+                stats.incr("timeouts")
+                log_event("pool_checkout_timeout", pool=stats.name, tenant=stats.tenant,
+                          waited_ms=round((time.perf_counter() - start) * 1000, 1),
+                          checked_out=self.checkedout(), overflow=self.overflow())
+            raise
+        if stats is not None:
+            ms = (time.perf_counter() - start) * 1000
+            stats.observe_wait(ms)
+            if ms >= POOL_SLOW_CHECKOUT_MS:
+                log_event("pool_checkout_slow", pool=stats.name, tenant=stats.tenant,
+                          waited_ms=round(ms, 1), checked_out=self.checkedout(), overflow=self.overflow())
+        return conn
@@ -24,6 +24,7 @@ from sqlalchemy import text
 from api.database import get_db
 from api.models_control import LoginUser  # 含 tenant_db_url / tenant_db_ready 欄位
 from api.services.tenant_bootstrap import ensure_tenant_schema
+from api.tenant_meta import invalidate_tenant_meta, secret_code_map
 
 router = APIRouter()
 
@@ -195,6 +196,7 @@ def register(req: RegisterRequest, db: Session = Depends(get_db)):
     db.add(user)
     db.commit()
     db.refresh(user)
+    secret_code_map.invalidate()  # 新暗號立即可用
 
     # === 立刻建立 tenant schema，並把 URL/READY 寫回 login_users ===
     try:
@@ -217,6 +219,7 @@ def register(req: RegisterRequest, db: Session = Depends(get_db)):
             {"url": tenant_url, "cid": user.client_id}
         )
         db.commit()
+        invalidate_tenant_meta(user.client_id)
 
     except Exception:
         db.rollback()
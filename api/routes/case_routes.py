@@ -1,22 +1,25 @@
 # api/routes/case_routes.py
 from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, select
 from typing import Optional, Dict, Any
 from datetime import datetime
 
-from api.database import get_db
-from api.models_control import ClientLineUsers, LoginUser, get_tenant_engine
+from api.database import get_async_db
+from api.models_control import ClientLineUsers, get_tenant_engine
+from api.tenant_meta import get_tenant_meta
+from api.services.case_lookup import case_lookup_cache
 
 router = APIRouter(prefix="/api", tags=["cases"])
 
 # ---- helpers ---------------------------------------------------------------
 
-def _ensure_lawyer(db: Session, line_user_id: str) -> str:
+async def _ensure_lawyer(db: AsyncSession, line_user_id: str) -> str:
     """回傳該 LINE 使用者的 client_id；若不是律師則 403。"""
-    clu = db.query(ClientLineUsers).filter(
-        ClientLineUsers.line_user_id == line_user_id
-    ).first()
+    clu = (await db.execute(
+        select(ClientLineUsers).where(ClientLineUsers.line_user_id == line_user_id).limit(1)
+    )).scalars().first()
     if not clu:
         raise HTTPException(403, detail="not bound to any firm")
     role = (getattr(clu, "role", "") or "").lower()
@@ -28,9 +31,9 @@ def _ensure_lawyer(db: Session, line_user_id: str) -> str:
         raise HTTPException(400, detail="client_id missing")
     return str(client_id)
 
-def _get_tenant_db_url(db: Session, client_id: str) -> str:
-    rec = db.query(LoginUser).filter(LoginUser.client_id == client_id).first()
-    url = getattr(rec, "tenant_db_url", None) if rec else None
+def _get_tenant_db_url(client_id: str) -> str:
+    meta = get_tenant_meta(client_id)
+    url = meta.tenant_db_url if meta else None
     if not url:
         raise HTTPException(404, detail="tenant_db_url not found")
     # Heroku 可能是 postgres:// 要轉 sqlalchemy 可用
@@ -47,39 +50,14 @@ def _extract_case_no(text_msg: str) -> Optional[str]:
     m = re.search(r"([A-Za-z0-9]{4,})", text_msg)
     return m.group(1) if m else None
 
-def _row_to_dict(row) -> Dict[str, Any]:
-    if row is None:
-        return {}
-    if isinstance(row, dict):
-        return row
-    try:
-        return dict(row._mapping)
-    except Exception:
-        return dict(row)
-
 def _format_dt(v: Any) -> str:
     if isinstance(v, (datetime, )):
         return v.strftime("%Y-%m-%d %H:%M")
     return str(v)
 
-def _find_case(engine, case_no: str) -> Dict[str, Any]:
-    """偵測 case_records 的欄位，優先用 case_no/case_number/case_id 其一查資料。"""
-    with engine.begin() as conn:
-        cols = conn.execute(text("""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_name='case_records'
-        """)).fetchall()
-        colnames = [c[0].lower() for c in cols]
-        # 找可用的案號欄位
-        candidates = [c for c in ["case_no", "case_number", "caseid", "case_id"] if c in colnames]
-        if not candidates:
-            # 退而求其次，直接撈一列
-            row = conn.execute(text("SELECT * FROM case_records LIMIT 1")).first()
-            return _row_to_dict(row) if row else {}
-        key = candidates[0]
-        row = conn.execute(text(f"SELECT * FROM case_records WHERE {key} = :v LIMIT 1"), {"v": case_no}).first()
-        return _row_to_dict(row) if row else {}
+def _find_case(engine, case_no: str, client_id: str) -> Dict[str, Any]:
+    """以租戶快取的欄位/語句查案號（case_no/case_number/caseid/case_id 其一）。"""
+    return case_lookup_cache.find(engine, client_id, case_no)
 
 def _compose_message(d: Dict[str, Any], case_no: str) -> str:
     if not d:
@@ -103,8 +81,14 @@ def _compose_message(d: Dict[str, Any], case_no: str) -> str:
 
 # ---- route ----------------------------------------------------------------
 
+def _search_tenant_case(client_id: str, case_no: str) -> Dict[str, Any]:
+    """租戶 engine 仍為同步：整段放進 threadpool，避免卡住 event loop。"""
+    tenant_db_url = _get_tenant_db_url(client_id)
+    engine = get_tenant_engine(client_id, tenant_db_url)
+    return _find_case(engine, case_no, client_id)
+
 @router.post("/lawyer/case-search")
-async def lawyer_case_search(req: Request, db: Session = Depends(get_db)):
+async def lawyer_case_search(req: Request, db: AsyncSession = Depends(get_async_db)):
     payload = await req.json()
     text_msg = (payload.get("text") or "").strip()
     line_user_id = payload.get("line_user_id") or payload.get("user_id")
@@ -116,13 +100,9 @@ async def lawyer_case_search(req: Request, db: Session = Depends(get_db)):
     if not case_no:
         return {"ok": False, "message": "請輸入格式：查案 <案件編號>，例如：查案 114001"}
 
-    # 驗證律師 & 找到 tenant
-    client_id = _ensure_lawyer(db, line_user_id)
-    tenant_db_url = _get_tenant_db_url(db, client_id)
-    engine = get_tenant_engine(client_id, tenant_db_url)
-
-    # 查資料
-    row_dict = _find_case(engine, case_no)
+    # 驗證律師（async 控制庫）& 查租戶資料（同步 engine → threadpool）
+    client_id = await _ensure_lawyer(db, line_user_id)
+    row_dict = await run_in_threadpool(_search_tenant_case, client_id, case_no)
     message = _compose_message(row_dict, case_no)
 
     return {"ok": True, "message": message, "case": row_dict, "case_no": case_no}
@@ -1,15 +1,23 @@
 # api/routes/case_upload_routes.py
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy import Table, Column, BigInteger, Text, JSON, TIMESTAMP, MetaData
 from api.database import ENGINE
+from api.schema_registry import schema_registry
+from api.case_partitions import PARENT, PARTITIONED_CONFLICT_COLS, ensure_case_partition, is_partitioned
+from api.services.case_list_cache import case_list_cache, names_in, prior_names
 from datetime import datetime
+import io
+import json
+import logging
+import os
 import re
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 metadata = MetaData()
 
 class CaseItem(BaseModel):
@@ -57,9 +65,24 @@ def _coerce_dt(s: Optional[str]) -> Optional[datetime]:
     except Exception:
         return None  # 不可解析就寫 NULL，避免 500
 
-def _get_or_create_table(tbl_name: str) -> Table:
-    # 定義表（每租戶同樣結構）
-    tbl = Table(
+def _get_or_create_table(tbl_name: str, client_id: Optional[str] = None) -> Table:
+    # 定義表（每租戶同樣結構）；已定義過就直接重用
+    tbl = metadata.tables.get(tbl_name)
+    if tbl is None:
+        tbl = _define_table(tbl_name)
+    # 建表/補索引每個程序只做一次（由 schema_registry 快取）
+    schema_registry.ensure(ENGINE, f"case_upload_table:{tbl_name}", lambda: _create_table(tbl), tag=client_id)
+    return tbl
+
+def _shared_table() -> Table:
+    # 分割後的共用 case_records：欄位以資料庫為準（反射一次後重用）
+    tbl = metadata.tables.get(PARENT)
+    if tbl is None:
+        tbl = Table(PARENT, metadata, autoload_with=ENGINE)
+    return tbl
+
+def _define_table(tbl_name: str) -> Table:
+    return Table(
         tbl_name, metadata,
         Column("id", BigInteger, primary_key=True, autoincrement=True),
         Column("case_id", Text, nullable=True),
@@ -81,6 +104,9 @@ def _get_or_create_table(tbl_name: str) -> Table:
         Column("updated_at", TIMESTAMP(timezone=True), server_default=text("NOW()")),
         extend_existing=True,
     )
+
+def _create_table(tbl: Table) -> None:
+    tbl_name = tbl.name
     metadata.create_all(ENGINE, tables=[tbl])
 
     # 確保唯一索引存在（ON CONFLICT 需要唯一/排他約束）
@@ -96,70 +122,205 @@ def _get_or_create_table(tbl_name: str) -> Table:
           END IF;
         END $$;
         """))
-    return tbl
+
+# ---- 寫入策略 ----
+# 筆數達門檻時走 COPY → 暫存表 → 單一 INSERT ... SELECT ... ON CONFLICT（set-based merge）
+COPY_MIN_ROWS = int(os.getenv("CASE_UPLOAD_COPY_MIN_ROWS", "50"))
+
+_VALUE_COLS = [
+    "case_id", "case_type", "client", "lawyer", "legal_affairs", "progress", "case_reason",
+    "case_number", "opposing_party", "court", "division", "progress_date",
+    "progress_stages", "progress_notes", "progress_times",
+]
+_JSON_COLS = {"progress_stages", "progress_notes", "progress_times"}
+_UPDATE_COLS = [c for c in _VALUE_COLS if c != "case_id"]
+
+def _item_to_values(item: CaseItem, client_id: Optional[str] = None) -> Dict[str, Any]:
+    """client_id 有值代表寫入分割後的共用 case_records（欄位型別與每租戶表不同）。"""
+    row = item.dict()
+    if client_id:
+        return {
+            **_item_to_values(item),
+            "client_id": client_id,
+            "case_type": row.get("case_type") or "",  # 共用表 case_type 為 NOT NULL
+            "progress_date": (str(row.get("progress_date")).strip() or None) if row.get("progress_date") else None,
+        }
+    return {
+        "case_id": (row.get("case_id") or row.get("case_number") or "").strip() or None,
+        "case_type": row.get("case_type"),
+        "client": row.get("client"),
+        "lawyer": row.get("lawyer"),
+        "legal_affairs": row.get("legal_affairs"),
+        "progress": row.get("progress"),
+        "case_reason": row.get("case_reason"),
+        "case_number": row.get("case_number"),
+        "opposing_party": row.get("opposing_party"),
+        "court": row.get("court"),
+        "division": row.get("division"),
+        "progress_date": _coerce_dt(row.get("progress_date")),
+        "progress_stages": row.get("progress_stages") or {},
+        "progress_notes": row.get("progress_notes") or {},
+        "progress_times": row.get("progress_times") or {},
+    }
+
+def _merge_rows_per_statement(conn, tbl: Table, rows: List[Tuple[int, Dict[str, Any]]],
+                              partitioned: bool = False) -> Tuple[int, List[str]]:
+    """逐筆 upsert（小批次或 COPY 失敗時的退路）；每筆包 SAVEPOINT，單筆失敗不影響其他筆。"""
+    success = 0
+    errors: List[str] = []
+    for i, values in rows:
+        try:
+            stmt = pg_insert(tbl).values(**values)
+            if partitioned:
+                # 共用表唯一鍵為 (client_id, case_type, case_id)，case_id 不可為空
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=PARTITIONED_CONFLICT_COLS,
+                    set_={**{c: stmt.excluded[c] for c in _UPDATE_COLS if c != "case_type"},
+                          "updated_at": text("NOW()")},
+                )
+            else:
+                # 以 case_id 當唯一鍵更新（case_id 可能為 NULL，則行為是插入）
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["case_id"],
+                    index_where=text("case_id IS NOT NULL"),
+                    set_={**{c: stmt.excluded[c] for c in _UPDATE_COLS}, "updated_at": text("NOW()")},
+                )
+            with conn.begin_nested():
+                conn.execute(stmt)
+            success += 1
+        except Exception as e:
+            errors.append(f"#{i} {repr(e)}")
+    return success, errors
+
+def _copy_escape(v: Any) -> str:
+    """COPY text 格式：NULL 為 \\N，並跳脫反斜線、tab、換行。"""
+    if v is None:
+        return "\\N"
+    if isinstance(v, datetime):
+        v = v.isoformat()
+    elif isinstance(v, (dict, list)):
+        v = json.dumps(v, ensure_ascii=False)
+    else:
+        v = str(v)
+    return v.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+def _merge_rows_copy(conn, tbl_name: str, rows: List[Tuple[int, Dict[str, Any]]],
+                     client_id: Optional[str] = None) -> int:
+    """
+    COPY 到暫存表，再以一個 INSERT ... SELECT ... ON CONFLICT 合併。
+    同一批內 case_id 重複時以最後一筆為準（與逐筆寫入的最終結果相同）。
+    client_id 有值代表目標是分割後的共用 case_records。
+    """
+    stage_cols = ["_ord"] + _VALUE_COLS
+    conn.execute(text("""
+        CREATE TEMP TABLE IF NOT EXISTS _case_upload_stage (
+            _ord BIGINT, case_id TEXT, case_type TEXT, client TEXT, lawyer TEXT, legal_affairs TEXT,
+            progress TEXT, case_reason TEXT, case_number TEXT, opposing_party TEXT, court TEXT,
+            division TEXT, progress_date TEXT,
+            progress_stages TEXT, progress_notes TEXT, progress_times TEXT
+        ) ON COMMIT DROP
+    """))
+
+    buf = io.StringIO()
+    for i, values in rows:
+        buf.write("\t".join([str(i)] + [_copy_escape(values[c]) for c in _VALUE_COLS]))
+        buf.write("\n")
+    buf.seek(0)
+    # 與 SQLAlchemy 同一條連線/交易，直接用 psycopg2 的 copy_expert
+    with conn.connection.dbapi_connection.cursor() as cur:
+        cur.copy_expert(f"COPY _case_upload_stage ({', '.join(stage_cols)}) FROM STDIN", buf)
+
+    if client_id:
+        # 共用表：progress_date 存字串、JSON 欄位為 jsonb；唯一鍵含 client_id / case_type
+        insert_cols = ["client_id"] + _VALUE_COLS
+        select_cols = ", ".join([":cid"] + [f"{c}::jsonb" if c in _JSON_COLS else c for c in _VALUE_COLS])
+        update_set = ", ".join(f"{c} = EXCLUDED.{c}" for c in _UPDATE_COLS if c != "case_type")
+        conn.execute(text(f"""
+            INSERT INTO {PARENT} ({", ".join(insert_cols)})
+            SELECT {select_cols} FROM (
+                SELECT DISTINCT ON (case_type, case_id) * FROM _case_upload_stage
+                WHERE case_id IS NOT NULL
+                ORDER BY case_type, case_id, _ord DESC
+            ) latest
+            ON CONFLICT (client_id, case_type, case_id)
+            DO UPDATE SET {update_set}, updated_at = NOW()
+        """), {"cid": client_id})
+        # case_id 為空的列在呼叫端已剔除
+        conn.execute(text("DROP TABLE _case_upload_stage"))
+        return len(rows)
+
+    select_cols = ", ".join(
+        f"{c}::json" if c in _JSON_COLS else ("progress_date::timestamptz" if c == "progress_date" else c)
+        for c in _VALUE_COLS
+    )
+    update_set = ", ".join(f"{c} = EXCLUDED.{c}" for c in _UPDATE_COLS)
+    conn.execute(text(f"""
+        INSERT INTO {tbl_name} ({", ".join(_VALUE_COLS)})
+        SELECT {select_cols} FROM (
+            SELECT DISTINCT ON (case_id) * FROM _case_upload_stage
+            WHERE case_id IS NOT NULL
+            ORDER BY case_id, _ord DESC
+        ) latest
+        ON CONFLICT (case_id) WHERE case_id IS NOT NULL
+        DO UPDATE SET {update_set}, updated_at = NOW()
+    """))
+    conn.execute(text(f"""
+        INSERT INTO {tbl_name} ({", ".join(_VALUE_COLS)})
+        SELECT {select_cols} FROM _case_upload_stage WHERE case_id IS NULL
+    """))
+    conn.execute(text("DROP TABLE _case_upload_stage"))
+    return len(rows)
 
 @router.post("/api/cases/upload")
-def upload_cases(payload: UploadPayload, request: Request):
+def upload_cases(payload: UploadPayload, request: Request, mode: Optional[str] = None):
+    """
+    mode: None=依筆數自動選擇；"copy"=強制 COPY 合併；"row"=逐筆 upsert
+    """
     client_id = payload.client_id.strip()
     if not client_id:
         raise HTTPException(status_code=400, detail="client_id is required")
 
-    tbl_name = _tenant_table_name(client_id)
-    tbl = _get_or_create_table(tbl_name)
+    # 已執行 partition_case_records.py → 寫入共用 case_records 的租戶分割；否則沿用每租戶表
+    partitioned = is_partitioned(ENGINE)
+    if partitioned:
+        ensure_case_partition(ENGINE, client_id)
+        tbl_name, tbl = PARENT, _shared_table()
+    else:
+        tbl_name = _tenant_table_name(client_id)
+        tbl = _get_or_create_table(tbl_name, client_id)
 
-    success = 0
-    failed = 0
     errors: List[str] = []
+    rows: List[Tuple[int, Dict[str, Any]]] = []
+    for i, item in enumerate(payload.items, start=1):
+        try:
+            values = _item_to_values(item, client_id if partitioned else None)
+            if partitioned and not values["case_id"]:
+                raise ValueError("case_id 為必填")
+            rows.append((i, values))
+        except Exception as e:
+            errors.append(f"#{i} {repr(e)}")
 
+    use_copy = mode == "copy" or (mode != "row" and len(rows) >= COPY_MIN_ROWS)
+    success = 0
+    names = set()
     with ENGINE.begin() as conn:
-        for i, item in enumerate(payload.items, start=1):
+        if partitioned and rows:
+            # 共用 case_records 才會影響 /api/user/my-cases 的快取
+            names = prior_names(conn, (v["case_id"] for _, v in rows)) | names_in(v for _, v in rows)
+        if use_copy and rows:
             try:
-                row = item.dict()
-
-                values = {
-                    "case_id": (row.get("case_id") or row.get("case_number") or "").strip() or None,
-                    "case_type": row.get("case_type"),
-                    "client": row.get("client"),
-                    "lawyer": row.get("lawyer"),
-                    "legal_affairs": row.get("legal_affairs"),
-                    "progress": row.get("progress"),
-                    "case_reason": row.get("case_reason"),
-                    "case_number": row.get("case_number"),
-                    "opposing_party": row.get("opposing_party"),
-                    "court": row.get("court"),
-                    "division": row.get("division"),
-                    "progress_date": _coerce_dt(row.get("progress_date")),
-                    "progress_stages": row.get("progress_stages") or {},
-                    "progress_notes": row.get("progress_notes") or {},
-                    "progress_times": row.get("progress_times") or {},
-                }
-
-                stmt = pg_insert(tbl).values(**values)
-                # 以 case_id 當唯一鍵更新（case_id 可能為 NULL，則行為是插入）
-                stmt = stmt.on_conflict_do_update(
-                    index_elements=["case_id"],
-                    set_={
-                        "case_type": stmt.excluded.case_type,
-                        "client": stmt.excluded.client,
-                        "lawyer": stmt.excluded.lawyer,
-                        "legal_affairs": stmt.excluded.legal_affairs,
-                        "progress": stmt.excluded.progress,
-                        "case_reason": stmt.excluded.case_reason,
-                        "case_number": stmt.excluded.case_number,
-                        "opposing_party": stmt.excluded.opposing_party,
-                        "court": stmt.excluded.court,
-                        "division": stmt.excluded.division,
-                        "progress_date": stmt.excluded.progress_date,
-                        "progress_stages": stmt.excluded.progress_stages,
-                        "progress_notes": stmt.excluded.progress_notes,
-                        "progress_times": stmt.excluded.progress_times,
-                        "updated_at": text("NOW()"),
-                    }
-                )
-                conn.execute(stmt)
-                success += 1
+                with conn.begin_nested():
+                    success = _merge_rows_copy(conn, tbl_name, rows, client_id if partitioned else None)
             except Exception as e:
-                failed += 1
-                errors.append(f"#{i} {repr(e)}")
+                # 整批合併失敗（例如某筆型別錯誤）→ 退回逐筆，以取得每筆成功/失敗
+                logger.warning(f"cases.upload COPY 合併失敗，改逐筆寫入: {e!r}")
+                use_copy = False
+        if not use_copy:
+            ok, row_errors = _merge_rows_per_statement(conn, tbl, rows, partitioned)
+            success = ok
+            errors.extend(row_errors)
+    case_list_cache.invalidate(names)
 
+    failed = len(payload.items) - success
+    errors.sort(key=lambda e: int(e.split(" ", 1)[0][1:]))
     return {"summary": {"total": success + failed, "success": success, "failed": failed}, "errors": errors}
@@ -1,13 +1,21 @@
 # case_upsert_routes.py（重點片段，可覆蓋）
 # -*- coding: utf-8 -*-
+import json
 import os
-from typing import List, Dict, Any, Union, Optional
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel, Field
+import uuid
+from typing import List, Dict, Any, Union, Optional, Set, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 from sqlalchemy.dialects.postgresql import insert
+from starlette.concurrency import run_in_threadpool
 from api.database import get_db
 from api.models_cases import CaseRecord  # ← 你的 CaseRecord
+from api.case_partitions import conflict_columns, ensure_case_partitions
+from api.schema_registry import schema_registry
+from api.services.case_list_cache import case_list_cache, names_in, prior_names
 
 router = APIRouter(prefix="/api/cases", tags=["cases"])
 
@@ -62,8 +70,34 @@ def _normalize_row(d: Dict[str, Any]) -> Dict[str, Any]:
     # ✅ 自動補上 client_id（若欄位存在且來自環境變數）
     if "client_id" in keep and not x.get("client_id") and TENANT_ID:
         x["client_id"] = TENANT_ID
+    # client_id 是唯一鍵的一部分；NULL 在唯一鍵中互不相等，會重複寫入同一案件
+    if not x.get("client_id"):
+        raise ValueError("client_id 為必填")
     return x
 
+def _upsert_rows(db: Session, rows: List[Dict[str, Any]]) -> Set[str]:
+    """
+    單一 INSERT ... ON CONFLICT；不 commit。呼叫前須先 ensure_case_partitions。
+    回傳受影響的當事人/對造姓名（含更新前），commit 後交給 case_list_cache 作廢。
+    """
+    key_cols = conflict_columns(db.get_bind())
+    names = prior_names(db, (r.get("case_id") for r in rows)) | names_in(rows)
+
+    stmt = insert(CaseRecord).values(rows)
+
+    # 衝突時要更新的欄位（❗不更新主鍵/唯一鍵本身）
+    exclude = {"id", *key_cols}
+    update_cols = {c.name: stmt.excluded[c.name]
+                   for c in CaseRecord.__table__.columns
+                   if c.name not in exclude}
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=key_cols,
+        set_=update_cols,
+    )
+    db.execute(stmt)
+    return names
+
 @router.post("/upsert")
 def upsert_cases(payload: Union[List[CaseUpsertIn], CaseUpsertIn], db: Session = Depends(get_db)):
     # 統一轉 list
@@ -76,22 +110,220 @@ def upsert_cases(payload: Union[List[CaseUpsertIn], CaseUpsertIn], db: Session =
         d = p.model_dump(exclude_none=True)
         if not d.get("case_type") or not d.get("case_id"):
             raise HTTPException(status_code=400, detail="case_type 與 case_id 為必填")
-        rows.append(_normalize_row(d))
+        try:
+            rows.append(_normalize_row(d))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-    stmt = insert(CaseRecord).values(rows)
+    # 分割佈局下先確保各租戶分割存在（每個程序只建一次）
+    ensure_case_partitions(db.get_bind(), (r.get("client_id") for r in rows))
+    names = _upsert_rows(db, rows)
+    db.commit()
+    case_list_cache.invalidate(names)
 
-    # 衝突時要更新的欄位（❗不更新主鍵/唯一鍵本身）
-    exclude = {"id", "case_type", "case_id"}
-    update_cols = {c.name: stmt.excluded[c.name]
-                   for c in CaseRecord.__table__.columns
-                   if c.name not in exclude}
+    return {"ok": True, "total": len(rows), "uploaded": len(rows), "failed": 0}
 
-    stmt = stmt.on_conflict_do_update(
-        index_elements=[CaseRecord.case_type, CaseRecord.case_id],
-        set_=update_cols,
-    )
+# ---- NDJSON 串流 upsert（application/x-ndjson，一行一筆案件）----
+# 邊讀邊解析，每 chunk_size 筆 upsert 並 commit 一次；游標與資料在同一交易內前進，
+# 連線中斷後以 upload_id 查詢游標，從該行繼續送即可（已 commit 的行會被略過）。
+NDJSON_CHUNK_ROWS = int(os.getenv("CASE_UPSERT_CHUNK_ROWS", "500"))
+NDJSON_MAX_ERRORS = 50  # 回應中最多列出幾筆錯誤（只保留這麼多，其餘只計數）
+NDJSON_MAX_LINE_BYTES = int(os.getenv("CASE_UPSERT_MAX_LINE_KB", "1024")) * 1024  # 單行上限；超過的行視為錯誤丟棄
+CURSOR_TTL_HOURS = int(os.getenv("CASE_UPSERT_CURSOR_TTL_HOURS", "72"))
 
-    db.execute(stmt)
+def create_cursor_table(engine: Engine) -> None:
+    """部署時執行（api/scripts/migrate.py 的 case_upsert_cursors 步驟）"""
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS case_upsert_cursors (
+                upload_id  TEXT PRIMARY KEY,
+                next_line  BIGINT NOT NULL DEFAULT 0,
+                uploaded   BIGINT NOT NULL DEFAULT 0,
+                failed     BIGINT NOT NULL DEFAULT 0,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+        """))
+
+def _cursor_table_exists(engine: Engine) -> bool:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT to_regclass('case_upsert_cursors') IS NOT NULL")).scalar()
+
+def _require_cursor_table(db: Session) -> None:
+    engine = db.get_bind()
+    schema_registry.require(engine, "case_upsert_cursors", lambda: _cursor_table_exists(engine),
+                            "case_upsert_cursors")
+
+def _open_cursor(db: Session, upload_id: str) -> Dict[str, int]:
+    """取得（或建立）上傳游標；順便清掉過期的游標。"""
+    _require_cursor_table(db)
+    row = db.execute(text("""
+        INSERT INTO case_upsert_cursors (upload_id) VALUES (:id)
+        ON CONFLICT (upload_id) DO UPDATE SET updated_at = NOW()
+        RETURNING next_line, uploaded, failed
+    """), {"id": upload_id}).fetchone()
+    db.execute(text("DELETE FROM case_upsert_cursors WHERE updated_at < NOW() - make_interval(hours => :h)"),
+               {"h": CURSOR_TTL_HOURS})
     db.commit()
+    return {"next_line": row[0], "uploaded": row[1], "failed": row[2]}
 
-    return {"ok": True, "total": len(rows), "uploaded": len(rows), "failed": 0}
+def _dedup_rows(rows: List[Tuple[int, Dict[str, Any]]], key_cols: List[str]) -> List[Tuple[int, Dict[str, Any]]]:
+    # 同一個 INSERT 內重複的鍵會讓 ON CONFLICT 報錯；保留最後一筆（與逐筆寫入結果相同）
+    latest: Dict[tuple, Tuple[int, Dict[str, Any]]] = {}
+    for line_no, r in rows:
+        latest[tuple(r.get(c) for c in key_cols)] = (line_no, r)
+    return list(latest.values())
+
+def _note_error(errors: List[Tuple[int, str]], line_no: int, message: str) -> None:
+    if len(errors) < NDJSON_MAX_ERRORS:
+        errors.append((line_no, message))
+
+def _commit_chunk(db: Session, upload_id: str, rows: List[Tuple[int, Dict[str, Any]]],
+                  next_line: int, invalid: int, errors: List[Tuple[int, str]]) -> Tuple[int, int]:
+    """
+    寫入一個 chunk 並把游標推進到 next_line（同一交易）。
+    整批失敗時改逐筆（SAVEPOINT）以找出壞資料，其餘照常寫入。回傳 (成功, 失敗)。
+    """
+    ok = failed = 0
+    names: Set[str] = set()
+    if rows:
+        ensure_case_partitions(db.get_bind(), (r.get("client_id") for _, r in rows))
+        try:
+            names = _upsert_rows(db, [r for _, r in _dedup_rows(rows, conflict_columns(db.get_bind()))])
+            ok = len(rows)
+        except Exception:
+            db.rollback()
+            for line_no, r in rows:
+                try:
+                    with db.begin_nested():
+                        names |= _upsert_rows(db, [r])
+                    ok += 1
+                except Exception as e:
+                    failed += 1
+                    _note_error(errors, line_no, repr(getattr(e, "orig", e)))
+    db.execute(text("""
+        UPDATE case_upsert_cursors
+        SET next_line = :n, uploaded = uploaded + :ok, failed = failed + :f, updated_at = NOW()
+        WHERE upload_id = :id
+    """), {"n": next_line, "ok": ok, "f": failed + invalid, "id": upload_id})
+    db.commit()
+    case_list_cache.invalidate(names)
+    return ok, failed
+
+async def _iter_lines(request: Request, max_line: int = NDJSON_MAX_LINE_BYTES):
+    """
+    逐塊讀取 request body，切成行（不把整個 body 讀進記憶體）。
+    超過 max_line 的行不累積：丟棄到下一個換行為止，並以 None 回報（行號照算）。
+    """
+    buf = b""
+    dropping = False
+    async for chunk in request.stream():
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for line in lines:
+            if dropping or len(line) > max_line:
+                dropping = False
+                yield None
+            else:
+                yield line
+        if dropping or len(buf) > max_line:
+            dropping, buf = True, b""
+    if dropping:
+        yield None
+    elif buf:
+        yield buf
+
+def _parse_line(raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """空白行回傳 None；過長（raw 為 None）、格式或欄位錯誤丟 ValueError。"""
+    if raw is None:
+        raise ValueError(f"單行超過 {NDJSON_MAX_LINE_BYTES // 1024} KB 上限")
+    line = raw.strip()
+    if not line:
+        return None
+    try:
+        item = CaseUpsertIn.model_validate(json.loads(line))
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())) from e
+    except ValueError as e:
+        raise ValueError(f"JSON 格式錯誤：{e}") from e
+    return _normalize_row(item.model_dump(exclude_none=True))
+
+@router.post("/upsert/ndjson")
+async def upsert_cases_ndjson(
+    request: Request,
+    upload_id: Optional[str] = None,
+    start: int = Query(0, ge=0, description="本次 body 第一行的行號（從 0 起算）"),
+    chunk_size: int = Query(NDJSON_CHUNK_ROWS, ge=1, le=5000),
+    db: Session = Depends(get_db),
+):
+    ctype = request.headers.get("content-type", "")
+    if "ndjson" not in ctype and "jsonlines" not in ctype:
+        raise HTTPException(status_code=415, detail="Content-Type 須為 application/x-ndjson")
+
+    upload_id = (upload_id or "").strip() or uuid.uuid4().hex
+    state = await run_in_threadpool(_open_cursor, db, upload_id)
+    resume_from = state["next_line"]
+    if start > resume_from:
+        # 中間有行沒送到，不能直接接續
+        raise HTTPException(status_code=409, detail={"message": "start 超過已提交游標", "cursor": resume_from})
+
+    pending: List[Tuple[int, Dict[str, Any]]] = []
+    errors: List[Tuple[int, str]] = []
+    invalid = 0  # 尚未隨 chunk 記錄到游標的壞行數
+    seen = bad_lines = skipped = uploaded = failed = 0
+    cursor = max(start, resume_from)
+
+    idx = start - 1
+    async for raw in _iter_lines(request):
+        idx += 1
+        if idx < resume_from:
+            skipped += 1  # 先前已 commit
+            continue
+        try:
+            row = _parse_line(raw)
+        except ValueError as e:
+            invalid += 1
+            bad_lines += 1
+            failed += 1
+            _note_error(errors, idx + 1, str(e))
+            row = None
+        if row is not None:
+            seen += 1
+            pending.append((idx + 1, row))
+        if len(pending) >= chunk_size:
+            ok, bad = await run_in_threadpool(_commit_chunk, db, upload_id, pending, idx + 1, invalid, errors)
+            uploaded += ok
+            failed += bad
+            cursor = idx + 1
+            pending, invalid = [], 0
+
+    if idx + 1 > cursor:
+        ok, bad = await run_in_threadpool(_commit_chunk, db, upload_id, pending, idx + 1, invalid, errors)
+        uploaded += ok
+        failed += bad
+        cursor = idx + 1
+
+    errors.sort()
+    return {
+        "ok": failed == 0,
+        "upload_id": upload_id,
+        "cursor": cursor,               # 下一次要送的行號；連線中斷後從這裡繼續
+        "total": seen + bad_lines,      # 本次請求處理的非空白行
+        "uploaded": state["uploaded"] + uploaded,   # 此 upload_id 累計
+        "failed": state["failed"] + failed,
+        "skipped": skipped,
+        "errors": [f"line {n}: {msg}" for n, msg in errors],
+        "errors_omitted": failed - len(errors),   # 超過 NDJSON_MAX_ERRORS 未列出的錯誤數
+    }
+
+@router.get("/upsert/ndjson/{upload_id}")
+def get_upsert_cursor(upload_id: str, db: Session = Depends(get_db)):
+    """查詢已提交的游標（中斷後續傳用）。"""
+    _require_cursor_table(db)
+    row = db.execute(text(
+        "SELECT next_line, uploaded, failed, updated_at FROM case_upsert_cursors WHERE upload_id = :id"
+    ), {"id": upload_id}).fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="upload_id 不存在或已過期")
+    return {"upload_id": upload_id, "cursor": row[0], "uploaded": row[1], "failed": row[2],
+            "updated_at": row[3].isoformat() if row[3] else None}
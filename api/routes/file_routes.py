@@ -2,17 +2,60 @@
 # 放在 api/routes/file_routes.py 內，或合併到你現有的檔案上傳路由中
 
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Request
-from typing import Optional, Dict, Any
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
 from sqlalchemy.orm import Session
 from sqlalchemy import text, inspect
-import json, traceback
+import json, os, re, traceback, uuid
+
+from starlette.concurrency import run_in_threadpool
 
 from api.database import get_db
 from api.models_cases import CaseRecord
+from api.models_files import FileBlob, ensure_file_blobs
+from api.schema_registry import schema_registry
+from api.case_partitions import ensure_case_partition
+from api.services.case_list_cache import case_list_cache, names_in
+from api.services.file_store import (
+    DEDUP_VERIFY_MAX_BYTES, attach, attach_upload, find_content, key_in_use, normalize_sha256,
+)
+from api.services.storage import (
+    complete_presigned, delete_object, list_uploaded_parts, presign_parts,
+    presign_upload, s3_put_stream, sha256_of_object, tenant_key,
+)
 
 router = APIRouter(prefix="/api/files", tags=["files"])
 
 # ------- 小工具 -------
+_UNSAFE_NAME_RE = re.compile(r"[^\w.\-()]+")
+
+def _safe_filename(name: Optional[str]) -> str:
+    base = os.path.basename((name or "").replace("\\", "/")).strip()
+    return (_UNSAFE_NAME_RE.sub("_", base) or "file")[:200]
+
+def _object_key(case_id: Optional[str], filename: str) -> str:
+    """租戶前綴之後的路徑：<案件>/<uuid>/<檔名>"""
+    return f"{_safe_filename(str(case_id)) if case_id else '_unassigned'}/{uuid.uuid4().hex}/{filename}"
+
+def _record_blob(db: Session, *, client_id: str, case_id: Optional[str], filename: str, content_type: str,
+                 size: int, s3_key: str, sha256: Optional[str], uploaded_by: Optional[str],
+                 meta: Dict[str, Any]) -> FileBlob:
+    ensure_file_blobs(db.get_bind())
+    blob = FileBlob(
+        client_id=client_id,
+        case_id=str(case_id or ""),
+        filename=filename,
+        content_type=content_type,
+        size_bytes=size,
+        s3_key=s3_key,
+        sha256=sha256,
+        uploaded_by=uploaded_by,
+        meta=meta,
+    )
+    db.add(blob); db.commit(); db.refresh(blob)
+    return blob
+
 def _get(d: Dict[str, Any], *names: str):
     for n in names:
         if isinstance(d, dict) and n in d and d[n] not in (None, "", "null"):
@@ -22,6 +65,14 @@ def _get(d: Dict[str, Any], *names: str):
 def _ensure_case_table_and_columns(db: Session):
     try:
         engine = db.get_bind()
+        # inspect + ALTER 每個程序只做一次；tenant_bootstrap 會重新啟用
+        schema_registry.ensure(engine, "file_routes.case_records_columns",
+                               lambda: _check_case_table_and_columns(db, engine))
+    except Exception:
+        traceback.print_exc()
+
+def _check_case_table_and_columns(db: Session, engine):
+    try:
         insp = inspect(engine)
         if not insp.has_table("case_records"):
             CaseRecord.__table__.create(bind=engine, checkfirst=True)
@@ -47,13 +98,15 @@ def _ensure_case_table_and_columns(db: Session):
             db.execute(text("ALTER TABLE case_records ADD COLUMN updated_at timestamptz DEFAULT NOW()"))
         db.commit()
     except Exception:
-        traceback.print_exc()
+        db.rollback()
+        raise
 
 def _upsert_case(db: Session, payload: Dict[str, Any]):
     """最小實作：把案件資料 upsert 進 case_records"""
     _ensure_case_table_and_columns(db)
     cid = str(payload["client_id"])
     caseid = str(payload["case_id"])
+    ensure_case_partition(db.get_bind(), cid)
 
     obj = (
         db.query(CaseRecord)
@@ -63,7 +116,9 @@ def _upsert_case(db: Session, payload: Dict[str, Any]):
     )
 
     fields = {k: v for k, v in payload.items() if k not in ("client_id", "case_id") and v is not None}
+    names = names_in([fields])
     if obj:
+        names |= names_in([{"client": obj.client, "opposing_party": obj.opposing_party}])
         for k, v in fields.items():
             setattr(obj, k, v)
         db.add(obj); db.commit(); db.refresh(obj)
@@ -72,6 +127,7 @@ def _upsert_case(db: Session, payload: Dict[str, Any]):
         obj = CaseRecord(client_id=cid, case_id=caseid, **fields)
         db.add(obj); db.commit(); db.refresh(obj)
         action = "created"
+    case_list_cache.invalidate(names)
     return action, obj.id
 
 # ------- 串接在你的檔案上傳端點 -------
@@ -129,15 +185,215 @@ async def upload_file(
     else:
         print(">> files.upload no client_id/case_id found; skip case upsert")
 
-    # 3) 照你原有邏輯上傳檔案 (以下是示意；把它換成你的 S3 邏輯)
-    # ----------------------------------------------------------------
-    # s3_url = await your_own_upload_s3_function(file)  # 你的既有程式
-    # ----------------------------------------------------------------
+    # 3) 上傳 S3：從 UploadFile 的 spool 分段讀取，multipart 並行上傳，不把整個檔案讀進記憶體
+    if not cid:
+        raise HTTPException(status_code=400, detail="缺少 client_id，無法儲存檔案")
+    filename = _safe_filename(file.filename)
+    content_type = file.content_type or "application/octet-stream"
+    try:
+        stored = await run_in_threadpool(s3_put_stream, str(cid), _object_key(cno, filename), file.file, content_type)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=502, detail=f"檔案上傳失敗: {e}")
+
+    # 同事務所已有相同內容 → 直接參照，丟掉剛傳的暫存物件；否則搬到內容定址 key
+    blob, dedup = await run_in_threadpool(
+        lambda: attach_upload(
+            db, staged_key=stored.key, size=stored.size,
+            client_id=str(cid), sha256=stored.sha256, case_id=cno, filename=filename, content_type=content_type,
+            uploaded_by=_get(ci, "uploaded_by", "user_name", "username"),
+            meta={"etag": stored.etag, "parts": stored.parts, "original_filename": file.filename},
+        ))
+    if blob.s3_key != stored.key:
+        await run_in_threadpool(delete_object, stored.key)
 
     # 4) 回傳綜合結果（包含是否有 upsert 成功）
     return {
         "ok": True,
         "filename": file.filename,
-        # "s3_url": s3_url,
+        "file_id": blob.id,
+        "s3_url": f"s3://{stored.bucket}/{blob.s3_key}",
+        "size_bytes": stored.size,
+        "sha256": stored.sha256,
+        "dedup": dedup,
         "case_upsert": upsert_info,
     }
+
+
+# ------- 直傳：桌面端拿 presigned URL 直接 PUT 到 S3，API 不經手檔案內容 -------
+class PresignIn(BaseModel):
+    client_id: str
+    case_id: Optional[str] = None
+    filename: str
+    size: int = Field(ge=0)
+    content_type: Optional[str] = None
+    sha256: Optional[str] = Field(default=None, pattern=r"^[0-9a-fA-F]{64}$")
+
+class ResumeIn(BaseModel):
+    client_id: str
+    key: str
+    upload_id: str
+    size: int = Field(ge=0)
+    part_size: int = Field(gt=0)
+
+class PartIn(BaseModel):
+    part_number: int = Field(ge=1)
+    etag: str
+
+class CompleteIn(BaseModel):
+    client_id: str
+    case_id: Optional[str] = None
+    key: Optional[str] = None   # None：不上傳，直接參照同 sha256 的既有內容
+    filename: str
+    size: int = Field(ge=0)
+    content_type: Optional[str] = None
+    sha256: Optional[str] = Field(default=None, pattern=r"^[0-9a-fA-F]{64}$")
+    upload_id: Optional[str] = None
+    parts: Optional[List[PartIn]] = None
+    uploaded_by: Optional[str] = None
+
+@router.api_route("/by-hash/{sha256}", methods=["GET", "HEAD"])
+def content_by_hash(sha256: str, client_id: str, db: Session = Depends(get_db)):
+    """上傳前先問：同事務所已有這份內容就不必再傳（200），否則 404"""
+    sha = normalize_sha256(sha256)
+    if not sha:
+        raise HTTPException(status_code=400, detail="sha256 格式錯誤")
+    content = find_content(db, client_id, sha)
+    if content is None:
+        raise HTTPException(status_code=404, detail="not found")
+    return JSONResponse(
+        {"ok": True, "sha256": sha, "size_bytes": content.size_bytes, "content_type": content.content_type},
+        headers={"X-File-Size": str(content.size_bytes)},
+    )
+
+@router.post("/presign")
+async def presign(body: PresignIn, db: Session = Depends(get_db)):
+    filename = _safe_filename(body.filename)
+    content_type = body.content_type or "application/octet-stream"
+    sha = normalize_sha256(body.sha256)
+    # 有 sha256 且已有同內容 → 不發上傳網址，client 直接 complete（不帶 key）
+    if sha and find_content(db, body.client_id, sha) is not None:
+        return {"ok": True, "mode": "exists", "sha256": sha, "filename": filename, "content_type": content_type}
+    # 一律傳到這次上傳專屬的 key；內容定址 key 由 complete 驗證雜湊後才複製過去，client 寫不到共用物件
+    key = tenant_key(body.client_id, _object_key(body.case_id, filename))
+    try:
+        plan = await run_in_threadpool(presign_upload, key, body.size, content_type)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=502, detail=f"無法建立上傳網址: {e}")
+    return {"ok": True, "key": key, "filename": filename, "content_type": content_type, **plan}
+
+@router.post("/presign/resume")
+async def presign_resume(body: ResumeIn):
+    """續傳：回報 S3 已收到的分段，並替其餘分段重新簽網址；multipart 已不存在回 404（client 從頭來）"""
+    if not body.key.startswith(tenant_key(body.client_id, "")):
+        raise HTTPException(status_code=400, detail="key 與 client_id 不符")
+    count = -(-body.size // body.part_size)
+    try:
+        done = await run_in_threadpool(list_uploaded_parts, body.key, body.upload_id)
+        if done is None:
+            raise HTTPException(status_code=404, detail="上傳已失效，請重新上傳")
+        acked = {p["part_number"] for p in done}
+        todo = [n for n in range(1, count + 1) if n not in acked]
+        parts = await run_in_threadpool(presign_parts, body.key, body.upload_id, todo)
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=502, detail=f"無法續傳: {e}")
+    return {"ok": True, "key": body.key, "upload_id": body.upload_id, "part_size": body.part_size,
+            "done": [{"part_number": p["part_number"], "etag": p["etag"]} for p in done], "parts": parts}
+
+@router.post("/complete")
+async def complete(body: CompleteIn, db: Session = Depends(get_db)):
+    sha = normalize_sha256(body.sha256)
+    if body.key is None:
+        if not sha:
+            raise HTTPException(status_code=400, detail="缺少 key 或 sha256")
+        return await _complete_content(body, sha, db)
+
+    # key 必須是 presign 發出的格式：<租戶前綴>/<案件>/<uuid>/<檔名>
+    case_seg = _safe_filename(body.case_id) if body.case_id else "_unassigned"
+    prefix = tenant_key(body.client_id, f"{case_seg}/")
+    rest = body.key[len(prefix):] if body.key.startswith(prefix) else ""
+    if not re.fullmatch(r"[0-9a-f]{32}/[^/]+", rest):
+        raise HTTPException(status_code=400, detail="key 與 client_id / case_id 不符")
+
+    ensure_file_blobs(db.get_bind())
+    existing = db.query(FileBlob).filter(FileBlob.s3_key == body.key).first()
+    if existing:  # complete 重送
+        return {"ok": True, "file_id": existing.id, "size_bytes": existing.size_bytes, "sha256": existing.sha256}
+
+    info = await _finish_upload(body, db)
+    if sha and info["size"] <= DEDUP_VERIFY_MAX_BYTES:
+        return await _complete_content(body, sha, db, info)
+
+    # 沒有 sha256，或大到不在這裡重算 → 不去重，各自一份；client 回報的雜湊只記在 meta，不拿來共用
+    filename = body.key.rsplit("/", 1)[-1]
+    blob = _record_blob(
+        db, client_id=body.client_id, case_id=body.case_id, filename=filename,
+        content_type=info.get("content_type") or body.content_type or "application/octet-stream",
+        size=info["size"], s3_key=body.key, sha256=None,
+        uploaded_by=body.uploaded_by,
+        meta={"etag": info.get("etag"), "parts": len(body.parts or []), "original_filename": body.filename,
+              "direct": True, "client_sha256": sha},
+    )
+    return {"ok": True, "file_id": blob.id, "size_bytes": blob.size_bytes, "sha256": blob.sha256}
+
+async def _discard_upload(db: Session, client_id: str, key: str) -> None:
+    """刪掉這次上傳的物件；已被任何 file_contents / file_blobs 參照的 key 絕不刪"""
+    if not await run_in_threadpool(key_in_use, db, client_id, key):
+        await run_in_threadpool(delete_object, key)
+
+async def _finish_upload(body: CompleteIn, db: Session) -> Dict[str, Any]:
+    """完成 multipart / 確認物件存在且大小相符；不符就刪掉這次上傳的物件"""
+    try:
+        info = await run_in_threadpool(complete_presigned, body.key, body.upload_id,
+                                       [p.model_dump() for p in body.parts or []])
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=400, detail=f"完成上傳失敗: {e}")
+    if not info:
+        raise HTTPException(status_code=404, detail="找不到已上傳的檔案")
+    if info["size"] != body.size:
+        await _discard_upload(db, body.client_id, body.key)
+        raise HTTPException(status_code=400, detail=f"檔案大小不符（預期 {body.size}，實際 {info['size']}）")
+    return info
+
+async def _complete_content(body: CompleteIn, sha: str, db: Session, info: Optional[Dict[str, Any]] = None):
+    """info 為 None：不上傳，參照既有內容；否則 body.key 是已完成的專屬上傳，驗證後搬到內容定址 key"""
+    filename = _safe_filename(body.filename)
+    ensure_file_blobs(db.get_bind())
+    existing = (
+        db.query(FileBlob)
+          .filter(FileBlob.client_id == body.client_id, FileBlob.case_id == str(body.case_id or ""),
+                  FileBlob.sha256 == sha, FileBlob.filename == filename)
+          .first()
+    )
+    if existing:  # complete 重送，或同案件同檔名重複附加
+        if info is not None:
+            await _discard_upload(db, body.client_id, body.key)
+        return {"ok": True, "file_id": existing.id, "size_bytes": existing.size_bytes, "sha256": sha, "dedup": True}
+
+    meta = {"original_filename": body.filename, "direct": True}
+    args = dict(client_id=body.client_id, sha256=sha, case_id=body.case_id, filename=filename,
+                content_type=body.content_type, uploaded_by=body.uploaded_by)
+    if info is None:
+        blob = attach(db, meta={**meta, "dedup": True}, **args)
+        if blob is None:
+            raise HTTPException(status_code=404, detail="找不到相同內容，請重新上傳")
+        return {"ok": True, "file_id": blob.id, "size_bytes": blob.size_bytes, "sha256": sha, "dedup": True}
+
+    # 內容定址 key 會被其他案件共用，登錄前確認內容真的是這個 sha256
+    actual = await run_in_threadpool(sha256_of_object, body.key)
+    if actual != sha:
+        await _discard_upload(db, body.client_id, body.key)
+        raise HTTPException(status_code=400, detail="檔案內容與 sha256 不符")
+
+    args["content_type"] = info.get("content_type") or body.content_type
+    meta = {**meta, "etag": info.get("etag"), "parts": len(body.parts or [])}
+    blob, dedup = await run_in_threadpool(
+        lambda: attach_upload(db, staged_key=body.key, size=info["size"], meta=meta, **args))
+    if blob.s3_key != body.key:  # 已搬到內容定址 key 或沿用既有內容，這次的上傳物件多餘
+        await _discard_upload(db, body.client_id, body.key)
+    return {"ok": True, "file_id": blob.id, "size_bytes": blob.size_bytes, "sha256": sha, "dedup": dedup}
@@ -10,21 +10,12 @@ from typing import Optional, Dict, Any
 from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text, true
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.database import get_db
-
-# ---- 依你的專案模型命名導入（兩段 try 以增加容錯） ----
-try:
-    from api.models_control import LoginUser, ClientLineUsers,PendingLineUser
-except Exception:
-    # 若你的模型放在別處，這裡可再調整
-    from api.models_control import LoginUser, ClientLineUsers,PendingLineUser # type: ignore
-
-try:
-    from api.models_cases import CaseRecord
-except Exception:
-    CaseRecord = None  # type: ignore
+from api.database import get_db, get_async_db
+from api.services.line_identity import line_identity
+from api.services.seat_counter import bind_seat, get_seat_usage
+from api.tenant_meta import normalize_secret_code, secret_code_map
 
 # 若你的 DB 有 “律師綁定表” 可在 _get_role_by_line_id() 內擴充；此檔以一般用戶綁定為主
 
@@ -63,9 +54,12 @@ class BindUserResponse(BaseModel):
     available: Optional[int] = None
     message: Optional[str] = None
 
+MORE_KEYWORDS = ("查看更多", "更多", "下一頁")
+
 class CaseSearchIn(BaseModel):
     text: str
     line_user_id: Optional[str] = None
+    cursor: Optional[str] = None  # 上一頁回傳的 next_cursor
 
 
 # =============== Helpers ===============
@@ -81,30 +75,9 @@ def _normalize_text(s: Optional[str]) -> str:
 def _has_question(s: str) -> bool:
     return "?" in s or "？" in s
 
-def _get_state_by_line_id(db: Session, line_user_id: str) -> dict:
-    state = {"is_user": False, "is_lawyer": False, "in_pending": False}
-    if not line_user_id:
-        return state
-
-    clu = db.query(ClientLineUsers).filter(
-        ClientLineUsers.line_user_id == line_user_id,
-        func.coalesce(ClientLineUsers.is_active, true()) == true()
-    ).first()
-    if clu:
-        role_val = str(getattr(clu, "user_role", "")).upper()
-        if role_val == "LAWYER":
-            state["is_lawyer"] = True
-        else:
-            state["is_user"] = True
-
-    try:
-        q = db.query(PendingLineUser).filter(PendingLineUser.line_user_id == line_user_id)
-        if q.first():
-            state["in_pending"] = True
-    except Exception:
-        pass
-
-    return state
+async def _get_state_by_line_id(db: AsyncSession, line_user_id: str) -> dict:
+    # 綁定與 pending 狀態一次查詢取得（line_identity 短 TTL 快取）
+    return (await line_identity.resolve_async(db, line_user_id)).state()
 
 def _build_plan_message(title: str, client_name: str, plan_type: Optional[str], limit_val: Optional[int], usage_val: int) -> str:
     plan = plan_type or "未設定"
@@ -126,7 +99,7 @@ def verify_secret_ping():
 
 
 @router.post("/verify-secret", response_model=VerifySecretOut)
-async def verify_secret(request: Request, db: Session = Depends(get_db)):
+async def verify_secret(request: Request, db: AsyncSession = Depends(get_async_db)):
     """
     規則：
     - (已綁定一般用戶 OR 在 pending_line_users 內) 且 訊息包含 ?/？ => REGISTERED_USER
@@ -160,7 +133,7 @@ async def verify_secret(request: Request, db: Session = Depends(get_db)):
     debug = bool(payload.get("debug"))
 
     # 先取狀態
-    st = _get_state_by_line_id(db, line_user_id)
+    st = await _get_state_by_line_id(db, line_user_id)
     has_q = _has_question(text_in)
 
     # ===== A) 一般用戶 & pending 規則 =====
@@ -190,16 +163,11 @@ async def verify_secret(request: Request, db: Session = Depends(get_db)):
         }
 
     # ===== C) 其餘維持原本暗號/登入/使用者分流 =====
-    secret_rec = None
-    if text_in:
-        secret_rec = (
-            db.query(LoginUser)
-              .filter(func.btrim(LoginUser.secret_code) == text_in)
-              .first()
-        )
+    # 暗號比對走記憶體對照表（寫入時已正規化）；一般聊天訊息不查資料庫
+    secret_rec = await secret_code_map.lookup_async(text_in) if text_in else None
     is_secret = bool(secret_rec)
-    client_id_from_secret = getattr(secret_rec, "client_id", None) if secret_rec else None
-    client_name_from_secret = getattr(secret_rec, "client_name", None) if secret_rec else None
+    client_id_from_secret = secret_rec.client_id if secret_rec else None
+    client_name_from_secret = secret_rec.client_name if secret_rec else None
 
     # 是否已是律師（再次保險，若你要限制同事務所可加上 client_id 條件）
     is_lawyer = st["is_lawyer"]
@@ -227,7 +195,7 @@ async def verify_secret(request: Request, db: Session = Depends(get_db)):
         base = os.getenv("API_BASE_URL") or os.getenv("APP_BASE_URL") or ""
         if base:
             from urllib.parse import quote
-            bind_url = f"{base.rstrip('/')}/api/tenant/bind-user?code={quote(text_in)}"
+            bind_url = f"{base.rstrip('/')}/api/tenant/bind-user?code={quote(normalize_secret_code(text_in))}"
             if client_id_from_secret:
                 bind_url += f"&client_id={quote(str(client_id_from_secret))}"
 
@@ -248,84 +216,31 @@ async def verify_secret(request: Request, db: Session = Depends(get_db)):
 def bind_user(payload: BindUserRequest, db: Session = Depends(get_db)):
     """
     依方案上限綁定。
-    上限來源：LoginUser.user_limit / max_users（擇一存在）
+    上限來源：LoginUser.max_users；使用數：login_users.current_users（觸發器維護）
     綁定表：client_line_users（以 (client_id, line_user_id) upsert）
     """
     if not payload.success:
         return BindUserResponse(success=False, message="未執行綁定")
 
-    tenant = (
-        db.query(LoginUser)
-          .filter(LoginUser.client_id == payload.client_id, LoginUser.is_active.is_(True))
-          .first()
-    )
-    if not tenant:
+    # 鎖定事務所列、判斷上限、寫入綁定在同一語句內完成（併發綁定不會超賣）
+    result = bind_seat(db, payload.client_id, payload.user_id, payload.role)
+    seats = result.seats
+    if seats is None:
         return BindUserResponse(success=False, message="找不到事務所或未啟用")
 
-    client_id = tenant.client_id
-    client_name = tenant.client_name
-    plan_type = getattr(tenant, "plan_type", None)
-    limit_val = getattr(tenant, "user_limit", None) or getattr(tenant, "max_users", None)
-    limit_val = int(limit_val) if isinstance(limit_val, int) or (isinstance(limit_val, str) and limit_val.isdigit()) else None
-
-    # 當前啟用數（僅一般用戶，或全部：依你需求）
-    usage_before = db.query(func.count(ClientLineUsers.id)).filter(
-        ClientLineUsers.client_id == client_id,
-        ClientLineUsers.is_active.is_(True)
-    ).scalar() or 0
-    usage_before = int(usage_before)
-
-    # 若存在啟用綁定，視為已綁
-    existed = db.query(ClientLineUsers).filter(
-        ClientLineUsers.client_id == client_id,
-        ClientLineUsers.line_user_id == payload.user_id,
-        ClientLineUsers.is_active.is_(True)
-    ).first()
-    if existed:
-        msg = _build_plan_message("ℹ️ 已綁定", client_name, plan_type, limit_val, usage_before)
-        return BindUserResponse(
-            success=True, client_name=client_name, plan_type=plan_type,
-            limit=limit_val, usage=usage_before,
-            available=(None if limit_val is None else max(0, limit_val - usage_before)),
-            message=msg
-        )
-
-    # 方案額滿（若要區分 LAWYER/USER 可在此細分）
-    if limit_val is not None and usage_before >= limit_val:
-        msg = _build_plan_message("⚠️ 已額滿，需要升級方案", client_name, plan_type, limit_val, usage_before)
-        return BindUserResponse(
-            success=False, client_name=client_name, plan_type=plan_type,
-            limit=limit_val, usage=usage_before, available=0, message=msg
-        )
-
-    # Upsert
-    db.execute(text("""
-        INSERT INTO client_line_users (client_id, client_name, line_user_id, user_role, is_active, bound_at)
-        VALUES (:client_id, :client_name, :line_user_id, :role, TRUE, NOW())
-        ON CONFLICT (client_id, line_user_id)
-        DO UPDATE SET client_name = EXCLUDED.client_name,
-                      user_role   = EXCLUDED.user_role,
-                      is_active   = TRUE,
-                      bound_at    = NOW();
-    """), {
-        "client_id": client_id,
-        "client_name": client_name,
-        "line_user_id": payload.user_id,
-        "role": payload.role
-    })
-    db.commit()
-
-    usage_now = db.query(func.count(ClientLineUsers.id)).filter(
-        ClientLineUsers.client_id == client_id,
-        ClientLineUsers.is_active.is_(True)
-    ).scalar() or 0
-    usage_now = int(usage_now)
-
-    msg = _build_plan_message("🎉 綁定成功", client_name, plan_type, limit_val, usage_now)
+    if result.already:
+        title = "ℹ️ 已綁定"
+    elif result.bound:
+        title = "🎉 綁定成功"
+    else:
+        # 方案額滿（若要區分 LAWYER/USER 可在此細分）
+        title = "⚠️ 已額滿，需要升級方案"
+
+    msg = _build_plan_message(title, seats.client_name, seats.plan_type, seats.limit, seats.usage)
     return BindUserResponse(
-        success=True, client_name=client_name, plan_type=plan_type,
-        limit=limit_val, usage=usage_now,
-        available=(None if limit_val is None else max(0, limit_val - usage_now)),
+        success=result.already or result.bound,
+        client_name=seats.client_name, plan_type=seats.plan_type,
+        limit=seats.limit, usage=seats.usage, available=seats.available,
         message=msg
     )
 
@@ -356,75 +271,61 @@ async def check_client_plan(request: Request, db: Session = Depends(get_db)):
     if not client_name:
         return {"success": False, "message": "client_name_required"}
 
-    user = (
-        db.query(LoginUser)
-          .filter(func.btrim(LoginUser.client_name) == client_name)
-          .first()
-    )
-    if not user:
+    seats = get_seat_usage(db, client_name=client_name)
+    if not seats:
         return {"success": False, "client_name": client_name, "message": "client_not_found"}
 
-    plan_type = getattr(user, "plan_type", None)
-    limit_val = getattr(user, "user_limit", None) or getattr(user, "max_users", None)
-    limit_val = int(limit_val) if isinstance(limit_val, int) or (isinstance(limit_val, str) and limit_val.isdigit()) else None
-
-    usage_val = db.query(func.count(ClientLineUsers.id)).filter(
-        ClientLineUsers.client_id == user.client_id,
-        ClientLineUsers.is_active.is_(True)
-    ).scalar() or 0
-    usage_val = int(usage_val)
-
-    available = (None if limit_val is None else max(0, limit_val - usage_val))
-    msg = _build_plan_message("✅ 目前方案資訊", user.client_name, plan_type, limit_val, usage_val)
+    msg = _build_plan_message("✅ 目前方案資訊", seats.client_name, seats.plan_type, seats.limit, seats.usage)
     ok = True
-    if (limit_val is not None) and usage_val >= limit_val:
-        msg = _build_plan_message("⚠️ 已額滿，需要升級方案", user.client_name, plan_type, limit_val, usage_val)
+    if seats.is_full:
+        msg = _build_plan_message("⚠️ 已額滿，需要升級方案", seats.client_name, seats.plan_type, seats.limit, seats.usage)
         ok = False
 
     return {
         "success": ok,
-        "client_name": user.client_name,
-        "plan_type": plan_type,
-        "limit": limit_val,
-        "usage": usage_val,
-        "available": available,
+        "client_name": seats.client_name,
+        "plan_type": seats.plan_type,
+        "limit": seats.limit,
+        "usage": seats.usage,
+        "available": seats.available,
         "message": msg
     }
 
 
 @router.post("/case-search")
-def case_search(payload: CaseSearchIn, db: Session = Depends(get_db)):
-    from api.models_cases import CaseRecord
+async def case_search(payload: CaseSearchIn, db: AsyncSession = Depends(get_async_db)):
+    from api.services.case_search import recall_search, remember_search, search_cases
 
     key = (payload.text or "").strip()
+    cursor = payload.cursor
+    if key in MORE_KEYWORDS and not cursor:
+        last = recall_search(payload.line_user_id)
+        if not last:
+            return {"message": "沒有更多結果了，請重新輸入關鍵字或案號"}
+        key, cursor = last
     if not key:
         return {"message": "請輸入關鍵字或案號"}
 
-    # 允許用案號、案號欄位、當事人名稱搜尋；不再用 client_id
-    q = (
-        db.query(CaseRecord)
-          .filter(
-              (CaseRecord.case_id == key) |
-              (CaseRecord.case_number.ilike(f"%{key}%")) |
-              (CaseRecord.client.ilike(f"%{key}%"))
-          )
-          .order_by(text("updated_at DESC NULLS LAST"))
-          .limit(10)
-    )
-
-    rows = q.all()
-    if not rows:
-        return {"message": f"找不到符合「{key}」的案件"}
+    # 允許用案號、案號欄位、當事人/對造名稱搜尋；依相似度排序；不再用 client_id
+    page = await search_cases(db, key, cursor=cursor)
+    remember_search(payload.line_user_id, key, page.next_cursor)
+    if not page.rows:
+        if cursor:
+            return {"message": "沒有更多結果了", "next_cursor": None}
+        return {"message": f"找不到符合「{key}」的案件", "next_cursor": None}
 
     def fmt(r):
-        ct  = getattr(r, "case_type", None) or "-"
-        cid = getattr(r, "case_id", None) or "-"
-        num = getattr(r, "case_number", None) or "-"
-        cli = getattr(r, "client", None) or "-"
-        prog= getattr(r, "progress", None) or "-"
+        ct  = r.get("case_type") or "-"
+        cid = r.get("case_id") or "-"
+        num = r.get("case_number") or "-"
+        cli = r.get("client") or "-"
+        prog= r.get("progress") or "-"
         return f"{cli} / {ct} / {num or cid} / 進度:{prog}"
 
-    return {"message": "查到以下案件：\n" + "\n".join(fmt(r) for r in rows)}
+    message = "查到以下案件：\n" + "\n".join(fmt(r) for r in page.rows)
+    if page.next_cursor:
+        message += "\n（輸入「查看更多」顯示下一頁）"
+    return {"message": message, "next_cursor": page.next_cursor}
 
 # =============== /api/user 補充路由（供 main.py import router_user） ===============
 router_user = APIRouter(prefix="/api/user", tags=["user"])
@@ -1,21 +1,25 @@
 # api/routes/line_routes.py — normalized imports & behavior
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 import re
 
 from api.schemas.line import VerifySecretIn, VerifySecretOut, ResolveRouteIn, ResolveRouteOut
-from api.database import get_db
-from api.services.lawyer import _is_bound_to_lawyer, _lookup_client_by_code, _bind_line_user_to_client
+from api.database import get_db, get_async_db
+from api.services.lawyer import (
+    _is_bound_to_lawyer,
+    _lookup_client_by_code_async,
+    _bind_line_user_to_client_async,
+)
 from api.services.engagement_service import touch_and_check_idle, mark_reminded
 
 router = APIRouter()
 CASE_NO_RE = re.compile(r"^\s*\d{2,8}[/-]\d{1,6}\s*$")  # e.g., 114001 or 1234/5678
 
 @router.post("/lawyer/verify-secret", response_model=VerifySecretOut)
-def verify_secret(payload: VerifySecretIn, db: Session = Depends(get_db)):
+async def verify_secret(payload: VerifySecretIn, db: AsyncSession = Depends(get_async_db)):
     code = (payload.text or "").strip()
-    already_bound = _is_bound_to_lawyer(db, payload.line_user_id)
 
     if not code:
         return VerifySecretOut(
@@ -26,7 +30,7 @@ def verify_secret(payload: VerifySecretIn, db: Session = Depends(get_db)):
             message="請輸入暗號。"
         )
 
-    tenant = _lookup_client_by_code(db, code)
+    tenant = await _lookup_client_by_code_async(db, code)
     if not tenant:
         return VerifySecretOut(
             success=True,
@@ -36,7 +40,7 @@ def verify_secret(payload: VerifySecretIn, db: Session = Depends(get_db)):
             message="暗號錯誤。"
         )
 
-    _bind_line_user_to_client(db, payload.line_user_id, tenant)
+    await _bind_line_user_to_client_async(db, payload.line_user_id, tenant)
 
     return VerifySecretOut(
         success=True,
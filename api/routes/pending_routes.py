@@ -3,9 +3,6 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Optional, Literal
 from sqlalchemy.orm import Session
-from sqlalchemy import func, select, true
-# api/routes/pending_routes.py — ensure alias name exists
-from fastapi import APIRouter
 
 router = APIRouter()
 
@@ -18,9 +15,9 @@ from api.models_control import (
     PendingLineUser,
     track_pending_central,
     track_pending_in_tenant,
-    ClientLineUsers,   # 注意：複數
-    LoginUser,
 )
+from api.services.line_identity import LineIdentity, line_identity
+from api.tenant_meta import get_tenant_meta
 
 router = APIRouter(prefix="/api", tags=["pending"])
 
@@ -47,22 +44,21 @@ class PendingOut(BaseModel):
 
 # ====== 小工具 ======
 
-def _resolve_binding(db: Session, line_user_id: str) -> Optional[ClientLineUsers]:
+def _resolve_binding(db: Session, line_user_id: str) -> Optional[LineIdentity]:
     """查此 LINE 使用者是否已綁定於某事務所（client）。"""
-    return db.query(ClientLineUsers).filter(
-        ClientLineUsers.line_user_id == line_user_id
-    ).first()
+    ident = line_identity.resolve(db, line_user_id)
+    return ident if ident.bound else None
 
 
 def _get_tenant_conn_by_client(db: Session, client_id: str) -> tuple[str, Optional[str]]:
     """
     由 client_id 取得該租戶的資料庫連線字串與顯示名稱。
-    這裡示範從 login_users 取 tenant_db_url / client_name。
+    這裡示範從 login_users 取 tenant_db_url / client_name（經 TTL 快取）。
     """
-    rec: Optional[LoginUser] = db.query(LoginUser).filter(LoginUser.client_id == client_id).first()
-    if not rec or not getattr(rec, "tenant_db_url", None):
+    meta = get_tenant_meta(client_id)
+    if not meta or not meta.tenant_db_url:
         raise HTTPException(status_code=404, detail="tenant_db_url not found for client_id")
-    return rec.tenant_db_url, getattr(rec, "client_name", None)
+    return meta.tenant_db_url, meta.client_name
 
 
 # ====== 核心端點：/api/safe/pending/track ======
@@ -170,33 +166,4 @@ def _get_state_by_line_id(db: Session, line_user_id: str) -> dict:
       "in_pending": bool,  # 是否存在於 pending_line_users（白名單/準備中）
     }
     """
-    state = {"is_user": False, "is_lawyer": False, "in_pending": False}
-    if not line_user_id:
-        return state
-
-    # 1) client_line_users：已綁定（用 COALESCE 避免 boolean = integer）
-    clu = db.query(ClientLineUsers).filter(
-        ClientLineUsers.line_user_id == line_user_id,
-        func.coalesce(ClientLineUsers.is_active, true()) == true()
-    ).first()
-    if clu:
-        role_val = str(getattr(clu, "user_role", "")).upper()
-        if role_val == "LAWYER":
-            state["is_lawyer"] = True
-        else:
-            state["is_user"] = True
-
-    # 2) pending_line_users：存在於名單（若你的模型/表不同，這裡對應調整）
-    try:
-        # 若 PendingLineUser 沒有 is_active 欄位，就改成只比對 line_user_id
-        q = db.query(PendingLineUser).filter(PendingLineUser.line_user_id == line_user_id)
-        # 有些專案會有 is_active/approved 等欄位，想限定可在此追加：
-        # q = q.filter(func.coalesce(PendingLineUser.is_active, true()) == true())
-        if q.first():
-            state["in_pending"] = True
-    except Exception:
-        # 沒有 PendingLineUser 模型就忽略
-        pass
-
-    return state
-
+    return line_identity.resolve(db, line_user_id).state()
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import text
 from api.deps import get_client_id
 from api.tenant_db import get_tenant_session
+from api.services.case_list_cache import case_list_cache, names_in, prior_names
 
 router = APIRouter()
 
@@ -12,6 +13,7 @@ def upload_cases(items: list[dict], client_id: str = Depends(get_client_id)):
     
     session = get_tenant_session(client_id)
     try:
+        names = prior_names(session, (item.get("case_id") for item in items)) | names_in(items)
         for item in items:
             if "case_id" not in item:
                 continue
@@ -29,6 +31,7 @@ def upload_cases(items: list[dict], client_id: str = Depends(get_client_id)):
             """)
             session.execute(stmt, item)
         session.commit()
+        case_list_cache.invalidate(names)
         return {"success": True, "message": f"{len(items)} records processed"}
     except Exception as e:
         session.rollback()
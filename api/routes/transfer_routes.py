@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# api/routes/transfer_routes.py
+"""
+下載連結（SecureFileTransfer 發出的 {base_url}/download/{transfer_id}）
+- GET / HEAD：串流檔案，支援 Range / If-Range（206 / 416），LINE 手機端斷線可續傳
+- 只有從第 0 個位元組開始的 GET 才算一次下載，續傳的區段請求不重複計數
+- GET /download/{transfer_id}/meta：檔名、大小、SHA-256（第一次呼叫才計算）
+"""
+
+import mimetypes
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from api.database import get_db
+from api.services.file_transfer import count_download, get_transfer, transfer_hash
+from api.utils.file_stream import RangeFileResponse
+
+router = APIRouter(tags=["files"])
+
+
+def _valid_transfer(db: Session, transfer_id: str):
+    record, message = get_transfer(db, transfer_id)
+    if record is None:
+        raise HTTPException(status_code=404 if message == "檔案不存在" else 403, detail=message)
+    return record
+
+
+@router.api_route("/download/{transfer_id}", methods=["GET", "HEAD"])
+async def download_file(transfer_id: str, request: Request, db: Session = Depends(get_db)):
+    record = await run_in_threadpool(_valid_transfer, db, transfer_id)
+    try:
+        st = await run_in_threadpool(os.stat, record.file_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="檔案不存在")
+
+    try:
+        response = RangeFileResponse(
+            record.file_path, st, record.file_name,
+            media_type=mimetypes.guess_type(record.file_name)[0] or "application/octet-stream",
+            range_header=request.headers.get("range"),
+            if_range=request.headers.get("if-range"),
+            method=request.method,
+            inline=request.query_params.get("preview") == "true",
+        )
+    except ValueError:
+        return Response(status_code=416, headers={"content-range": f"bytes */{st.st_size}"})
+
+    if request.method == "GET" and response.offset == 0:
+        await run_in_threadpool(count_download, db, transfer_id)
+    return response
+
+
+@router.get("/download/{transfer_id}/meta")
+async def download_meta(transfer_id: str, db: Session = Depends(get_db)):
+    record = await run_in_threadpool(_valid_transfer, db, transfer_id)
+    try:
+        sha256 = await run_in_threadpool(transfer_hash, db, record)
+    except OSError:
+        raise HTTPException(status_code=404, detail="檔案不存在")
+    return {
+        "ok": True,
+        "transfer_id": transfer_id,
+        "file_name": record.file_name,
+        "size": record.size_bytes,
+        "sha256": sha256,
+        "expires_at": record.expires_at.isoformat(),
+        "download_count": record.download_count,
+    }
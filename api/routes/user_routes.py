@@ -11,24 +11,24 @@
 
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from sqlalchemy import text, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text, or_, select
 from typing import Optional, List, Dict, Any, Tuple, Literal
 from datetime import datetime
-from uuid import uuid4
-import logging, traceback, re, json, os
+import logging, traceback, re, json
 
-from api.database import get_db
+from api.database import get_async_db
 from api.models_cases import CaseRecord
+from api.services.case_list_cache import case_list_cache
+from api.services.line_identity import invalidate_line_identity, line_identity
+from api.services.session_store import session_store
+from api.utils.render_cache import render_cache
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 user_router = APIRouter(prefix="/api/user", tags=["user"])
 
-# ============================ 可調參數 ============================
-SESSION_TTL_MINUTES = int(os.getenv("UQS_TTL_MINUTES", "30"))
-
 # ============================ Pydantic Models ============================
 class RegisterIn(BaseModel):
     line_user_id: str = Field(..., min_length=5)
@@ -390,63 +390,32 @@ def _render_case_brief_list(items: List[Dict[str, Any]], label: str) -> str:
     return "\n".join(lines)
 
 # ============================ Helpers：會話暫存 ============================
-def _cleanup_expired_sessions(db: Session, line_user_id: Optional[str] = None):
-    params = {"ttl": SESSION_TTL_MINUTES}
-    where_user = ""
-    if line_user_id:
-        where_user = "AND line_user_id = :lid"
-        params["lid"] = line_user_id
-    db.execute(
-        text(f"""
-        DELETE FROM user_query_sessions
-        WHERE created_at < NOW() - (CAST(:ttl AS TEXT) || ' minutes')::interval
-        {where_user}
-        """),
-        params,
-    )
-    db.commit()
+# 實際存放由 session_store 決定（預設程序內 TTL；USER_SESSION_BACKEND=postgres 時寫 user_query_sessions）
+# 過期資料由 main.py 啟動的背景任務定期清除；db 參數保留以相容舊呼叫
+async def _save_session(db: AsyncSession, line_user_id: str, scope: str, payload: Dict[str, Any]) -> None:
+    await session_store.save(line_user_id, scope, payload)
 
-def _save_session(db: Session, line_user_id: str, scope: str, payload: Dict[str, Any]) -> None:
-    _cleanup_expired_sessions(db, line_user_id)
-    db.execute(
-        text("""DELETE FROM user_query_sessions WHERE line_user_id = :lid AND scope = :scope"""),
-        {"lid": line_user_id, "scope": scope},
-    )
-    db.execute(
-        text("""
-        INSERT INTO user_query_sessions (line_user_id, session_key, scope, payload_json)
-        VALUES (:lid, :skey, :scope, :payload)
-        """),
-        {"lid": line_user_id, "skey": str(uuid4()), "scope": scope, "payload": json.dumps(payload, ensure_ascii=False)},
-    )
-    db.commit()
-
-def _load_last_session(db: Session, line_user_id: str) -> Optional[Dict[str, Any]]:
-    row = db.execute(
-        text(f"""
-            SELECT session_key, scope, payload_json, created_at
-            FROM user_query_sessions
-            WHERE line_user_id = :lid
-              AND created_at >= NOW() - (CAST(:ttl AS TEXT) || ' minutes')::interval
-            ORDER BY created_at DESC
-            LIMIT 1
-        """),
-        {"lid": line_user_id, "ttl": SESSION_TTL_MINUTES},
-    ).first()
-    if not row:
-        return None
-    _, scope, payload, created_at = row
-    if isinstance(payload, str):
-        payload = json.loads(payload)
-    return {"scope": scope, "payload": payload, "created_at": created_at}
+async def _load_last_session(db: AsyncSession, line_user_id: str) -> Optional[Dict[str, Any]]:
+    return await session_store.load_last(line_user_id)
 
-def _consume_all_sessions(db: Session, line_user_id: str):
-    db.execute(text("""DELETE FROM user_query_sessions WHERE line_user_id = :lid"""),
-               {"lid": line_user_id})
-    db.commit()
+async def _consume_all_sessions(db: AsyncSession, line_user_id: str):
+    await session_store.consume_all(line_user_id)
 
 # ============================ 視圖：單筆詳情 ============================
+# 詳情輸出格式有改動時 +1，讓 render_cache 內的舊文字失效
+CASE_DETAIL_TEMPLATE_VERSION = 1
+
 def render_case_detail(case) -> str:
+    """以 (id, updated_at, 樣板版本) 快取；所有寫入路徑都會把 updated_at 設為 NOW()。"""
+    return render_cache.render(
+        "line_case_detail",
+        getattr(case, "id", None),
+        getattr(case, "updated_at", None) or getattr(case, "updated_date", None),
+        CASE_DETAIL_TEMPLATE_VERSION,
+        lambda: _render_case_detail(case),
+    )
+
+def _render_case_detail(case) -> str:
     case_number   = case.case_number or case.case_id or "-"
     client        = case.client or "-"
     case_type     = case.case_type or "-"
@@ -541,7 +510,7 @@ def render_case_detail(case) -> str:
 
 # ============================ 1) /register ============================
 @user_router.post("/register", response_model=RegisterOut)
-def register_user(payload: RegisterIn, db: Session = Depends(get_db)):
+async def register_user(payload: RegisterIn, db: AsyncSession = Depends(get_async_db)):
     try:
         lid     = (payload.line_user_id or "").strip()
         text_in = _normalize_text(payload.text or "")
@@ -549,13 +518,13 @@ def register_user(payload: RegisterIn, db: Session = Depends(get_db)):
         # 數字選單
         if re.fullmatch(r"[1-9]\d*", text_in):
             choice = int(text_in)
-            sess = _load_last_session(db, lid)
+            sess = await _load_last_session(db, lid)
             if not sess:
                 return RegisterOut(success=False, message="尚無有效選單，請先輸入「?」。", route='INFO')
 
             scope = sess["scope"]
             payload_json = sess["payload"]
-            _consume_all_sessions(db, lid)
+            await _consume_all_sessions(db, lid)
 
             if scope == "category_menu":
                 menu   = payload_json["menu"]
@@ -569,7 +538,7 @@ def register_user(payload: RegisterIn, db: Session = Depends(get_db)):
                 items = bucket["items"]
                 label = bucket["label"]
 
-                _save_session(db, lid, f"case_list:{key}", {"label": label, "items": items})
+                await _save_session(db, lid, f"case_list:{key}", {"label": label, "items": items})
                 msg = _render_case_brief_list(items, label)
                 return RegisterOut(success=True, message=msg, route='MENU_LIST')
 
@@ -579,7 +548,7 @@ def register_user(payload: RegisterIn, db: Session = Depends(get_db)):
                     return RegisterOut(success=False, message="選項超出範圍，請輸入「?」重新載入。", route='INFO')
 
                 case_id = items[choice - 1]["id"]
-                case = db.query(CaseRecord).filter(CaseRecord.id == case_id).first()
+                case = (await db.execute(select(CaseRecord).where(CaseRecord.id == case_id))).scalars().first()
                 if not case:
                     return RegisterOut(success=False, message="案件不存在或已移除，請輸入「?」重新載入。", route='INFO')
 
@@ -596,7 +565,7 @@ def register_user(payload: RegisterIn, db: Session = Depends(get_db)):
 
         if intent == "prepare" and cname:
             candidate = re.sub(r"^(?:登錄|登陸|登入|登录)\s+", "", cname).strip()
-            db.execute(text("""
+            await db.execute(text("""
                 INSERT INTO pending_line_users (line_user_id, expected_name, status, created_at, updated_at)
                 VALUES (:lid, :name, 'pending', NOW(), NOW())
                 ON CONFLICT (line_user_id)
@@ -605,8 +574,9 @@ def register_user(payload: RegisterIn, db: Session = Depends(get_db)):
                     status        = 'pending',
                     updated_at    = NOW();
             """), {"lid": lid, "name": candidate})
-            db.commit()
-            _consume_all_sessions(db, lid)
+            await db.commit()
+            invalidate_line_identity(lid)
+            await _consume_all_sessions(db, lid)
             return RegisterOut(
                 success=True,
                 expected_name=candidate,
@@ -615,25 +585,20 @@ def register_user(payload: RegisterIn, db: Session = Depends(get_db)):
             )
 
         if intent == "confirm_yes":
-            row = db.execute(text("""
-                SELECT expected_name
-                FROM pending_line_users
-                WHERE line_user_id = :lid
-                ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST
-                LIMIT 1
-            """), {"lid": lid}).first()
-            if not row or not row[0]:
+            ident = await line_identity.resolve_async(db, lid, fresh=True)
+            if not ident.expected_name:
                 return RegisterOut(success=False, message="尚未收到您的大名，請輸入「登錄 您的大名」。", route='INFO')
 
-            final_name = row[0]
-            db.execute(text("""
+            final_name = ident.expected_name
+            await db.execute(text("""
                 UPDATE pending_line_users
                 SET status = 'registered',
                     updated_at = NOW()
                 WHERE line_user_id = :lid
             """), {"lid": lid})
-            db.commit()
-            _consume_all_sessions(db, lid)
+            await db.commit()
+            invalidate_line_identity(lid)
+            await _consume_all_sessions(db, lid)
             return RegisterOut(
                 success=True,
                 expected_name=final_name,
@@ -642,70 +607,43 @@ def register_user(payload: RegisterIn, db: Session = Depends(get_db)):
             )
 
         if intent == "confirm_no":
-            db.execute(text("""
+            await db.execute(text("""
                 UPDATE pending_line_users
                 SET expected_name = NULL,
                     status        = 'pending',
                     updated_at    = NOW()
                 WHERE line_user_id = :lid
             """), {"lid": lid})
-            db.commit()
-            _consume_all_sessions(db, lid)
+            await db.commit()
+            invalidate_line_identity(lid)
+            await _consume_all_sessions(db, lid)
             return RegisterOut(success=True, message="好的，請重新輸入「登錄 您的大名」。", route='REGISTER_RETRY')
 
         # 其他輸入：登錄提示
-        row = db.execute(text("""
-            SELECT status FROM pending_line_users
-            WHERE line_user_id = :lid
-            ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST
-            LIMIT 1
-        """), {"lid": lid}).first()
-        if row and row[0] == "registered":
+        ident = await line_identity.resolve_async(db, lid)
+        if ident.pending_status == "registered":
             return RegisterOut(success=True, message="已登錄，用「?」可查詢您的案件。", route='INFO')
         else:
             return RegisterOut(success=False, message="您好，請輸入「登錄 您的大名」完成登錄。", route='INFO')
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"/register 失敗: {e}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail="REG_500: 系統錯誤")
 
-# ============================ 2) /my-cases ============================
-@user_router.post("/my-cases")
-def my_cases(payload: MyCasesIn, db: Session = Depends(get_db)):
-    lid = (payload.line_user_id or "").strip()
-    if not lid:
-        raise HTTPException(status_code=400, detail="line_user_id 必填")
-
-    row = db.execute(text("""
-        SELECT expected_name
-        FROM pending_line_users
-        WHERE line_user_id = :lid
-          AND status = 'registered'
-          AND expected_name IS NOT NULL
-        ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST
-        LIMIT 1
-    """), {"lid": lid}).first()
-    if not row or not row[0]:
-        return {"ok": False, "message": "尚未登錄，請輸入「登錄 您的大名」完成登錄。", "route": "INFO"}
-
-    user_name = row[0].strip()
-    if not user_name:
-        return {"ok": False, "message": "目前查無姓名資訊，請輸入「登錄 您的大名」。", "route": "INFO"}
-
-    if payload.include_as_opponent:
-        q = db.query(CaseRecord).filter(or_(CaseRecord.client == user_name, CaseRecord.opposing_party == user_name))
+async def _load_case_list_view(db: AsyncSession, user_name: str, include_as_opponent: bool) -> Dict[str, Any]:
+    """查詢並整理成可快取的內容：{"total", "detail"（單筆時的詳情文字）, "buckets"}。"""
+    if include_as_opponent:
+        q = select(CaseRecord).where(or_(CaseRecord.client == user_name, CaseRecord.opposing_party == user_name))
     else:
-        q = db.query(CaseRecord).filter(CaseRecord.client == user_name)
+        q = select(CaseRecord).where(CaseRecord.client == user_name)
 
+    # 由 ix_case_records_client_recent / ix_case_records_opposing_recent 提供順序
     q = q.order_by(text("updated_date DESC NULLS LAST, updated_at DESC NULLS LAST, id DESC"))
-    rows: List[CaseRecord] = q.all()
-
-    if not rows:
-        return {"ok": True, "total": 0, "message": f"沒有找到「{user_name}」的案件。", "route": "INFO"}
+    rows: List[CaseRecord] = list((await db.execute(q)).scalars().all())
 
     if len(rows) == 1:
-        return {"ok": True, "total": 1, "message": render_case_detail(rows[0]), "route": "CASE_DETAIL"}
+        return {"total": 1, "detail": render_case_detail(rows[0]), "buckets": {}}
 
     buckets: Dict[str, Dict[str, Any]] = {}
     for r in rows:
@@ -718,22 +656,52 @@ def my_cases(payload: MyCasesIn, db: Session = Depends(get_db)):
             "case_type": r.case_type,
             "updated_at": _fmt_dt(getattr(r, "updated_date", None) or getattr(r, "updated_at", None))
         })
+    return {"total": len(rows), "detail": None, "buckets": buckets}
+
+# ============================ 2) /my-cases ============================
+@user_router.post("/my-cases")
+async def my_cases(payload: MyCasesIn, db: AsyncSession = Depends(get_async_db)):
+    lid = (payload.line_user_id or "").strip()
+    if not lid:
+        raise HTTPException(status_code=400, detail="line_user_id 必填")
+
+    ident = await line_identity.resolve_async(db, lid)
+    if ident.pending_status != "registered" or not ident.expected_name:
+        return {"ok": False, "message": "尚未登錄，請輸入「登錄 您的大名」完成登錄。", "route": "INFO"}
+
+    user_name = ident.registered_name
+    if not user_name:
+        return {"ok": False, "message": "目前查無姓名資訊，請輸入「登錄 您的大名」。", "route": "INFO"}
+
+    view = case_list_cache.get(user_name, bool(payload.include_as_opponent))
+    if view is None:
+        generation = case_list_cache.generation()
+        view = await _load_case_list_view(db, user_name, bool(payload.include_as_opponent))
+        case_list_cache.put(user_name, bool(payload.include_as_opponent), view, generation)
+
+    total = view["total"]
+    if not total:
+        return {"ok": True, "total": 0, "message": f"沒有找到「{user_name}」的案件。", "route": "INFO"}
+
+    if view["detail"] is not None:
+        return {"ok": True, "total": 1, "message": view["detail"], "route": "CASE_DETAIL"}
 
+    buckets: Dict[str, Dict[str, Any]] = view["buckets"]
     types_present = [k for k in ["CRIM", "CIVIL", "OTHER"] if k in buckets]
 
     if len(types_present) >= 2:
         menu_items = [{"key": k, "label": buckets[k]["label"], "count": len(buckets[k]["items"])}
                       for k in types_present]
-        _save_session(db, lid, "category_menu", {"menu": menu_items, "by_type": buckets})
+        await _save_session(db, lid, "category_menu", {"menu": menu_items, "by_type": buckets})
         msg = _render_category_menu(menu_items)
-        return {"ok": True, "total": len(rows), "message": msg, "route": "MENU_CATEGORY"}
+        return {"ok": True, "total": total, "message": msg, "route": "MENU_CATEGORY"}
 
     only_key = types_present[0]
     items = buckets[only_key]["items"]
     label = buckets[only_key]["label"]
-    _save_session(db, lid, f"case_list:{only_key}", {"label": label, "items": items})
+    await _save_session(db, lid, f"case_list:{only_key}", {"label": label, "items": items})
     msg = _render_case_brief_list(items, label)
-    return {"ok": True, "total": len(rows), "message": msg, "route": "MENU_LIST"}
+    return {"ok": True, "total": total, "message": msg, "route": "MENU_LIST"}
 
 # ============================ 健康檢查 ============================
 @user_router.get("/health")
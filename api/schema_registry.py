@@ -0,0 +1,92 @@
+# api/schema_registry.py
+# -*- coding: utf-8 -*-
+"""
+Schema 就緒註冊表（每個程序只檢查一次）
+- 以 (engine URL, 檢查名稱, 遷移版本) 為鍵，建表/補欄位/補索引的檢查成功後快取在記憶體
+- 請求路徑不再每次查系統目錄（inspect / information_schema / pg_indexes）
+- 只有 tenant_bootstrap（或部署時調高 SCHEMA_VERSION）會重新啟用檢查
+- 觸發器 / 回填這類會鎖表的遷移改由部署時的 api/scripts/migrate.py 執行，請求路徑只以 require() 確認已安裝
+"""
+
+import threading
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy.engine import Engine
+
+# DDL 檢查內容有變動時調高；舊快取自然失效
+SCHEMA_VERSION = 1
+
+_Key = Tuple[str, str, int]
+
+
+class MigrationMissing(RuntimeError):
+    """部署時的遷移尚未套用（請執行 python api/scripts/migrate.py）"""
+
+
+def _engine_key(bind) -> str:
+    engine = getattr(bind, "engine", bind)
+    # URL 含 options=-csearch_path=...，因此同一 DB 不同 schema 會是不同鍵
+    return engine.url.render_as_string(hide_password=True)
+
+
+class SchemaRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready: Dict[_Key, Optional[str]] = {}  # key -> tag（通常是 client_id）
+        self._running: Dict[_Key, threading.Lock] = {}
+        self._listeners: Set[Callable[[Optional[str]], None]] = set()
+        self._counters: Dict[str, int] = {"checks_run": 0, "checks_skipped": 0, "rearms": 0}
+
+    def ensure(self, bind: Engine, name: str, check: Callable[[], None],
+               tag: Optional[str] = None, version: int = SCHEMA_VERSION) -> None:
+        """check() 成功後記錄；失敗則不快取，下次請求再試。"""
+        key = (_engine_key(bind), name, version)
+        with self._lock:
+            if key in self._ready:
+                self._counters["checks_skipped"] += 1
+                return
+            key_lock = self._running.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # 另一條執行緒可能已經做完
+            with self._lock:
+                if key in self._ready:
+                    self._counters["checks_skipped"] += 1
+                    return
+            check()
+            with self._lock:
+                self._ready[key] = tag
+                self._counters["checks_run"] += 1
+
+    def require(self, bind: Engine, name: str, probe: Callable[[], bool], step: str) -> None:
+        """只檢查、不安裝：probe() 為 True 後快取；否則丟 MigrationMissing（不快取，下次再查）。"""
+        def _check() -> None:
+            if not probe():
+                raise MigrationMissing(f"{name} 尚未安裝，請執行 python api/scripts/migrate.py --only {step}")
+
+        self.ensure(bind, name, _check)
+
+    def rearm(self, tag: Optional[str] = None) -> None:
+        """tag=None 代表全部重新檢查；否則只清除該租戶的紀錄。"""
+        with self._lock:
+            if tag is None:
+                self._ready.clear()
+            else:
+                for key in [k for k, t in self._ready.items() if t == tag]:
+                    del self._ready[key]
+            self._counters["rearms"] += 1
+            listeners = list(self._listeners)
+        for fn in listeners:
+            fn(tag)
+
+    def add_listener(self, fn: Callable[[Optional[str]], None]) -> None:
+        """rearm 時通知（例如清除依賴 schema 的欄位快取）。"""
+        with self._lock:
+            self._listeners.add(fn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "ready": len(self._ready), "version": SCHEMA_VERSION}
+
+
+schema_registry = SchemaRegistry()
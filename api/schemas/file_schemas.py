@@ -6,7 +6,6 @@
 包含控制層、邏輯層、API端點和檔案傳輸功能
 """
 
-import hashlib
 import os
 from datetime import datetime, timedelta
 import secrets
@@ -19,6 +18,13 @@ import shutil
 from pathlib import Path
 import json
 
+try:
+    from api.database import SessionLocal
+    from api.services.file_transfer import create_transfer, file_hash_cache, get_transfer
+except ImportError:
+    from database import SessionLocal  # type: ignore
+    from services.file_transfer import create_transfer, file_hash_cache, get_transfer  # type: ignore
+
 # ==================== 1. 資料模型擴展 ====================
 
 from pydantic import BaseModel, Field
@@ -129,43 +135,27 @@ class FileClassifier:
 # ==================== 3. 安全檔案傳輸邏輯層 ====================
 
 class SecureFileTransfer:
-    """安全檔案傳輸管理器"""
+    """安全檔案傳輸管理器（連結存在 file_transfers 表，見 api/services/file_transfer.py）"""
 
-    def __init__(self, base_url: str, temp_folder: str):
+    def __init__(self, base_url: str, temp_folder: str, session_factory=None):
         self.base_url = base_url
         self.temp_folder = temp_folder
-        self.transfer_records = {}  # 在實際應用中應使用資料庫
+        self.session_factory = session_factory or SessionLocal
 
         # 確保臨時資料夾存在
         os.makedirs(temp_folder, exist_ok=True)
 
     def create_secure_download_link(self, file_path: str, expiry_hours: int = 24) -> Dict[str, str]:
-        """建立安全下載連結"""
+        """建立安全下載連結（只做 stat；雜湊等第一次查詢 /download/{id}/meta 才計算）"""
         try:
-            # 生成唯一的傳輸ID
-            transfer_id = secrets.token_urlsafe(32)
-
-            # 計算檔案雜湊值
-            file_hash = self._calculate_file_hash(file_path)
-
-            # 建立過期時間
-            expires_at = datetime.now() + timedelta(hours=expiry_hours)
-
-            # 儲存傳輸記錄
-            self.transfer_records[transfer_id] = {
-                'file_path': file_path,
-                'file_hash': file_hash,
-                'expires_at': expires_at.isoformat(),
-                'download_count': 0,
-                'created_at': datetime.now().isoformat()
-            }
-
-            # 生成下載URL
-            download_url = f"{self.base_url}/download/{transfer_id}"
+            with self.session_factory() as db:
+                record = create_transfer(db, file_path, expiry_hours)
+                transfer_id = record.transfer_id
+                expires_at = record.expires_at
 
             return {
                 'transfer_id': transfer_id,
-                'download_url': download_url,
+                'download_url': f"{self.base_url}/download/{transfer_id}",
                 'expires_at': expires_at.isoformat(),
                 'file_name': os.path.basename(file_path)
             }
@@ -197,28 +187,14 @@ class SecureFileTransfer:
             return ""
 
     def _calculate_file_hash(self, file_path: str) -> str:
-        """計算檔案SHA256雜湊值"""
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
+        """計算檔案SHA256雜湊值（依 路徑/大小/mtime 快取）"""
+        return file_hash_cache.sha256(file_path)[0]
 
     def verify_transfer(self, transfer_id: str) -> Tuple[bool, str]:
         """驗證傳輸請求"""
-        if transfer_id not in self.transfer_records:
-            return False, "無效的傳輸ID"
-
-        record = self.transfer_records[transfer_id]
-        expires_at = datetime.fromisoformat(record['expires_at'])
-
-        if datetime.now() > expires_at:
-            return False, "下載連結已過期"
-
-        if not os.path.exists(record['file_path']):
-            return False, "檔案不存在"
-
-        return True, "驗證通過"
+        with self.session_factory() as db:
+            record, message = get_transfer(db, transfer_id)
+        return record is not None, message
 
 # ==================== 4. 案件資料夾檔案邏輯層 ====================
 
@@ -815,41 +791,8 @@ def prepare_files_for_transfer(
         print(f"❌ 準備檔案傳輸 API 錯誤: {e}")
         raise HTTPException(status_code=500, detail="系統錯誤")
 
-@app.get("/download/{transfer_id}")
-def download_file(transfer_id: str = Path(..., description="傳輸ID")):
-    \"\"\"安全檔案下載端點\"\"\"
-    try:
-        controller = get_controller()
-        extension = CaseControllerExtension(controller)
-        file_transfer = extension.folder_file_logic.file_transfer
-
-        # 驗證傳輸請求
-        valid, message = file_transfer.verify_transfer(transfer_id)
-        if not valid:
-            raise HTTPException(status_code=403, detail=message)
-
-        # 取得檔案資訊
-        record = file_transfer.transfer_records[transfer_id]
-        file_path = record['file_path']
-
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="檔案不存在")
-
-        # 更新下載次數
-        record['download_count'] += 1
-
-        from fastapi.responses import FileResponse
-        return FileResponse(
-            path=file_path,
-            filename=os.path.basename(file_path),
-            media_type='application/octet-stream'
-        )
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"❌ 檔案下載 API 錯誤: {e}")
-        raise HTTPException(status_code=500, detail="檔案下載失敗")
+# 下載端點已實作於 api/routes/transfer_routes.py：
+#   GET/HEAD /download/{transfer_id}（支援 Range 續傳）、GET /download/{transfer_id}/meta（SHA-256）
 
 # 全域變數擴展（添加到現有的全域變數區域）
 case_controller_extension = None  # 新增：案件控制器擴展
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: 案件詳情 / 進度歷程文字渲染，每次重建 vs. render_cache 命中
+用法：python api/scripts/bench_case_render.py [階段數 ...]   （預設 50 100 200）
+Requires env: DATABASE_URL（只為了能 import api.routes；不會連線）
+桌面端 CaseDisplayFormatter 需可 import utils（缺套件時略過）
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from api.routes.user_routes import _render_case_detail, render_case_detail  # noqa: E402
+from api.utils.render_cache import render_cache  # noqa: E402
+
+try:
+    from utils.case_display_formatter import CaseDisplayFormatter  # noqa: E402
+except Exception as e:  # utils/__init__ 會連帶載入 Excel 等桌面端套件
+    print(f"⚠️ 略過桌面端：{e!r}")
+    CaseDisplayFormatter = None
+
+REPEAT = 2000
+TIME_FORMATS = ["14:30", "下午2點30分", "上午９：３０", "10.15", ""]
+
+
+def _api_case(n: int):
+    base = datetime(2024, 1, 1)
+    stages = {}
+    for i in range(n):
+        d = (base + timedelta(days=7 * i)).strftime("%Y-%m-%d")
+        t = TIME_FORMATS[i % len(TIME_FORMATS)]
+        stages[f"階段{i:03d}"] = {"date": f"{d} {t}".strip(), "note": f"第 {i} 次開庭\n請帶身分證"} if i % 3 \
+            else f"{d}T{10 + i % 8}:00:00"
+    notes = {f"階段{i:03d}": f"補充備註 {i}" for i in range(0, n, 2)}
+    return SimpleNamespace(
+        id=1, case_id="B0000001", case_number="114-訴-1234", client="王小明", case_type="民事",
+        case_reason="損害賠償", court="臺北地院", division="民三庭", legal_affairs="陳法務",
+        opposing_party="對造公司", progress_stages=stages, progress_notes=notes,
+        progress_times=None, progress_time=None,
+        created_date="2024-01-01 09:00:00", updated_date="2025-08-14 10:00:00",
+        updated_at=datetime(2025, 8, 14, 10, 0, 0),
+    )
+
+
+def _desktop_case(n: int):
+    base = datetime(2024, 1, 1)
+    stages = {f"階段{i:03d}": (base + timedelta(days=7 * (n - i))).strftime("%Y-%m-%d") for i in range(n)}
+    return SimpleNamespace(
+        case_id="B0000001", progress="階段000", progress_date="2025-08-14",
+        progress_stages=stages,
+        progress_times={k: TIME_FORMATS[i % len(TIME_FORMATS)] for i, k in enumerate(stages)},
+        progress_notes={k: f"備註 {i}" for i, k in enumerate(stages) if i % 2},
+        updated_date=datetime(2025, 8, 14, 10, 0, 0),
+    )
+
+
+def _time(fn) -> float:
+    t0 = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - t0) / REPEAT * 1e6
+
+
+def _report(label: str, build, cached) -> None:
+    render_cache.clear()
+    assert build() == cached(), "快取輸出與直接渲染不一致"
+    raw, hit = _time(build), _time(cached)
+    print(f"  {label:<22} build {raw:9.1f}µs   cached {hit:7.2f}µs   {raw / hit:7.0f}x")
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [50, 100, 200]
+    for n in sizes:
+        print(f"stages={n}")
+        case = _api_case(n)
+        _report("render_case_detail", lambda: _render_case_detail(case), lambda: render_case_detail(case))
+        if CaseDisplayFormatter is not None:
+            dcase = _desktop_case(n)
+            _report("desktop timeline",
+                    lambda: CaseDisplayFormatter._format_progress_timeline_without_status(dcase),
+                    lambda: CaseDisplayFormatter._cached_progress_timeline(dcase))
+    print(render_cache.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark: 律師案件搜尋 舊版 ILIKE + updated_at 排序 vs. pg_trgm 相似度排序（含 keyset 第二頁）
+用法：python api/scripts/bench_case_search.py [筆數]   （預設 200000）
+Requires env: DATABASE_URL（需可使用 pg_trgm；會建立並刪除 case_records_bench_search 表）
+"""
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import text  # noqa: E402
+
+from api.database import ENGINE  # noqa: E402
+from api.services.case_search import (  # noqa: E402
+    FUZZY_THRESHOLD, _escape_like, build_search_sql, encode_cursor, trgm_index_ddl,
+)
+
+TABLE = "case_records_bench_search"
+REPEAT = 7
+KEYS = ["王小明", "陳怡", "114-1234", "B0123456", "對造77", "王小民", "B012345x"]
+
+LEGACY_SQL = f"""
+    SELECT id, case_type, case_id, case_number, client, opposing_party, progress
+    FROM {TABLE}
+    WHERE case_id = :k OR case_number ILIKE :pat OR client ILIKE :pat
+    ORDER BY updated_at DESC NULLS LAST
+    LIMIT 10
+"""
+
+
+def _setup(conn, n: int) -> str:
+    ext = conn.execute(text("SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace "
+                            "WHERE e.extname = 'pg_trgm'")).scalar()
+    if not ext:
+        conn.execute(text("CREATE EXTENSION pg_trgm WITH SCHEMA public"))
+        ext = "public"
+    conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+    conn.execute(text(f"""
+        CREATE TABLE {TABLE} (
+            id BIGSERIAL PRIMARY KEY, case_type TEXT, case_id TEXT, case_number TEXT,
+            client TEXT, opposing_party TEXT, progress TEXT, updated_at TIMESTAMPTZ
+        )
+    """))
+    conn.execute(text("SELECT setseed(0.42)"))
+    # 姓 × 名 兩字，約 4 萬種姓名組合；案號/流水號唯一
+    conn.execute(text(f"""
+        INSERT INTO {TABLE} (case_type, case_id, case_number, client, opposing_party, progress, updated_at)
+        SELECT (ARRAY['民事','刑事','行政','家事'])[1 + (g % 4)],
+               'B' || lpad(g::text, 7, '0'),
+               (110 + g % 5)::text || '-' || g::text,
+               s.a[1 + floor(random() * 20)::int] || g1.a[1 + floor(random() * 40)::int] || g1.a[1 + floor(random() * 40)::int],
+               '對造' || (g % 997)::text,
+               (ARRAY['起訴','一審','二審','結案'])[1 + (g % 4)],
+               NOW() - (g || ' minutes')::interval
+        FROM generate_series(1, :n) g,
+             (SELECT ARRAY['王','李','張','劉','陳','楊','黃','趙','吳','周','徐','孫','馬','朱','胡','郭','何','林','高','羅'] a) s,
+             (SELECT ARRAY['小','明','怡','君','志','偉','美','玲','建','華','文','雅','宏','俊','婷','芳','家','豪','佳','慧',
+                           '國','強','欣','儀','子','軒','宇','涵','承','翰','淑','惠','信','安','柏','諺','思','妤','冠','廷'] a) g1
+    """), {"n": n})
+    conn.execute(text(f"ANALYZE {TABLE}"))
+    return ext
+
+
+def _time(sql: str, params: dict) -> float:
+    samples = []
+    for _ in range(REPEAT):
+        with ENGINE.connect() as conn:
+            t0 = time.perf_counter()
+            conn.execute(text(sql), params).fetchall()
+            samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples)
+
+
+def _run(label: str, ext: str):
+    print(f"[{label}]")
+    for k in KEYS:
+        params = {"k": k, "pat": f"%{_escape_like(k)}%", "limit": 11}
+        legacy_ms = _time(LEGACY_SQL, params)
+        # 與 search_cases 相同：子字串沒命中才改用相似度
+        fuzzy = False
+        ranked_first = build_search_sql(ext, has_cursor=False, table=TABLE)
+        with ENGINE.connect() as conn:
+            rows = conn.execute(text(ranked_first), params).fetchall()
+        if not rows:
+            fuzzy = True
+            ranked_first = f"SET pg_trgm.similarity_threshold = {FUZZY_THRESHOLD};" + build_search_sql(
+                ext, has_cursor=False, table=TABLE, fuzzy=True)
+            with ENGINE.connect() as conn:
+                rows = conn.execute(text(ranked_first), params).fetchall()
+        ranked_next = build_search_sql(ext, has_cursor=True, table=TABLE, fuzzy=fuzzy)
+        if fuzzy:
+            ranked_next = f"SET pg_trgm.similarity_threshold = {FUZZY_THRESHOLD};" + ranked_next
+        ranked_ms = _time(ranked_first, params)
+        page2 = "-"
+        if len(rows) > 10:
+            last = rows[9]._mapping
+            p2 = {**params, "after_score": last["score"], "after_id": last["id"]}
+            page2 = f"{_time(ranked_next, p2):8.1f}"
+            assert encode_cursor(last["score"], last["id"])
+        mode = "fuzzy" if fuzzy else "substr"
+        print(f"  {k:<10} legacy {legacy_ms:8.1f} ms   ranked({mode}) {ranked_ms:8.1f} ms   "
+              f"page2 {page2} ms   hits≥{len(rows)}", flush=True)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with ENGINE.begin() as conn:
+        t0 = time.perf_counter()
+        ext = _setup(conn, n)
+    print(f"rows={n} (setup {time.perf_counter() - t0:.1f}s, pg_trgm schema={ext})")
+    try:
+        _run("no trigram index", ext)
+        with ENGINE.begin() as conn:
+            t0 = time.perf_counter()
+            for sql in trgm_index_ddl(ext, TABLE):
+                conn.execute(text(sql))
+            conn.execute(text(f"ANALYZE {TABLE}"))
+        print(f"  (built {len(trgm_index_ddl(ext, TABLE))} GIN indexes in {time.perf_counter() - t0:.1f}s)")
+        _run("gin_trgm_ops indexes", ext)
+    finally:
+        with ENGINE.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /api/cases/upload 的逐筆 upsert vs. COPY + set-based merge
+用法：python api/scripts/bench_case_upload.py [筆數 ...]   （預設 1000 10000 100000）
+Requires env: DATABASE_URL（會建立並刪除 case_records_bench_upload 表）
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import text  # noqa: E402
+
+from api.database import ENGINE  # noqa: E402
+from api.routes.case_upload_routes import (  # noqa: E402
+    CaseItem, _get_or_create_table, _item_to_values, _merge_rows_copy, _merge_rows_per_statement,
+)
+
+TABLE = "case_records_bench_upload"
+
+
+def _make_rows(n: int):
+    items = []
+    for i in range(n):
+        items.append(CaseItem(
+            case_id=f"B{i:07d}",
+            case_type="民事" if i % 2 else "刑事",
+            client=f"當事人{i % 5000}",
+            lawyer="王律師",
+            progress="一審",
+            case_reason="損害賠償",
+            case_number=f"114-{i}",
+            opposing_party=f"對造{i % 777}",
+            court="臺北地院",
+            division="民三庭",
+            progress_date="2025-08-14",
+            progress_stages={"起訴": "2025-01-02", "一審": {"date": "2025-08-14", "time": "14:30"}},
+            progress_notes={"一審": "帶文件"},
+        ))
+    return [(i, _item_to_values(it)) for i, it in enumerate(items, start=1)]
+
+
+def _run(label: str, fn, tbl, rows) -> float:
+    with ENGINE.begin() as conn:
+        conn.execute(text(f"TRUNCATE {TABLE}"))
+    t0 = time.perf_counter()
+    with ENGINE.begin() as conn:
+        fn(conn, tbl, rows)
+    elapsed = time.perf_counter() - t0
+    print(f"  {label:<12} {elapsed:8.2f}s  {len(rows) / elapsed:10.0f} rows/s")
+    return elapsed
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    tbl = _get_or_create_table(TABLE)
+    try:
+        for n in sizes:
+            rows = _make_rows(n)
+            print(f"rows={n}")
+            per_row = _run("per-row", _merge_rows_per_statement, tbl, rows)
+            copy = _run("copy+merge", lambda conn, _tbl, r: _merge_rows_copy(conn, TABLE, r), tbl, rows)
+            print(f"  speedup      {per_row / copy:8.1f}x")
+    finally:
+        with ENGINE.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {TABLE}"))
+
+
+if __name__ == "__main__":
+    main()
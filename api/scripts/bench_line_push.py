@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark / 驗證：LINE 推播佇列對本機 mock LINE server
+- mock server 提供 /v2/bot/message/push 與 /multicast，依設定比例回 429（Retry-After）或 500
+- 比較逐則 push（每次新建 AsyncClient，舊版做法）與 line_push 佇列（連線池 + multicast + 限流）
+- 最後檢查沒有人重複收到（重試用盡的才允許漏收）
+用法：python api/scripts/bench_line_push.py [訊息數] [不同內容數] [429 比例] [--queued-only]   （預設 2000 5 0.05）
+不需要 DATABASE_URL
+"""
+import asyncio
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+from fastapi import FastAPI, Request  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from api.services.line_service import LinePushClient  # noqa: E402
+
+received: Counter = Counter()
+seen_retry_keys = set()
+calls = Counter()
+
+
+def _mock_app(throttle_ratio: float) -> FastAPI:
+    app = FastAPI()
+
+    async def _handle(req: Request, recipients):
+        key = req.headers.get("X-Line-Retry-Key")
+        if key and key in seen_retry_keys:
+            return JSONResponse({"message": "The retry key is already accepted"}, status_code=409)
+        r = random.random()
+        if r < throttle_ratio:
+            calls["429"] += 1
+            return JSONResponse({"message": "Too Many Requests"}, status_code=429, headers={"Retry-After": "1"})
+        if r < throttle_ratio * 1.2:
+            calls["500"] += 1
+            return JSONResponse({"message": "Internal Server Error"}, status_code=500)
+        if key:
+            seen_retry_keys.add(key)
+        for to, msgs in recipients:
+            received[(to, msgs)] += 1
+        return JSONResponse({})
+
+    @app.post("/v2/bot/message/push")
+    async def push(req: Request):
+        body = await req.json()
+        calls["push"] += 1
+        return await _handle(req, [(body["to"], body["messages"][0]["text"])])
+
+    @app.post("/v2/bot/message/multicast")
+    async def multicast(req: Request):
+        body = await req.json()
+        calls["multicast"] += 1
+        assert len(body["to"]) <= 500 and len(set(body["to"])) == len(body["to"])
+        return await _handle(req, [(to, body["messages"][0]["text"]) for to in body["to"]])
+
+    return app
+
+
+def _serve(app: FastAPI) -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def _workload(n: int, texts: int):
+    return [(f"U{i:05d}", f"開庭提醒 #{i % texts}") for i in range(n)]
+
+
+async def _legacy(base: str, jobs) -> float:
+    sem = asyncio.Semaphore(8)
+
+    async def one(to, text):
+        async with sem:
+            for _ in range(10):
+                async with httpx.AsyncClient() as client:
+                    r = await client.post(f"{base}/v2/bot/message/push",
+                                          json={"to": to, "messages": [{"type": "text", "text": text}]})
+                if r.status_code < 400:
+                    return
+                await asyncio.sleep(float(r.headers.get("Retry-After", "0.2")))
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(to, text) for to, text in jobs))
+    return time.perf_counter() - t0
+
+
+async def _queued(base: str, jobs) -> float:
+    client = LinePushClient(base_url=base, token="test", rate=200, burst=50)
+    client.start()
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(client.push_text(to, text) for to, text in jobs), return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    failed = sum(1 for r in results if isinstance(r, Exception))
+    print(f"  failed after retries: {failed}")
+    print(f"  stats: {client.stats()}")
+    await client.stop()
+    return elapsed
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    n = int(args[0]) if len(args) > 0 else 2000
+    texts = int(args[1]) if len(args) > 1 else 5
+    ratio = float(args[2]) if len(args) > 2 else 0.05
+    base = _serve(_mock_app(ratio))
+    jobs = _workload(n, texts)
+    expected = Counter((to, text) for to, text in jobs)
+
+    runs = (("queued", _queued),) if "--queued-only" in sys.argv else (("per-message", _legacy), ("queued", _queued))
+    for label, fn in runs:
+        received.clear()
+        calls.clear()
+        elapsed = asyncio.run(fn(base, jobs))
+        # 重試用盡而失敗的可以沒收到，但收到的每一則都只能一次
+        ok = set(received) <= set(expected) and all(v == 1 for v in received.values())
+        print(f"{label:<12} {elapsed:7.2f}s  {n / elapsed:8.0f} msg/s  calls={dict(calls)}  exactly-once={ok}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark / 驗證：s3_put_stream 對本機 S3 替身（moto server，另開子程序，記憶體不算在本程序）
+- 產生 N MB 的暫存檔（與 UploadFile 的 SpooledTemporaryFile 相同介面）
+- 比較整檔讀進記憶體後 s3_put_bytes（舊做法）與分段 multipart 的 Python 記憶體峰值（tracemalloc）
+- 檢查上傳後物件內容的 SHA-256 / 大小一致、分段上傳失敗時有 abort（不留未完成的 multipart）
+用法：python api/scripts/bench_s3_upload.py [MB] [part MB] [並行數]   （預設 64 8 4）
+需要：pip install "moto[server]"；不需要 DATABASE_URL、AWS 帳號
+"""
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+MB = 1024 * 1024
+
+
+def _start_moto() -> subprocess.Popen:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, "-m", "moto.server", "-H", "127.0.0.1", "-p", str(port)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    os.environ["S3_ENDPOINT_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["S3_BUCKET"] = "bench-bucket"
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    return proc
+
+
+def _spool(size_mb: int):
+    f = tempfile.SpooledTemporaryFile(max_size=1 * MB)
+    block = os.urandom(MB)
+    digest = hashlib.sha256()
+    for i in range(size_mb):
+        chunk = block[:-1] + bytes([i % 256])
+        f.write(chunk)
+        digest.update(chunk)
+    f.seek(0)
+    return f, digest.hexdigest()
+
+
+def _measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / MB
+
+
+def main():
+    args = [float(a) for a in sys.argv[1:]]
+    size_mb = int(args[0]) if len(args) > 0 else 64
+    part_mb = args[1] if len(args) > 1 else 8
+    concurrency = int(args[2]) if len(args) > 2 else 4
+
+    moto = _start_moto()
+    from api.services import storage  # 讀到上面設定的環境變數
+
+    try:
+        s3 = storage._client()
+        s3.create_bucket(Bucket=storage.S3_BUCKET,
+                         CreateBucketConfiguration={"LocationConstraint": storage.AWS_DEFAULT_REGION})
+
+        f, expected = _spool(size_mb)
+        _, t_bytes, peak_bytes = _measure(lambda: storage.s3_put_bytes("bench", "whole.bin", f.read()))
+        f.seek(0)
+        stored, t_stream, peak_stream = _measure(lambda: storage.s3_put_stream(
+            "bench", "stream.bin", f, part_size=int(part_mb * MB), concurrency=concurrency))
+
+        body = s3.get_object(Bucket=stored.bucket, Key=stored.key)["Body"]
+        actual = hashlib.sha256()
+        for chunk in iter(lambda: body.read(MB), b""):
+            actual.update(chunk)
+        ok = stored.sha256 == expected == actual.hexdigest() and stored.size == size_mb * MB
+
+        print(f"file {size_mb} MB, part {part_mb} MB × {concurrency}")
+        print(f"  put_bytes   {t_bytes:6.2f}s   peak {peak_bytes:7.1f} MB")
+        print(f"  put_stream  {t_stream:6.2f}s   peak {peak_stream:7.1f} MB   parts={stored.parts}")
+        print(f"  sha256/size match: {ok}")
+
+        # 第 3 段失敗：應該 abort，bucket 內不留未完成的 multipart
+        original = s3.upload_part
+
+        def flaky(**kw):
+            if kw["PartNumber"] == 3:
+                raise RuntimeError("injected part failure")
+            return original(**kw)
+
+        s3.upload_part = flaky
+        f.seek(0)
+        try:
+            storage.s3_put_stream("bench", "broken.bin", f, part_size=int(part_mb * MB), concurrency=concurrency)
+            print("  failure injection: NOT raised")
+        except RuntimeError:
+            pending = s3.list_multipart_uploads(Bucket=storage.S3_BUCKET).get("Uploads", [])
+            print(f"  failure injection: aborted, pending multipart uploads={len(pending)}")
+        finally:
+            s3.upload_part = original
+        print(f"  stats: {storage.storage_stats()}")
+    finally:
+        moto.terminate()
+
+
+if __name__ == "__main__":
+    main()
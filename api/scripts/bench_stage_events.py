@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark: 事務所未來 7 天期日，讀全部 progress_stages 在 Python 解析（DateReminderManager 做法）
+vs. case_stage_events 索引範圍查詢
+用法：python api/scripts/bench_stage_events.py [案件數]   （預設 20000，每件 8 個階段）
+Requires env: DATABASE_URL（會在 case_records 寫入 client_id=bench_stage_events 的資料，結束時刪除）
+"""
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import text  # noqa: E402
+
+from api.case_partitions import ensure_case_partition, is_partitioned, partition_name  # noqa: E402
+from api.database import ENGINE  # noqa: E402
+from api.services.stage_reminders import ensure_stage_events, upcoming_stage_events  # noqa: E402
+
+CLIENT_ID = "bench_stage_events"
+REPEAT = 7
+STAGES = ["起訴", "調解", "準備程序", "言詞辯論", "一審宣判", "上訴", "二審", "執行"]
+
+
+def _seed(n: int) -> None:
+    today = date.today()
+    rows = []
+    for i in range(n):
+        stages, times = {}, {}
+        for j, s in enumerate(STAGES):
+            d = today + timedelta(days=random.randint(-720, 360))
+            stages[s] = d.isoformat()
+            if j % 2:
+                times[s] = f"{9 + j}:30"
+        rows.append({"cid": CLIENT_ID, "case_id": f"S{i:07d}", "client": f"當事人{i % 3000}",
+                     "stages": json.dumps(stages, ensure_ascii=False), "times": json.dumps(times)})
+    with ENGINE.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO case_records (client_id, case_type, case_id, client, progress, progress_stages, progress_times)
+            VALUES (:cid, '民事', :case_id, :client, '起訴', CAST(:stages AS jsonb), CAST(:times AS jsonb))
+        """), rows)
+        conn.execute(text("ANALYZE case_stage_events"))
+
+
+def _legacy(conn, days: int) -> int:
+    # 與 utils/date_reminder.py 相同：逐案逐階段 strptime 後比對區間
+    today = datetime.now().date()
+    end = today + timedelta(days=days)
+    hits = 0
+    for stages, times in conn.execute(text(
+        "SELECT progress_stages, progress_times FROM case_records WHERE client_id = :cid"
+    ), {"cid": CLIENT_ID}):
+        for name, value in (stages or {}).items():
+            try:
+                d = datetime.strptime(value, "%Y-%m-%d").date()
+            except (TypeError, ValueError):
+                continue
+            if today <= d <= end:
+                (times or {}).get(name, "")
+                hits += 1
+    return hits
+
+
+def _time(fn):
+    samples, result = [], None
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    ensure_stage_events(ENGINE)
+    ensure_case_partition(ENGINE, CLIENT_ID)
+    try:
+        t0 = time.perf_counter()
+        _seed(n)
+        print(f"seed {n} cases × {len(STAGES)} stages (trigger 維護): {time.perf_counter() - t0:.1f}s")
+        with ENGINE.connect() as conn:
+            legacy_ms, legacy_hits = _time(lambda: _legacy(conn, 7))
+            indexed_ms, rows = _time(lambda: upcoming_stage_events(conn, CLIENT_ID, 7))
+        print(f"  python scan   {legacy_ms:9.2f} ms   {legacy_hits} stages")
+        print(f"  indexed       {indexed_ms:9.2f} ms   {len(rows)} stages")
+        print(f"  speedup       {legacy_ms / indexed_ms:9.1f}x")
+    finally:
+        with ENGINE.begin() as conn:
+            conn.execute(text("DELETE FROM case_records WHERE client_id = :cid"), {"cid": CLIENT_ID})
+            if is_partitioned(ENGINE):
+                conn.execute(text(f"DROP TABLE IF EXISTS {partition_name(CLIENT_ID)}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+刪除案件附件（管理用；API 沒有對外的刪除端點）
+- 同內容沒有其他案件參照時一併刪除 S3 物件（services/file_store.release）
+用法：python api/scripts/delete_case_file.py CLIENT_ID FILE_ID [FILE_ID ...] [--dry-run]
+Requires env: DATABASE_URL, S3_BUCKET, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from api.database import SessionLocal  # noqa: E402
+from api.models_files import FileBlob, ensure_file_blobs  # noqa: E402
+from api.services.file_store import release  # noqa: E402
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("client_id")
+    ap.add_argument("file_ids", nargs="+", type=int, metavar="FILE_ID")
+    ap.add_argument("--dry-run", action="store_true", help="只列出要刪的附件")
+    args = ap.parse_args()
+
+    ok = True
+    db = SessionLocal()
+    try:
+        ensure_file_blobs(db.get_bind())
+        for file_id in args.file_ids:
+            blob = db.query(FileBlob).filter(FileBlob.id == file_id, FileBlob.client_id == args.client_id).first()
+            if blob is None:
+                print(f"  ⚠️ #{file_id} 不存在或不屬於 {args.client_id}")
+                ok = False
+                continue
+            label = f"#{file_id} {blob.case_id}/{blob.filename}"
+            if args.dry_run:
+                print(f"  • {label}（dry-run，未刪除）")
+                continue
+            purged = release(db, blob)
+            print(f"  • {label} 已刪除" + ("，內容物件一併刪除" if purged else ""))
+    finally:
+        db.close()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
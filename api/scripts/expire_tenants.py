@@ -1,57 +1,38 @@
 #!/usr/bin/env python3
 """
 Mark expired paid tenants as inactive (tenant_status = FALSE).
-Use with Heroku Scheduler: `python expire_tenants.py`
+API 程序內的 timer wheel（api/services/plan_expiry.py）已在 paid_until 當下翻轉，
+不必再排程每小時執行；保留給 PLAN_EXPIRY_ENABLED=0 的部署或手動補跑：`python expire_tenants.py`
 Requires env: DATABASE_URL
 """
-from pathlib import Path
-import os, sys
+import os
+import sys
 from datetime import datetime
-from contextlib import closing
 from pathlib import Path
-import os
-from dotenv import load_dotenv  # 這行是關鍵，剛剛漏了
 
-# 載入專案根目錄的 .env
-env_path = Path(__file__).parent.parent.parent / ".env"
-load_dotenv(dotenv_path=env_path)
+from dotenv import load_dotenv
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL not set")
-
-print(f"✅ 已載入 DATABASE_URL: {DATABASE_URL}")
+# 載入專案根目錄的 .env
+ROOT = Path(__file__).resolve().parents[2]
+load_dotenv(dotenv_path=ROOT / ".env")
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
 
+if not os.getenv("DATABASE_URL"):
+    print('ERROR: DATABASE_URL not set', file=sys.stderr)
+    sys.exit(1)
 
-try:
-    import psycopg2
-except Exception as e:
-    print("ERROR: psycopg2 is required. Add it to requirements.txt", file=sys.stderr)
-    raise
+from api.services.plan_expiry import expire_due  # noqa: E402
 
-SQL = '''
-UPDATE login_users
-SET tenant_status = FALSE
-WHERE plan_type <> 'unpaid'
-  AND tenant_status = TRUE
-  AND paid_until IS NOT NULL
-  AND now() >= paid_until;
-'''
 
 def main():
-    dsn = os.getenv('DATABASE_URL')
-    if not dsn:
-        print('ERROR: DATABASE_URL not set', file=sys.stderr)
-        sys.exit(1)
     try:
-        with closing(psycopg2.connect(dsn)) as conn:
-            conn.autocommit = True
-            with closing(conn.cursor()) as cur:
-                cur.execute(SQL)
-                print(f'[{datetime.utcnow().isoformat()}Z] expired tenants updated:', cur.rowcount)
+        expired = expire_due()
     except Exception as e:
         print('ERROR:', e, file=sys.stderr)
         sys.exit(2)
+    print(f'[{datetime.utcnow().isoformat()}Z] expired tenants updated:', len(expired))
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+部署時的 schema 遷移（Procfile 的 release: 階段，每次部署跑一次）
+- 建索引 / 裝觸發器 / 回填都在這裡做，API 程序只檢查是否已安裝，不在請求路徑上跑 DDL
+- 每個步驟都可重複執行；索引以 api/online_index.ensure_index 建立（CONCURRENTLY，並修復 INVALID 索引）
+- 控制庫與各租戶 schema（login_users.tenant_db_url）分別跑各自需要的步驟
+
+用法：python api/scripts/migrate.py [--list] [--only 步驟 ...] [--skip-tenants]
+Requires env: DATABASE_URL
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List, NamedTuple
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+
+from api.database import ENGINE  # noqa: E402
+from api.models_files import install_file_blobs, install_file_transfers  # noqa: E402
+from api.routes.case_upsert_routes import create_cursor_table  # noqa: E402
+from api.services.case_list_cache import create_case_list_indexes  # noqa: E402
+from api.services.case_lookup import create_key_index  # noqa: E402
+from api.services.case_search import create_trgm_indexes  # noqa: E402
+from api.services.seat_counter import install_seat_counter  # noqa: E402
+from api.services.stage_reminders import install_stage_events  # noqa: E402
+from api.tenant_db import normalize_pg_url  # noqa: E402
+
+
+class Step(NamedTuple):
+    name: str
+    run: Callable[[Engine], None]
+    control: bool   # 控制庫（共用 case_records / login_users 等）
+    tenant: bool    # 每個租戶 schema
+
+
+STEPS: List[Step] = [
+    Step("seat_counter", install_seat_counter, control=True, tenant=False),
+    Step("stage_events", install_stage_events, control=True, tenant=False),
+    Step("file_blobs", install_file_blobs, control=True, tenant=False),
+    Step("file_transfers", install_file_transfers, control=True, tenant=False),
+    Step("case_upsert_cursors", create_cursor_table, control=True, tenant=False),
+    Step("case_list_indexes", create_case_list_indexes, control=True, tenant=False),
+    Step("case_lookup_index", create_key_index, control=True, tenant=True),
+    Step("case_search_trgm", create_trgm_indexes, control=True, tenant=True),
+]
+
+
+def _tenant_urls():
+    with ENGINE.connect() as conn:
+        return conn.execute(text("""
+            SELECT client_id, tenant_db_url FROM login_users
+            WHERE tenant_db_url IS NOT NULL AND tenant_db_url <> ''
+            ORDER BY client_id
+        """)).fetchall()
+
+
+def _run(step: Step, engine: Engine, label: str) -> bool:
+    started = time.monotonic()
+    try:
+        step.run(engine)
+    except Exception as e:
+        print(f"  ❌ {step.name} @ {label}: {e}")
+        return False
+    print(f"  • {step.name} @ {label}（{time.monotonic() - started:.1f}s）")
+    return True
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--list", action="store_true", help="列出步驟後結束")
+    ap.add_argument("--only", nargs="+", metavar="STEP")
+    ap.add_argument("--skip-tenants", action="store_true")
+    args = ap.parse_args()
+
+    if args.list:
+        for s in STEPS:
+            scope = "+".join(n for n, on in (("control", s.control), ("tenant", s.tenant)) if on)
+            print(f"{s.name:<28} {scope}")
+        return 0
+
+    steps = [s for s in STEPS if not args.only or s.name in args.only]
+    ok = True
+    for step in (s for s in steps if s.control):
+        ok &= _run(step, ENGINE, "control")
+
+    tenant_steps = [s for s in steps if s.tenant]
+    if tenant_steps and not args.skip_tenants:
+        for client_id, url in _tenant_urls():
+            engine = create_engine(normalize_pg_url(url), pool_pre_ping=True, future=True)
+            try:
+                for step in tenant_steps:
+                    ok &= _run(step, engine, f"tenant:{client_id}")
+            finally:
+                engine.dispose()
+
+    print("✅ 遷移完成" if ok else "⚠️ 有步驟失敗，請查看上方訊息")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
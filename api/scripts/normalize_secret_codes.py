@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+把 login_users.secret_code 既有資料正規化（去零寬字元、全形轉半形、去頭尾空白；空字串改 NULL），
+之後暗號比對可直接用等號走 secret_code 唯一索引。新寫入的資料由 LoginUser 模型自動正規化。
+
+用法：python api/scripts/normalize_secret_codes.py [--dry-run]
+正規化後若與其他帳號的暗號重複，該筆不更新並列出，請人工處理。
+Requires env: DATABASE_URL
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import text  # noqa: E402
+
+from api.database import ENGINE  # noqa: E402
+from api.tenant_meta import normalize_secret_code  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    with ENGINE.begin() as conn:
+        rows = conn.execute(text(
+            "SELECT id, client_id, secret_code FROM login_users WHERE secret_code IS NOT NULL FOR UPDATE"
+        )).fetchall()
+        taken = {r.secret_code for r in rows if normalize_secret_code(r.secret_code) == r.secret_code}
+        changed = conflicts = 0
+        for r in rows:
+            code = normalize_secret_code(r.secret_code)
+            if code == r.secret_code:
+                continue
+            if code is not None and code in taken:
+                conflicts += 1
+                print(f"  ⚠️ {r.client_id}: {r.secret_code!r} → {code!r} 與其他帳號重複，略過")
+                continue
+            print(f"• {r.client_id}: {r.secret_code!r} → {code!r}")
+            if not args.dry_run:
+                conn.execute(text("UPDATE login_users SET secret_code = :c WHERE id = :id"), {"c": code, "id": r.id})
+            if code is not None:
+                taken.add(code)
+            changed += 1
+
+    mode = "（dry-run，未寫入）" if args.dry_run else ""
+    print(f"✅ 正規化 {changed} 筆，衝突 {conflicts} 筆{mode}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+把 case_records 轉成依 client_id LIST 分割的表，並把 /api/cases/upload 舊有的
+case_records_<client> 每租戶表搬進對應分割。
+
+用法：python api/scripts/partition_case_records.py [--dry-run] [--drop-legacy] [--skip-tenant-tables]
+  --dry-run             全部執行後 ROLLBACK，只印出會搬動的筆數
+  --drop-legacy         搬完後刪除舊表（預設改名為 *_migrated 保留）
+  --skip-tenant-tables  只轉換共用 case_records，不處理每租戶表
+
+整個流程在單一交易內完成；執行完畢後請重新啟動 API（各程序會快取表的佈局）。
+Requires env: DATABASE_URL
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from sqlalchemy import text  # noqa: E402
+
+from api.case_partitions import DEFAULT_PARTITION, PARENT, create_partition, partition_name  # noqa: E402
+from api.database import ENGINE  # noqa: E402
+from api.routes.case_upload_routes import _tenant_table_name  # noqa: E402
+
+LEGACY = "case_records_unpartitioned"
+STAGING = "case_records_partitioned"
+STAGE_TRIGGER = "trg_case_stage_events"
+
+
+class _DryRun(Exception):
+    pass
+
+
+def _columns(conn, table: str) -> Dict[str, str]:
+    rows = conn.execute(text("""
+        SELECT column_name, data_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = :t
+        ORDER BY ordinal_position
+    """), {"t": table}).fetchall()
+    return {r[0]: r[1] for r in rows}
+
+
+def _relkind(conn, table: str):
+    return conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}).scalar()
+
+
+def move_stage_trigger(conn) -> bool:
+    """
+    期日提醒觸發器（api/migrations/05_case_stage_events.sql）掛在表上，改名後會留在 LEGACY；
+    改到新的分割父表（各分割自動繼承）。資料搬完才建，case_pk 沿用 id，已有的 case_stage_events 與 reminded_on 不動。
+    """
+    on_legacy = conn.execute(text(
+        "SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(:t) AND tgname = :n"
+    ), {"t": LEGACY, "n": STAGE_TRIGGER}).first()
+    if not on_legacy:
+        return False
+    conn.execute(text(f"DROP TRIGGER {STAGE_TRIGGER} ON {LEGACY}"))
+    # 與 05_case_stage_events.sql 相同的定義
+    conn.execute(text(f"""
+        CREATE TRIGGER {STAGE_TRIGGER}
+        AFTER INSERT OR DELETE
+           OR UPDATE OF progress_stages, progress_times, client_id, case_id, case_type, client, case_number, court, division
+           ON {PARENT}
+        FOR EACH ROW
+        EXECUTE FUNCTION sync_case_stage_events()
+    """))
+    print(f"• {STAGE_TRIGGER} 已由 {LEGACY} 移到 {PARENT}")
+    return True
+
+
+def convert_parent(conn) -> int:
+    """舊 case_records → 分割表；回傳搬移筆數。已是分割表則回傳 0。"""
+    kind = _relkind(conn, PARENT)
+    if kind == "p":
+        print("• case_records 已是分割表，略過轉換")
+        return 0
+    if kind is None:
+        raise RuntimeError("case_records 不存在")
+
+    # /api/cases/upload 併入後會寫 updated_at；先補齊，LIKE 才會帶到分割表
+    conn.execute(text(f"""
+        ALTER TABLE {PARENT}
+            ADD COLUMN IF NOT EXISTS uploaded_by TEXT,
+            ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ DEFAULT NOW(),
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW()
+    """))
+
+    conn.execute(text(f"CREATE TABLE {STAGING} (LIKE {PARENT} INCLUDING DEFAULTS) PARTITION BY LIST (client_id)"))
+    seq = conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": PARENT}).scalar()
+    if not seq:
+        raise RuntimeError("case_records.id 不是 serial 欄位，無法沿用序號")
+    # 序號改掛到新表，之後刪除舊表也不會連帶刪掉
+    conn.execute(text(f"ALTER SEQUENCE {seq} OWNED BY {STAGING}.id"))
+
+    conn.execute(text(f"ALTER TABLE {PARENT} RENAME TO {LEGACY}"))
+    conn.execute(text(f"ALTER TABLE {STAGING} RENAME TO {PARENT}"))
+
+    # 分割表的唯一約束必須包含分割鍵；主鍵 (id) 放在各分割上
+    conn.execute(text(f"CREATE UNIQUE INDEX ux_case_records_p_client_type_case ON {PARENT} (client_id, case_type, case_id)"))
+    conn.execute(text(f"CREATE INDEX ix_case_records_p_case_id ON {PARENT} (case_id)"))
+    conn.execute(text(f"CREATE INDEX ix_case_records_p_case_type ON {PARENT} (case_type)"))
+    conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT"))
+    conn.execute(text(f"ALTER TABLE {DEFAULT_PARTITION} ADD PRIMARY KEY (id)"))
+
+    client_ids = conn.execute(text(
+        f"SELECT DISTINCT client_id FROM {LEGACY} WHERE client_id IS NOT NULL AND client_id <> ''"
+    )).scalars().all()
+    for cid in client_ids:
+        create_partition(conn, cid)
+
+    orphans = conn.execute(text(f"SELECT COUNT(*) FROM {LEGACY} WHERE client_id IS NULL")).scalar()
+    if orphans:
+        # 唯一鍵含 client_id，NULL 不會去重；API 已拒收，舊資料請補上 client_id 後再處理
+        print(f"  ⚠️ {orphans} 筆 client_id 為 NULL，會落在 {DEFAULT_PARTITION}")
+    moved = conn.execute(text(f"INSERT INTO {PARENT} SELECT * FROM {LEGACY}")).rowcount
+    # 之後 fold_tenant_tables 寫入的列由觸發器展開
+    move_stage_trigger(conn)
+    print(f"• case_records：{moved} 筆搬入 {len(client_ids)} 個租戶分割（舊表改名 {LEGACY}）")
+    return moved
+
+
+def _select_expr(col: str, src_type: str, dst_type: str) -> str:
+    if col == "case_type":
+        return "COALESCE(case_type, '')"  # 分割表 case_type 為 NOT NULL
+    if src_type.startswith("timestamp") and dst_type in ("text", "character varying"):
+        # 舊表 progress_date 為 timestamptz；共用表存字串
+        return (f"CASE WHEN {col}::time = '00:00' THEN to_char({col}, 'YYYY-MM-DD') "
+                f"ELSE to_char({col}, 'YYYY-MM-DD HH24:MI') END")
+    if src_type == "json" and dst_type == "jsonb":
+        return f"{col}::jsonb"
+    return col
+
+
+def fold_tenant_tables(conn, drop_legacy: bool) -> List[Tuple[str, str, int, int]]:
+    """case_records_<client> → 對應分割；以 (client_id, case_type, case_id) 去重，共用表既有資料優先。"""
+    by_table = {}
+    for cid in conn.execute(text("SELECT client_id FROM login_users WHERE client_id IS NOT NULL")).scalars():
+        by_table[_tenant_table_name(cid)] = cid
+
+    existing = set(conn.execute(text("""
+        SELECT tablename FROM pg_tables
+        WHERE schemaname = current_schema() AND tablename LIKE 'case\\_records\\_%'
+    """)).scalars())
+    unknown = sorted(t for t in existing - set(by_table)
+                     if not t.startswith("case_records_p_") and t not in (LEGACY,) and not t.endswith("_migrated"))
+    for t in unknown:
+        print(f"  ⚠️ {t} 對應不到 login_users.client_id，略過")
+
+    dst_cols = _columns(conn, PARENT)
+    results = []
+    for tbl in sorted(existing & set(by_table)):
+        cid = by_table[tbl]
+        src_cols = _columns(conn, tbl)
+        cols = [c for c in src_cols if c in dst_cols and c not in ("id", "client_id")]
+        exprs = [_select_expr(c, src_cols[c], dst_cols[c]) for c in cols]
+
+        create_partition(conn, cid)
+        total = conn.execute(text(f"SELECT COUNT(*) FROM {tbl}")).scalar()
+        inserted = conn.execute(text(f"""
+            INSERT INTO {PARENT} (client_id, {", ".join(cols)})
+            SELECT :cid, {", ".join(exprs)} FROM {tbl}
+            WHERE case_id IS NOT NULL
+            ON CONFLICT (client_id, case_type, case_id) DO NOTHING
+        """), {"cid": cid}).rowcount
+
+        if drop_legacy:
+            conn.execute(text(f"DROP TABLE {tbl}"))
+        else:
+            conn.execute(text(f"ALTER TABLE {tbl} RENAME TO {tbl[:54]}_migrated"))
+        results.append((tbl, cid, inserted, total - inserted))
+        print(f"• {tbl} → {partition_name(cid)}：寫入 {inserted}，略過 {total - inserted}（case_id 為空或重複）")
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--drop-legacy", action="store_true")
+    ap.add_argument("--skip-tenant-tables", action="store_true")
+    args = ap.parse_args()
+
+    try:
+        with ENGINE.begin() as conn:
+            # 轉換期間擋住寫入，避免漏搬
+            conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+            conn.execute(text(f"LOCK TABLE {PARENT} IN ACCESS EXCLUSIVE MODE"))
+            convert_parent(conn)
+            if not args.skip_tenant_tables:
+                fold_tenant_tables(conn, args.drop_legacy)
+            if args.drop_legacy and _relkind(conn, LEGACY):
+                conn.execute(text(f"DROP TABLE {LEGACY}"))
+            if args.dry_run:
+                raise _DryRun()
+    except _DryRun:
+        print("🔎 dry-run：已 ROLLBACK，資料庫未變更")
+        return
+
+    with ENGINE.begin() as conn:
+        conn.execute(text(f"ANALYZE {PARENT}"))
+    print("✅ 完成；請重新啟動 API 程序以套用分割佈局")
+
+
+if __name__ == "__main__":
+    main()
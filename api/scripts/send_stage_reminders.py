@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+發送一次期日提醒（供 cron / Heroku Scheduler 使用；app 內的定期任務需 REMINDER_ENABLED=1）
+用法：python api/scripts/send_stage_reminders.py [--days N] [--dry-run]
+--dry-run 只列出到期階段與收件人數，不發送也不標記
+Requires env: DATABASE_URL, LINE_CHANNEL_ACCESS_TOKEN
+"""
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from api.database import dispose_async_engine  # noqa: E402
+from api.services.line_service import line_push  # noqa: E402
+from api.services.stage_reminders import REMINDER_DAYS_AHEAD, run_once  # noqa: E402
+
+
+async def _main(days: int, dry_run: bool) -> None:
+    try:
+        totals = await run_once(days_ahead=days, dry_run=dry_run)
+    finally:
+        await line_push.stop()
+        await dispose_async_engine()
+    mode = "（dry-run，未發送）" if dry_run else ""
+    print(f"✅ 提醒 {totals['events']} 個階段，送出 {totals['messages']} 則，失敗 {totals['failed_events']} 個{mode}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--days", type=int, default=REMINDER_DAYS_AHEAD, help="提醒今天起幾天內的階段")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+    asyncio.run(_main(args.days, args.dry_run))
+
+
+if __name__ == "__main__":
+    main()
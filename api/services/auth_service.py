@@ -7,8 +7,14 @@ from datetime import datetime
 # 使用新的資料庫模型
 try:
     from api.models_control import LoginUser, ClientLineUsers
+    from api.services.line_identity import line_identity
+    from api.services.seat_counter import ensure_seat_counter
+    from api.tenant_meta import get_plan_status
 except ImportError:
     from models_control import LoginUser, ClientLineUsers
+    from services.line_identity import line_identity
+    from services.seat_counter import ensure_seat_counter
+    from tenant_meta import get_plan_status
 
 class AuthService:
     """認證服務類別 - 適配新資料庫結構"""
@@ -84,42 +90,27 @@ class AuthService:
     def check_user_plan_status(self, line_user_id: str, db: Session) -> Optional[Dict[str, Any]]:
         """檢查LINE用戶的方案狀態"""
         try:
-            # 查詢用戶綁定資訊
-            line_user = db.query(ClientLineUsers).filter(
-                ClientLineUsers.line_user_id == line_user_id,
-                ClientLineUsers.is_active == True
-            ).first()
-
-            if not line_user:
+            # 綁定與方案都走快取（line_identity / 方案快照），命中時不查 login_users
+            ident = line_identity.resolve(db, line_user_id)
+            if not (ident.bound and ident.bound_active is True):
                 return None
 
-            # 取得事務所資訊
-            client = db.query(LoginUser).filter(
-                LoginUser.client_id == line_user.client_id
-            ).first()
-
-            if not client:
+            # current_users 由觸發器維護（快照內僅供顯示）
+            ensure_seat_counter(db.get_bind())
+            plan = get_plan_status(ident.client_id)
+            if not plan:
                 return None
 
-            # 計算實際用戶數
-            actual_users = db.query(ClientLineUsers).filter(
-                ClientLineUsers.client_id == client.client_id,
-                ClientLineUsers.is_active == True
-            ).count()
-
-            # 更新實際用戶數
-            client.current_users = actual_users
-            db.commit()
-
+            actual_users = plan.current_users
             return {
                 "line_user_id": line_user_id,
-                "client_name": client.client_name,
-                "plan_type": client.plan_type,
-                "user_status": client.user_status,
+                "client_name": plan.client_name,
+                "plan_type": plan.plan_type,
+                "user_status": plan.user_status,
                 "current_users": actual_users,
-                "max_users": client.max_users,
-                "usage_percentage": round((actual_users / client.max_users) * 100, 1),
-                "is_plan_active": client.user_status == "active"
+                "max_users": plan.max_users,
+                "usage_percentage": round((actual_users / plan.max_users) * 100, 1) if plan.max_users else 0.0,
+                "is_plan_active": plan.user_status == "active"
             }
 
         except Exception as e:
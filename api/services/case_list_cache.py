@@ -0,0 +1,136 @@
+# api/services/case_list_cache.py
+# -*- coding: utf-8 -*-
+"""
+「?」我的案件清單（/api/user/my-cases）
+- 與查詢相符的複合索引：(client | opposing_party, updated_date, updated_at, id)，排序可直接走索引；
+  由部署時的 api/scripts/migrate.py 建立（create_case_list_indexes）
+- 以姓名為鍵快取整理好的選單內容（分類 buckets / 單筆詳情）
+- 案件 upsert 觸及該當事人或對造時作廢；TTL 只是多程序部署下的保險
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+try:
+    from api.online_index import ensure_index
+    from api.schema_registry import schema_registry
+except ImportError:
+    from online_index import ensure_index  # type: ignore
+    from schema_registry import schema_registry  # type: ignore
+
+CASE_LIST_TTL_SECONDS = int(os.getenv("CASE_LIST_CACHE_TTL_SECONDS", "900"))
+CASE_LIST_MAX_ENTRIES = int(os.getenv("CASE_LIST_CACHE_MAX_ENTRIES", "5000"))
+
+# 與 my_cases 的 ORDER BY 相同，順序掃描索引即可，不需另外排序
+_ORDER = ("updated_date DESC NULLS LAST", "updated_at DESC NULLS LAST", "id DESC")
+_INDEXES = {"client": "ix_case_records_client_recent", "opposing_party": "ix_case_records_opposing_recent"}
+
+
+def case_list_index_specs(has_updated_at: bool = True) -> Tuple[Tuple[str, str], ...]:
+    """(索引名稱, ON case_records 之後的定義)"""
+    order = [o for o in _ORDER if has_updated_at or not o.startswith("updated_at")]
+    return tuple((name, f"({col}, {', '.join(order)})") for col, name in _INDEXES.items())
+
+
+def create_case_list_indexes(engine: Engine) -> None:
+    """部署時執行（api/scripts/migrate.py）；CONCURRENTLY 建立並修復 INVALID 索引，不在請求路徑上跑"""
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT to_regclass('case_records')")).scalar() is None:
+            return
+        has_updated_at = conn.execute(text("""
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = to_regclass('case_records') AND attname = 'updated_at' AND NOT attisdropped
+        """)).first() is not None
+    for name, body in case_list_index_specs(has_updated_at):
+        ensure_index(engine, name, "case_records", body)
+
+
+class CaseListCache:
+    def __init__(self, ttl: int = CASE_LIST_TTL_SECONDS, max_entries: int = CASE_LIST_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        # (姓名, 是否含對造) -> (到期時間, 選單內容)
+        self._entries: "OrderedDict[Tuple[str, bool], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+        self._generation = 0  # 每次作廢 +1；查詢期間有作廢就不寫回，避免快取到舊資料
+
+    def get(self, name: str, include_as_opponent: bool) -> Optional[Dict[str, Any]]:
+        key = (name, bool(include_as_opponent))
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None or hit[0] <= time.monotonic():
+                self._entries.pop(key, None)
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return hit[1]
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def put(self, name: str, include_as_opponent: bool, view: Dict[str, Any],
+            generation: Optional[int] = None) -> None:
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[(name, bool(include_as_opponent))] = (time.monotonic() + self.ttl, view)
+            self._entries.move_to_end((name, bool(include_as_opponent)))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate(self, names: Iterable[Optional[str]]) -> None:
+        """names：upsert 前後的 client / opposing_party；請在 commit 之後呼叫。"""
+        wanted: Set[str] = {n.strip() for n in names if isinstance(n, str) and n.strip()}
+        if not wanted:
+            return
+        with self._lock:
+            for key in [k for k in self._entries if k[0] in wanted]:
+                del self._entries[key]
+            self._generation += 1
+            self._counters["invalidations"] += 1
+
+    def clear(self, _tag: Optional[str] = None) -> None:
+        """可直接當 schema_registry 的 listener。"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._counters["invalidations"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "ttl_seconds": self.ttl}
+
+
+def names_in(rows: Iterable[Dict[str, Any]]) -> Set[str]:
+    """一批案件資料中出現的當事人 / 對造姓名。"""
+    out: Set[str] = set()
+    for r in rows:
+        for col in ("client", "opposing_party"):
+            v = r.get(col)
+            if isinstance(v, str) and v.strip():
+                out.add(v.strip())
+    return out
+
+
+def prior_names(db, case_ids: Iterable[Optional[str]]) -> Set[str]:
+    """upsert 前查出既有的當事人 / 對造（改名時舊姓名的快取也要作廢）；db 可為 Session 或 Connection。"""
+    ids = sorted({str(c) for c in case_ids if c})
+    if not ids:
+        return set()
+    rows = db.execute(text("SELECT client, opposing_party FROM case_records WHERE case_id = ANY(:ids)"),
+                      {"ids": ids}).fetchall()
+    return names_in(dict(r._mapping) for r in rows)
+
+
+case_list_cache = CaseListCache()
+schema_registry.add_listener(case_list_cache.clear)
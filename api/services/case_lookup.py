@@ -0,0 +1,138 @@
+# api/services/case_lookup.py
+# -*- coding: utf-8 -*-
+"""
+律師「查案」用的案件查詢快取（每個租戶 engine 一份）
+- 第一次查詢時解析 case_records 的欄位與案號欄位，組好查詢語句後重用
+- 案號欄位的索引由部署時的 api/scripts/migrate.py 建立（create_key_index），請求路徑不跑 DDL
+- schema_registry.rearm / tenant_bootstrap 遷移後自動作廢
+"""
+
+import threading
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.sql.elements import TextClause
+
+try:
+    from api.online_index import ensure_index
+    from api.schema_registry import _engine_key, schema_registry
+except ImportError:
+    from online_index import ensure_index  # type: ignore
+    from schema_registry import _engine_key, schema_registry  # type: ignore
+
+# 依優先順序挑第一個存在的欄位當案號
+KEY_CANDIDATES = ("case_no", "case_number", "caseid", "case_id")
+
+_COLUMNS_SQL = text("""
+    SELECT a.attname
+    FROM pg_attribute a
+    WHERE a.attrelid = to_regclass('case_records') AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum
+""")
+# 以該欄位開頭的索引（to_regclass 依 search_path 解析，租戶 schema 也適用）
+_INDEXED_SQL = text("""
+    SELECT 1
+    FROM pg_index i
+    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+    WHERE i.indrelid = to_regclass('case_records') AND a.attname = :col
+    LIMIT 1
+""")
+
+
+class CaseLookup(NamedTuple):
+    client_id: str
+    key: Optional[str]   # 用來比對案號的欄位；None 代表表裡沒有案號欄位
+    columns: Tuple[str, ...]
+    stmt: Optional[TextClause]  # None 代表 case_records 不存在
+
+
+def _quote(col: str) -> str:
+    return '"' + col.replace('"', '""') + '"'
+
+
+def _key_column(columns: Tuple[str, ...]) -> Optional[str]:
+    lowered = {c.lower(): c for c in columns}
+    return next((lowered[c] for c in KEY_CANDIDATES if c in lowered), None)
+
+
+def create_key_index(engine: Engine) -> None:
+    """部署時執行（api/scripts/migrate.py）：案號欄位沒有索引就建一個（CONCURRENTLY）"""
+    with engine.connect() as conn:
+        col = _key_column(tuple(r[0] for r in conn.execute(_COLUMNS_SQL)))
+        if not col or conn.execute(_INDEXED_SQL, {"col": col}).first():
+            return
+    ensure_index(engine, f"ix_case_records_lookup_{col.lower()}", "case_records", f"({_quote(col)})")
+
+
+class CaseLookupCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], CaseLookup] = {}  # (client_id, engine URL) -> lookup
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0, "retries": 0}
+
+    def _resolve(self, engine: Engine, client_id: str) -> CaseLookup:
+        with engine.connect() as conn:
+            columns = tuple(r[0] for r in conn.execute(_COLUMNS_SQL))
+        if not columns:
+            return CaseLookup(client_id, None, (), None)
+
+        key = _key_column(columns)
+
+        select_list = ", ".join(_quote(c) for c in columns)
+        if key:
+            stmt = text(f"SELECT {select_list} FROM case_records WHERE {_quote(key)} = :v LIMIT 1")
+        else:
+            # 退而求其次，直接撈一列（沿用舊行為）
+            stmt = text(f"SELECT {select_list} FROM case_records LIMIT 1")
+        return CaseLookup(client_id, key, columns, stmt)
+
+    def get(self, engine: Engine, client_id: str) -> CaseLookup:
+        cache_key = (client_id, _engine_key(engine))
+        with self._lock:
+            hit = self._entries.get(cache_key)
+            if hit is not None:
+                self._counters["hits"] += 1
+                return hit
+            self._counters["misses"] += 1
+        lookup = self._resolve(engine, client_id)
+        with self._lock:
+            self._entries[cache_key] = lookup
+        return lookup
+
+    def find(self, engine: Engine, client_id: str, case_no: str) -> Dict[str, Any]:
+        """以快取的語句查一筆；欄位被改掉（UndefinedColumn 等）時重新解析一次。"""
+        for attempt in (0, 1):
+            lookup = self.get(engine, client_id)
+            if lookup.stmt is None:
+                return {}
+            try:
+                with engine.connect() as conn:
+                    row = conn.execute(lookup.stmt, {"v": case_no}).first()
+                return dict(row._mapping) if row else {}
+            except ProgrammingError:
+                if attempt:
+                    raise
+                with self._lock:
+                    self._counters["retries"] += 1
+                self.invalidate(client_id)
+        return {}
+
+    def invalidate(self, client_id: Optional[str] = None) -> None:
+        """client_id=None 代表全部清空；可直接當 schema_registry 的 listener。"""
+        with self._lock:
+            self._counters["invalidations"] += 1
+            if client_id is None:
+                self._entries.clear()
+            else:
+                for k in [k for k in self._entries if k[0] == client_id]:
+                    del self._entries[k]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries)}
+
+
+case_lookup_cache = CaseLookupCache()
+schema_registry.add_listener(case_lookup_cache.invalidate)
@@ -0,0 +1,187 @@
+# api/services/case_search.py
+# -*- coding: utf-8 -*-
+"""
+律師案件搜尋（pg_trgm 相似度排序 + keyset 分頁）
+- 比對欄位：client / case_number / case_id / opposing_party
+- 先以 ILIKE 子字串篩選；完全沒有命中時才改用 % 相似運算子（容錯打錯字）
+  兩者都能走 gin_trgm_ops 索引（控制庫由 api/scripts/migrate.py、新租戶由 tenant_bootstrap 建立）
+- 依 GREATEST(similarity(...)) 由高到低排序，同分再依 id；游標為 (模式, score, id)
+- 資料庫沒有 pg_trgm 時退回純 ILIKE（分數只分「完全相符 / 部分相符」）
+"""
+
+import base64
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+try:
+    from api.online_index import ensure_index
+    from api.schema_registry import _engine_key
+except ImportError:
+    from online_index import ensure_index  # type: ignore
+    from schema_registry import _engine_key  # type: ignore
+
+TRGM_COLUMNS = ("client", "case_number", "case_id", "opposing_party")
+RESULT_COLUMNS = ("id", "case_type", "case_id", "case_number", "client", "opposing_party", "progress")
+SEARCH_PAGE_SIZE = int(os.getenv("CASE_SEARCH_PAGE_SIZE", "10"))
+# 相似度篩選門檻（只在子字串沒命中時使用）；中文姓名錯一字約 0.33
+FUZZY_THRESHOLD = float(os.getenv("CASE_SEARCH_FUZZY_THRESHOLD", "0.3"))
+# 「查看更多」記住每位使用者上一次搜尋的游標
+MORE_TTL_SECONDS = int(os.getenv("CASE_SEARCH_MORE_TTL_SECONDS", "600"))
+MORE_MAX_USERS = 5000
+
+_EXT_SQL = text("SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace "
+                "WHERE e.extname = 'pg_trgm'")
+
+_lock = threading.Lock()
+_trgm_schema: Dict[str, Optional[str]] = {}  # engine URL -> pg_trgm 所在 schema（None 代表未安裝）
+_recent: Dict[str, Tuple[float, str, str]] = {}  # line_user_id -> (到期時間, 關鍵字, 下一頁游標)
+
+
+class SearchPage(NamedTuple):
+    rows: List[Dict[str, Any]]
+    next_cursor: Optional[str]
+
+
+def trgm_index_specs(ext_schema: str, table: str = "case_records") -> List[Tuple[str, str]]:
+    """每個比對欄位一個 GIN 索引 (名稱, ON 之後的定義)；租戶 schema 的 search_path 不含 public，opclass 需帶 schema。"""
+    return [(f"ix_{table}_trgm_{col}", f"USING gin ({col} {ext_schema}.gin_trgm_ops)") for col in TRGM_COLUMNS]
+
+
+def trgm_index_ddl(ext_schema: str, table: str = "case_records") -> List[str]:
+    return [f"CREATE INDEX IF NOT EXISTS {name} ON {table} {body}"
+            for name, body in trgm_index_specs(ext_schema, table)]
+
+
+def create_trgm_indexes(engine) -> None:
+    """部署時 / tenant_bootstrap 執行：以 CONCURRENTLY 建索引，不擋其他租戶寫入；沒有 pg_trgm 就略過"""
+    with engine.connect() as conn:
+        ext_schema = conn.execute(_EXT_SQL).scalar()
+    if not ext_schema:
+        return
+    for name, body in trgm_index_specs(ext_schema):
+        ensure_index(engine, name, "case_records", body)
+
+
+def build_search_sql(ext_schema: Optional[str], has_cursor: bool, scoped: bool = False,
+                     table: str = "case_records", fuzzy: bool = False) -> str:
+    if fuzzy:
+        where = "({})".format(" OR ".join(f"{c} OPERATOR({ext_schema}.%) :k" for c in TRGM_COLUMNS))
+    else:
+        where = "({})".format(" OR ".join(f"{c} ILIKE :pat" for c in TRGM_COLUMNS))
+    if ext_schema:
+        score = "COALESCE(GREATEST({}), 0)::real".format(
+            ", ".join(f"{ext_schema}.similarity({c}, :k)" for c in TRGM_COLUMNS))
+    else:
+        score = "(CASE WHEN case_id = :k OR case_number = :k OR client = :k THEN 1 ELSE 0.5 END)::real"
+    if scoped:
+        where += " AND client_id = :client_id"  # 分割佈局下只掃該租戶的分割
+    after = "WHERE (m.score, m.id) < (CAST(:after_score AS real), :after_id)" if has_cursor else ""
+    return f"""
+        SELECT * FROM (
+            SELECT {", ".join(RESULT_COLUMNS)}, {score} AS score
+            FROM {table}
+            WHERE {where}
+        ) m
+        {after}
+        ORDER BY m.score DESC, m.id DESC
+        LIMIT :limit
+    """
+
+
+def encode_cursor(score: float, row_id: int, fuzzy: bool = False) -> str:
+    raw = f"{'f' if fuzzy else 's'}:{score!r}:{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[bool, float, int]]:
+    """回傳 (是否為相似度模式, score, id)；格式錯誤視為沒有游標。"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        mode, score, row_id = raw.split(":", 2)
+        return mode == "f", float(score), int(row_id)
+    except Exception:
+        return None
+
+
+def _escape_like(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def _get_trgm_schema(db: AsyncSession) -> Optional[str]:
+    key = _engine_key(db.get_bind())
+    with _lock:
+        if key in _trgm_schema:
+            return _trgm_schema[key]
+    schema = (await db.execute(_EXT_SQL)).scalar()
+    with _lock:
+        _trgm_schema[key] = schema
+    return schema
+
+
+async def search_cases(db: AsyncSession, key: str, cursor: Optional[str] = None,
+                       limit: int = SEARCH_PAGE_SIZE, client_id: Optional[str] = None) -> SearchPage:
+    """回傳一頁結果與下一頁游標（沒有下一頁時為 None）。"""
+    key = (key or "").strip()
+    if not key:
+        return SearchPage([], None)
+    after = decode_cursor(cursor)
+    ext_schema = await _get_trgm_schema(db)
+
+    params: Dict[str, Any] = {"k": key, "pat": f"%{_escape_like(key)}%", "limit": limit + 1}
+    if after:
+        params.update(after_score=after[1], after_id=after[2])
+    if client_id:
+        params["client_id"] = client_id
+
+    async def run(fuzzy: bool) -> List[Dict[str, Any]]:
+        if fuzzy:
+            await db.execute(text("SELECT set_config('pg_trgm.similarity_threshold', :t, true)"),
+                             {"t": str(FUZZY_THRESHOLD)})
+        sql = build_search_sql(ext_schema, has_cursor=after is not None, scoped=bool(client_id), fuzzy=fuzzy)
+        return [dict(r._mapping) for r in (await db.execute(text(sql), params)).fetchall()]
+
+    fuzzy = bool(after and after[0])
+    rows = await run(fuzzy)
+    if not rows and not after and ext_schema:
+        # 子字串完全沒命中 → 改用相似度（例如打錯一個字）
+        fuzzy = True
+        rows = await run(fuzzy)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["score"], rows[-1]["id"], fuzzy)
+    return SearchPage(rows, next_cursor)
+
+
+def remember_search(line_user_id: Optional[str], key: str, next_cursor: Optional[str]) -> None:
+    if not line_user_id:
+        return
+    with _lock:
+        if next_cursor is None:
+            _recent.pop(line_user_id, None)
+            return
+        if len(_recent) >= MORE_MAX_USERS:
+            now = time.monotonic()
+            for uid in [u for u, v in _recent.items() if v[0] <= now] or [next(iter(_recent))]:
+                del _recent[uid]
+        _recent[line_user_id] = (time.monotonic() + MORE_TTL_SECONDS, key, next_cursor)
+
+
+def recall_search(line_user_id: Optional[str]) -> Optional[Tuple[str, str]]:
+    """「查看更多」：回傳 (關鍵字, 游標)；過期或沒有下一頁則為 None。"""
+    if not line_user_id:
+        return None
+    with _lock:
+        hit = _recent.get(line_user_id)
+        if not hit or hit[0] <= time.monotonic():
+            _recent.pop(line_user_id, None)
+            return None
+        return hit[1], hit[2]
@@ -1,19 +1,33 @@
-
 # api/services/engagement_service.py
 # 記錄使用者最後互動時間，並判斷是否超過閒置門檻
+# - 最後互動時間放在程序記憶體，閒置判斷不碰 DB；每個 line_user_id 只在第一次出現時讀一次
+# - 變更累積起來，由背景任務每 ENGAGEMENT_FLUSH_SECONDS 秒（與 shutdown 時）一次批次寫回
 
+import asyncio
+import os
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from sqlalchemy import Column, Integer, String, DateTime, func, text
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 try:
     from api.database import Base, ENGINE
 except ImportError:
-    from database import Base  # type: ignore
+    from database import Base, ENGINE  # type: ignore
 
 from sqlalchemy import inspect
 
+try:
+    from api.schema_registry import schema_registry
+except ImportError:
+    from schema_registry import schema_registry  # type: ignore
+
+ENGAGEMENT_FLUSH_SECONDS = float(os.getenv("ENGAGEMENT_FLUSH_SECONDS", "5"))
+ENGAGEMENT_MAX_ENTRIES = int(os.getenv("ENGAGEMENT_MAX_ENTRIES", "50000"))
+ENGAGEMENT_FLUSH_BATCH = 1000
+
 # 動態宣告，避免修改既有 models_control 結構
 class UserEngagement(Base):
     __tablename__ = 'user_engagements'
@@ -22,49 +36,234 @@ class UserEngagement(Base):
     last_seen_at = Column(DateTime, nullable=False, server_default=func.now())
     last_reminded_at = Column(DateTime, nullable=True)
 
-def _ensure_table_exists(db: Session):
+def _create_table_if_missing(bind):
     # 若資料表不存在則建立（避免強依賴 Alembic）
-    inspector = inspect(db.bind)
+    inspector = inspect(bind)
     if 'user_engagements' not in inspector.get_table_names():
         # 用 Base.metadata.create_all 只創建當前 model 對應的表
-        UserEngagement.__table__.create(bind=db.bind, checkfirst=True)
+        UserEngagement.__table__.create(bind=bind, checkfirst=True)
+
+def _ensure_table_exists(db: Session):
+    # 每個程序只檢查一次（schema_registry 快取）
+    schema_registry.ensure(db.bind, "user_engagements", lambda: _create_table_if_missing(db.bind))
+
+
+def _utc(dt: Optional[datetime]) -> Optional[datetime]:
+    # 欄位是不含時區的 timestamp，內容一律視為 UTC
+    if dt is None:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _naive(dt: Optional[datetime]) -> Optional[datetime]:
+    return dt.astimezone(timezone.utc).replace(tzinfo=None) if dt else None
+
+
+def _later(a: Optional[datetime], b: Optional[datetime]) -> Optional[datetime]:
+    if a is None or b is None:
+        return a or b
+    return max(a, b)
+
+
+# 同一使用者多次互動只留最新時間；GREATEST（忽略 NULL）避免多程序互相把時間寫舊
+_FLUSH_SQL = """
+    INSERT INTO user_engagements (line_user_id, last_seen_at, last_reminded_at)
+    SELECT v.lid, v.seen, v.reminded
+    FROM (VALUES {values}) AS v(lid, seen, reminded)
+    ON CONFLICT (line_user_id) DO UPDATE
+    SET last_seen_at = GREATEST(user_engagements.last_seen_at, EXCLUDED.last_seen_at),
+        last_reminded_at = GREATEST(user_engagements.last_reminded_at, EXCLUDED.last_reminded_at)
+"""
+
+_LOAD_SQL = text("SELECT last_seen_at, last_reminded_at FROM user_engagements WHERE line_user_id = :lid")
+
+
+class EngagementTracker:
+    """
+    line_user_id -> [last_seen, last_reminded]（aware UTC）
+    多程序部署時各程序各自記憶；記憶判定「該提醒」時會回查 DB 一次，
+    合併其他程序已寫回的時間後再決定，避免同一段閒置被重複提醒。
+    """
+
+    def __init__(self, max_entries: int = ENGAGEMENT_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._entries: "OrderedDict[str, List[Optional[datetime]]]" = OrderedDict()
+        self._dirty: set = set()
+        self._bind = None
+        self._counters: Dict[str, int] = {
+            "touches": 0, "loads": 0, "rechecks": 0, "reminders": 0,
+            "flushes": 0, "rows_flushed": 0, "flush_errors": 0, "evictions": 0,
+        }
+
+    def _load(self, db: Session, line_user_id: str) -> Tuple[Optional[datetime], Optional[datetime]]:
+        row = db.execute(_LOAD_SQL, {"lid": line_user_id}).first()
+        return (_utc(row.last_seen_at), _utc(row.last_reminded_at)) if row else (None, None)
+
+    def _entry(self, db: Session, line_user_id: str) -> List[Optional[datetime]]:
+        with self._lock:
+            entry = self._entries.get(line_user_id)
+            if entry is not None:
+                self._entries.move_to_end(line_user_id)
+                return entry
+        seen, reminded = self._load(db, line_user_id)
+        with self._lock:
+            self._counters["loads"] += 1
+            entry = self._entries.get(line_user_id)
+            if entry is None:
+                entry = self._entries[line_user_id] = [seen, reminded]
+            else:
+                entry[0], entry[1] = _later(entry[0], seen), _later(entry[1], reminded)
+            return entry
+
+    def _mark_dirty(self, line_user_id: str, entry: List[Optional[datetime]]) -> None:
+        """呼叫端需持有 self._lock。entry 可能在取得後被 _trim 淘汰（或已換成新載入的項目），放回 / 合併後才標記，flush 才寫得到。"""
+        current = self._entries.get(line_user_id)
+        if current is None:
+            self._entries[line_user_id] = entry
+        elif current is not entry:
+            current[0], current[1] = _later(current[0], entry[0]), _later(current[1], entry[1])
+        self._dirty.add(line_user_id)
+
+    def _bind_from(self, db: Session) -> None:
+        _ensure_table_exists(db)
+        if self._bind is None:
+            self._bind = db.get_bind()
+
+    @staticmethod
+    def _is_idle(entry: List[Optional[datetime]], now: datetime, idle: timedelta) -> bool:
+        seen, reminded = entry
+        if seen is None or now - seen < idle:
+            return False
+        # 若未提醒過，或距上次提醒又超過門檻，則應提醒
+        return reminded is None or now - reminded >= idle
+
+    def touch(self, db: Session, line_user_id: str, idle_minutes: int = 60) -> bool:
+        self._bind_from(db)
+        now = datetime.now(timezone.utc)
+        idle = timedelta(minutes=idle_minutes)
+        entry = self._entry(db, line_user_id)
+        with self._lock:
+            should_remind = self._is_idle(entry, now, idle)
+        if should_remind:
+            # 只在「看起來閒置」時回查：其他程序可能已寫回較新的時間
+            seen, reminded = self._load(db, line_user_id)
+            with self._lock:
+                self._counters["rechecks"] += 1
+                entry[0], entry[1] = _later(entry[0], seen), _later(entry[1], reminded)
+                should_remind = self._is_idle(entry, now, idle)
+        with self._lock:
+            entry[0] = _later(entry[0], now)
+            self._mark_dirty(line_user_id, entry)
+            self._counters["touches"] += 1
+        return should_remind
+
+    def mark_reminded(self, db: Session, line_user_id: str) -> None:
+        self._bind_from(db)
+        now = datetime.now(timezone.utc)
+        entry = self._entry(db, line_user_id)
+        with self._lock:
+            entry[1] = _later(entry[1], now)
+            if entry[0] is None:
+                entry[0] = now
+            self._mark_dirty(line_user_id, entry)
+            self._counters["reminders"] += 1
+
+    def flush(self) -> int:
+        """把累積的變更一次寫回，回傳寫入筆數；失敗時保留待下次重試。"""
+        bind = self._bind or ENGINE
+        with self._flush_lock:
+            with self._lock:
+                lids = list(self._dirty)
+                self._dirty.clear()
+                rows = [(lid, *self._entries[lid]) for lid in lids if lid in self._entries]
+            if not rows:
+                return 0
+            try:
+                with bind.begin() as conn:
+                    for i in range(0, len(rows), ENGAGEMENT_FLUSH_BATCH):
+                        chunk = rows[i:i + ENGAGEMENT_FLUSH_BATCH]
+                        params: Dict[str, Any] = {}
+                        values = []
+                        for n, (lid, seen, reminded) in enumerate(chunk):
+                            params[f"l{n}"], params[f"s{n}"], params[f"r{n}"] = lid, _naive(seen), _naive(reminded)
+                            values.append(f"(CAST(:l{n} AS varchar), CAST(:s{n} AS timestamp), CAST(:r{n} AS timestamp))")
+                        conn.execute(text(_FLUSH_SQL.format(values=", ".join(values))), params)
+            except Exception:
+                with self._lock:
+                    self._dirty.update(lids)
+                    self._counters["flush_errors"] += 1
+                raise
+            with self._lock:
+                self._counters["flushes"] += 1
+                self._counters["rows_flushed"] += len(rows)
+                self._trim()
+            return len(rows)
+
+    def _trim(self) -> None:
+        # 只淘汰已寫回的項目；未寫回的留到下一次 flush 之後
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        for lid in [k for k in self._entries if k not in self._dirty][:excess]:
+            del self._entries[lid]
+            self._counters["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "dirty": len(self._dirty),
+                    "flush_seconds": ENGAGEMENT_FLUSH_SECONDS}
+
+
+engagement_tracker = EngagementTracker()
+
 
 def touch_and_check_idle(db: Session, line_user_id: str, idle_minutes: int = 60) -> bool:
     """
     更新 last_seen_at；回傳是否「應提醒」（超過 idle_minutes，且尚未提醒或距上次提醒超過 idle_minutes）。
+    寫回 DB 由背景 flush 處理。
     """
     if not line_user_id:
         return False
-    _ensure_table_exists(db)
-    now = datetime.now(timezone.utc)
-    row: Optional[UserEngagement] = db.query(UserEngagement).filter_by(line_user_id=line_user_id).first()
-    should_remind = False
-    if not row:
-        row = UserEngagement(line_user_id=line_user_id, last_seen_at=now, last_reminded_at=None)
-        db.add(row)
-        db.commit(); db.refresh(row)
-        return False
+    return engagement_tracker.touch(db, line_user_id, idle_minutes)
 
-    # 計算是否超過 idle
-    last_seen = row.last_seen_at if isinstance(row.last_seen_at, datetime) else now
-    last_reminded = row.last_reminded_at
-    idle_delta = now - (last_seen if last_seen.tzinfo else last_seen.replace(tzinfo=timezone.utc))
-    if idle_delta >= timedelta(minutes=idle_minutes):
-        # 若未提醒過，或距上次提醒又超過門檻，則應提醒
-        if (last_reminded is None) or (now - (last_reminded if last_reminded.tzinfo else last_reminded.replace(tzinfo=timezone.utc)) >= timedelta(minutes=idle_minutes)):
-            should_remind = True
+def mark_reminded(db: Session, line_user_id: str):
+    if not line_user_id:
+        return
+    engagement_tracker.mark_reminded(db, line_user_id)
 
-    # 更新 last_seen_at
-    row.last_seen_at = now
-    db.add(row)
-    db.commit()
-    return should_remind
 
-def mark_reminded(db: Session, line_user_id: str):
-    _ensure_table_exists(db)
-    now = datetime.now(timezone.utc)
-    row: Optional[UserEngagement] = db.query(UserEngagement).filter_by(line_user_id=line_user_id).first()
-    if row:
-        row.last_reminded_at = now
-        db.add(row)
-        db.commit()
+async def _flush_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(engagement_tracker.flush)
+        except Exception as e:
+            print(f">> engagement flush failed: {e!r}")
+
+
+_flusher: Optional[asyncio.Task] = None
+
+
+def start_engagement_flusher(interval: float = ENGAGEMENT_FLUSH_SECONDS) -> None:
+    """在 app startup 呼叫；同一程序只啟動一次。"""
+    global _flusher
+    if _flusher is None or _flusher.done():
+        _flusher = asyncio.get_running_loop().create_task(_flush_loop(interval))
+
+
+async def stop_engagement_flusher() -> None:
+    """停止背景任務並把剩下的變更寫回。"""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        try:
+            await _flusher
+        except (asyncio.CancelledError, Exception):
+            pass
+        _flusher = None
+    try:
+        await asyncio.to_thread(engagement_tracker.flush)
+    except Exception as e:
+        print(f">> engagement final flush failed: {e!r}")
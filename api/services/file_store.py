@@ -0,0 +1,157 @@
+# api/services/file_store.py
+# -*- coding: utf-8 -*-
+"""
+內容定址的案件檔案（同一事務所內以 SHA-256 去重）
+- 物件 key：<租戶前綴>/blobs/sha256/<前兩碼>/<sha256>/<隨機碼>；file_contents 一筆對應一份內容。
+  每次認領都寫到新的 key：release() 刪掉 ref_count 歸零的內容時，只會刪到那一列自己的物件，
+  不會刪到同時重新認領同一 sha256 的新物件
+- file_blobs（案件附件）以 (client_id, sha256) 參照內容，ref_count 由觸發器維護（migrations/06_file_contents.sql）
+- 認領內容時鎖住 file_contents 那一列，與 release() 的刪除互斥：不會參照到剛被刪掉的內容
+- 只在同事務所內去重，by-hash 查詢不會洩漏其他事務所有哪些檔案
+- 直傳（presign）一律先傳到該次上傳專屬的 key，complete 重算 SHA-256 相符才複製到內容定址 key；
+  client 不能直接寫入或刪除共用的內容物件
+"""
+
+import os
+import re
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+try:
+    from api.models_files import FileBlob, FileContent, ensure_file_blobs
+    from api.services.storage import MAX_COPY_BYTES, copy_object, delete_object, tenant_key
+except ImportError:
+    from models_files import FileBlob, FileContent, ensure_file_blobs  # type: ignore
+    from services.storage import MAX_COPY_BYTES, copy_object, delete_object, tenant_key  # type: ignore
+
+# 直傳 complete 時會下載回來重算 SHA-256 的上限；更大的檔案不做內容定址（各自一份），不信任 client 回報的雜湊
+DEDUP_VERIFY_MAX_BYTES = int(float(os.getenv("DEDUP_VERIFY_MAX_MB", "512")) * 1024 * 1024)
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_CLAIM_SQL = text("""
+    INSERT INTO file_contents (client_id, sha256, size_bytes, s3_key, content_type)
+    VALUES (:cid, :sha, :size, :key, :ctype)
+    ON CONFLICT (client_id, sha256) DO UPDATE SET ref_count = file_contents.ref_count
+    RETURNING id
+""")
+
+_LOCK_SQL = text("""
+    SELECT id FROM file_contents WHERE client_id = :cid AND sha256 = :sha FOR UPDATE
+""")
+
+_IN_USE_SQL = text("""
+    SELECT EXISTS (SELECT 1 FROM file_contents WHERE client_id = :cid AND s3_key = :key)
+        OR EXISTS (SELECT 1 FROM file_blobs WHERE s3_key = :key)
+""")
+
+_DROP_SQL = text("""
+    DELETE FROM file_contents WHERE client_id = :cid AND sha256 = :sha AND ref_count <= 0
+    RETURNING s3_key
+""")
+
+
+def normalize_sha256(value: Optional[str]) -> Optional[str]:
+    v = (value or "").strip().lower()
+    return v if _SHA256_RE.match(v) else None
+
+
+def content_key(client_id: str, sha256: str) -> str:
+    """新認領用的 key（每次呼叫都不同）；既有內容以 file_contents.s3_key 為準"""
+    return tenant_key(client_id, f"blobs/sha256/{sha256[:2]}/{sha256}/{uuid.uuid4().hex[:16]}")
+
+
+def find_content(db: Session, client_id: str, sha256: str) -> Optional[FileContent]:
+    ensure_file_blobs(db.get_bind())
+    return db.query(FileContent).filter(FileContent.client_id == client_id, FileContent.sha256 == sha256).first()
+
+
+def key_in_use(db: Session, client_id: str, s3_key: str) -> bool:
+    """有 file_contents / file_blobs 參照的物件不能當作暫存上傳刪掉"""
+    ensure_file_blobs(db.get_bind())
+    return bool(db.execute(_IN_USE_SQL, {"cid": client_id, "key": s3_key}).scalar())
+
+
+def attach(db: Session, *, client_id: str, sha256: str, case_id: Optional[str], filename: str,
+           content_type: Optional[str], uploaded_by: Optional[str], meta: Dict[str, Any],
+           size: Optional[int] = None, s3_key: Optional[str] = None) -> Optional[FileBlob]:
+    """
+    把內容掛到案件上（同一交易內：認領 / 鎖住內容 → 新增 file_blobs → 觸發器 ref_count + 1）。
+    size / s3_key 為 None 代表不上傳、只參照既有內容；內容不存在時回傳 None。
+    """
+    ensure_file_blobs(db.get_bind())
+    params = {"cid": client_id, "sha": sha256}
+    try:
+        if s3_key is None:
+            if db.execute(_LOCK_SQL, params).first() is None:
+                db.rollback()
+                return None
+        else:
+            db.execute(_CLAIM_SQL, {**params, "size": size, "key": s3_key, "ctype": content_type})
+        content = find_content(db, client_id, sha256)
+        blob = FileBlob(
+            client_id=client_id,
+            case_id=str(case_id or ""),
+            filename=filename,
+            content_type=content_type or content.content_type or "application/octet-stream",
+            size_bytes=content.size_bytes,
+            s3_key=content.s3_key,
+            sha256=sha256,
+            uploaded_by=uploaded_by,
+            meta=meta,
+        )
+        db.add(blob)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(blob)
+    return blob
+
+
+def attach_upload(db: Session, *, staged_key: str, size: int, meta: Dict[str, Any],
+                  **args: Any) -> Tuple[FileBlob, bool]:
+    """
+    把已確認 sha256 的上傳物件掛到案件上，回傳 (blob, 是否沿用既有內容)。
+    已有同內容 → 直接參照；否則複製到新的內容 key 再認領（超過 MAX_COPY_BYTES 則沿用 staged_key）。
+    blob.s3_key 與 staged_key 不同時由呼叫端刪掉 staged_key。
+    """
+    blob = attach(db, meta={**meta, "dedup": True}, **args)
+    if blob is not None:
+        return blob, True
+    key = staged_key
+    if size <= MAX_COPY_BYTES:
+        key = content_key(args["client_id"], args["sha256"])
+        copy_object(staged_key, key)
+    try:
+        blob = attach(db, size=size, s3_key=key, meta=meta, **args)
+    except Exception:
+        if key != staged_key:
+            delete_object(key)
+        raise
+    if key != staged_key and blob.s3_key != key:
+        delete_object(key)  # 同時有人先認領了同內容，這份複本沒有人參照
+    return blob, False
+
+
+def release(db: Session, blob: FileBlob) -> bool:
+    """刪除案件附件；內容沒有其他參照時一併刪掉 S3 物件。回傳是否刪了內容。"""
+    client_id, sha256, own_key = blob.client_id, blob.sha256, blob.s3_key
+    content = find_content(db, client_id, sha256) if sha256 else None
+    shared_key = content.s3_key if content else None
+    db.delete(blob)
+    db.commit()
+    if own_key and own_key != shared_key:
+        # 去重前上傳的舊檔（各自一份 uuid 路徑）只屬於這一筆
+        delete_object(own_key)
+    if shared_key is None:
+        return False
+    row = db.execute(_DROP_SQL, {"cid": client_id, "sha": sha256}).first()
+    db.commit()
+    if row is None:
+        return False
+    delete_object(row[0])
+    return True
@@ -0,0 +1,136 @@
+# api/services/file_transfer.py
+# -*- coding: utf-8 -*-
+"""
+下載連結（transfer token）與檔案雜湊
+- 連結存在 file_transfers 表（models_files.FileTransfer），重啟不會失效，多個 worker 共用
+- 建立連結只做 stat，不讀檔；SHA-256 第一次有人要（/download/{id}/meta）才計算並寫回該列
+- 雜湊在程序內以 (路徑, 大小, mtime_ns) 快取：同一份檔案發多次連結只讀一次，檔案改過鍵就不同
+- 過期的連結在建立新連結時順手刪掉（依 expires_at 索引）
+"""
+
+import hashlib
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+try:
+    from api.models_files import FileTransfer, ensure_file_transfers
+except ImportError:
+    from models_files import FileTransfer, ensure_file_transfers  # type: ignore
+
+FILE_HASH_CACHE_MAX = int(os.getenv("FILE_HASH_CACHE_MAX_ENTRIES", "2048"))
+HASH_READ_BLOCK = 1024 * 1024
+
+_COUNT_SQL = text("UPDATE file_transfers SET download_count = download_count + 1 WHERE transfer_id = :tid")
+_PURGE_SQL = text("DELETE FROM file_transfers WHERE expires_at < now()")
+
+_Key = Tuple[str, int, int]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class FileHashCache:
+    def __init__(self, max_entries: int = FILE_HASH_CACHE_MAX):
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[_Key, str]" = OrderedDict()
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "bytes_hashed": 0, "changed_while_hashing": 0}
+
+    def sha256(self, path: str) -> Tuple[str, os.stat_result]:
+        """回傳 (SHA-256, 計算時的 stat)；檔案在讀取途中被改過就不快取（下次重算）"""
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return hit, st
+            self._counters["misses"] += 1
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_READ_BLOCK), b""):
+                digest.update(block)
+        value = digest.hexdigest()
+
+        after = os.stat(path)
+        with self._lock:
+            self._counters["bytes_hashed"] += st.st_size
+            if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                self._counters["changed_while_hashing"] += 1
+                return value, after
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value, st
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "max_entries": self.max_entries}
+
+
+file_hash_cache = FileHashCache()
+
+
+def create_transfer(db: Session, file_path: str, expiry_hours: float = 24) -> FileTransfer:
+    """登錄一個下載連結；檔案不存在時丟 FileNotFoundError"""
+    ensure_file_transfers(db.get_bind())
+    st = os.stat(file_path)
+    db.execute(_PURGE_SQL)
+    record = FileTransfer(
+        transfer_id=secrets.token_urlsafe(32),
+        file_path=os.path.abspath(file_path),
+        file_name=os.path.basename(file_path),
+        size_bytes=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        expires_at=_utcnow() + timedelta(hours=expiry_hours),
+    )
+    db.add(record)
+    db.commit()
+    return record
+
+
+def get_transfer(db: Session, transfer_id: str) -> Tuple[Optional[FileTransfer], str]:
+    """(紀錄, 訊息)；無效 / 過期 / 檔案不見時紀錄為 None"""
+    ensure_file_transfers(db.get_bind())
+    record = db.get(FileTransfer, transfer_id)
+    if record is None:
+        return None, "無效的傳輸ID"
+    expires_at = record.expires_at
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if _utcnow() > expires_at:
+        return None, "下載連結已過期"
+    if not os.path.isfile(record.file_path):
+        return None, "檔案不存在"
+    return record, "驗證通過"
+
+
+def transfer_hash(db: Session, record: FileTransfer) -> str:
+    """連結檔案的 SHA-256；已算過且檔案沒變就直接用，否則計算並寫回"""
+    st = os.stat(record.file_path)
+    if record.file_hash and (record.size_bytes, record.mtime_ns) == (st.st_size, st.st_mtime_ns):
+        return record.file_hash
+    value, st = file_hash_cache.sha256(record.file_path)
+    record.file_hash, record.size_bytes, record.mtime_ns = value, st.st_size, st.st_mtime_ns
+    db.commit()
+    return value
+
+
+def count_download(db: Session, transfer_id: str) -> None:
+    db.execute(_COUNT_SQL, {"tid": transfer_id})
+    db.commit()
@@ -1,38 +1,31 @@
-
 from typing import Optional, Dict
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from api.models_control import LoginUser, ClientLineUsers
+from sqlalchemy.ext.asyncio import AsyncSession
+from api.models_control import ClientLineUsers
+from api.services.line_identity import invalidate_line_identity, line_identity
+from api.tenant_meta import secret_code_map
+
+# 綁定狀態統一由 line_identity 解析（一次查詢 + 短 TTL 快取）
 
 def _is_bound_to_lawyer(db: Session, line_user_id: str) -> bool:
     if not line_user_id:
         return False
-    row = db.query(ClientLineUsers).filter(
-        ClientLineUsers.line_user_id == line_user_id,
-        ClientLineUsers.is_active == True  # noqa: E712
-    ).first()
-    return bool(row)
+    ident = line_identity.resolve(db, line_user_id)
+    return ident.bound and ident.bound_active is True
 
 def _lookup_client_by_code(db: Session, code: str) -> Optional[Dict[str, str]]:
-    if not code:
-        return None
-    tenant = db.query(LoginUser).filter(
-        and_(LoginUser.secret_code == code, LoginUser.is_active == True)  # noqa: E712
-    ).first()
-    if not tenant:
+    entry = secret_code_map.lookup(code, active_only=True)
+    if not entry:
         return None
     return {
-        "client_id": tenant.client_id,
-        "client_name": tenant.client_name,
+        "client_id": entry.client_id,
+        "client_name": entry.client_name,
     }
 
 def _bind_line_user_to_client(db: Session, line_user_id: str, tenant: Dict[str, str]) -> bool:
     if not tenant or not line_user_id:
         return False
-    exists = db.query(ClientLineUsers).filter(
-        ClientLineUsers.line_user_id == line_user_id
-    ).first()
-    if exists:
+    if line_identity.resolve(db, line_user_id, fresh=True).bound:
         return True
     db.add(ClientLineUsers(
         client_id=tenant["client_id"],
@@ -40,4 +33,35 @@ def _bind_line_user_to_client(db: Session, line_user_id: str, tenant: Dict[str,
         is_active=True
     ))
     db.commit()
+    invalidate_line_identity(line_user_id)
+    return True
+
+# ---- async 版本（供 /api/lawyer/verify-secret 等熱路徑使用）----
+async def _is_bound_to_lawyer_async(db: AsyncSession, line_user_id: str) -> bool:
+    if not line_user_id:
+        return False
+    ident = await line_identity.resolve_async(db, line_user_id)
+    return ident.bound and ident.bound_active is True
+
+async def _lookup_client_by_code_async(db: AsyncSession, code: str) -> Optional[Dict[str, str]]:
+    entry = await secret_code_map.lookup_async(code, active_only=True)
+    if not entry:
+        return None
+    return {
+        "client_id": entry.client_id,
+        "client_name": entry.client_name,
+    }
+
+async def _bind_line_user_to_client_async(db: AsyncSession, line_user_id: str, tenant: Dict[str, str]) -> bool:
+    if not tenant or not line_user_id:
+        return False
+    if (await line_identity.resolve_async(db, line_user_id, fresh=True)).bound:
+        return True
+    db.add(ClientLineUsers(
+        client_id=tenant["client_id"],
+        line_user_id=line_user_id,
+        is_active=True
+    ))
+    await db.commit()
+    invalidate_line_identity(line_user_id)
     return True
@@ -0,0 +1,180 @@
+# api/services/line_identity.py
+# -*- coding: utf-8 -*-
+"""
+LINE 使用者身分解析（每則訊息的路由判斷共用）
+- 一個查詢同時取得 client_line_users 綁定（角色 / 事務所）與 pending_line_users 登錄狀態
+- 以 line_user_id 為鍵短 TTL 快取；綁定、登錄、解除綁定後須呼叫 invalidate_line_identity()
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+LINE_IDENTITY_TTL = float(os.getenv("LINE_IDENTITY_TTL_SECONDS", "30"))
+LINE_IDENTITY_MAX_ENTRIES = int(os.getenv("LINE_IDENTITY_MAX_ENTRIES", "20000"))
+
+# line_user_id 在兩張表都是唯一鍵，LATERAL 各取一列即可
+_SQL = text("""
+    SELECT c.client_id, c.client_name, c.user_name, c.user_role, c.is_active AS bound_active,
+           c.client_id IS NOT NULL AS bound,
+           p.status AS pending_status, p.expected_name
+    FROM (SELECT CAST(:lid AS text) AS lid) x
+    LEFT JOIN LATERAL (
+        SELECT client_id, client_name, user_name, user_role, is_active
+        FROM client_line_users
+        WHERE line_user_id = x.lid
+        LIMIT 1
+    ) c ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT status, expected_name
+        FROM pending_line_users
+        WHERE line_user_id = x.lid
+        ORDER BY updated_at DESC NULLS LAST, created_at DESC NULLS LAST
+        LIMIT 1
+    ) p ON TRUE
+""")
+
+
+class LineIdentity(NamedTuple):
+    line_user_id: str
+    bound: bool                    # client_line_users 有資料（不論是否啟用）
+    bound_active: Optional[bool]   # client_line_users.is_active 原值
+    role: Optional[str]            # user_role 大寫；未綁定為 None
+    client_id: Optional[str]
+    client_name: Optional[str]
+    user_name: Optional[str]
+    pending_status: Optional[str]  # pending_line_users.status；不在名單為 None
+    expected_name: Optional[str]
+
+    @property
+    def is_bound(self) -> bool:
+        """is_active 為 NULL 視為啟用（與舊 COALESCE 判斷相同）。"""
+        return self.bound and self.bound_active is not False
+
+    @property
+    def is_lawyer(self) -> bool:
+        return self.is_bound and self.role == "LAWYER"
+
+    @property
+    def is_user(self) -> bool:
+        return self.is_bound and self.role != "LAWYER"
+
+    @property
+    def in_pending(self) -> bool:
+        return self.pending_status is not None
+
+    @property
+    def registered_name(self) -> Optional[str]:
+        """完成「登錄 XXX」確認後的姓名。"""
+        if self.pending_status == "registered" and self.expected_name:
+            return self.expected_name.strip() or None
+        return None
+
+    def state(self) -> Dict[str, bool]:
+        """相容舊 _get_state_by_line_id() 的回傳格式。"""
+        return {"is_user": self.is_user, "is_lawyer": self.is_lawyer, "in_pending": self.in_pending}
+
+
+def _from_row(line_user_id: str, row) -> LineIdentity:
+    m = row._mapping
+    role = m["user_role"]
+    return LineIdentity(
+        line_user_id=line_user_id,
+        bound=bool(m["bound"]),
+        bound_active=m["bound_active"],
+        role=str(role).upper() if role is not None else None,
+        client_id=m["client_id"],
+        client_name=m["client_name"],
+        user_name=m["user_name"],
+        pending_status=m["pending_status"],
+        expected_name=m["expected_name"],
+    )
+
+
+def _empty(line_user_id: str) -> LineIdentity:
+    return LineIdentity(line_user_id, False, None, None, None, None, None, None, None)
+
+
+class LineIdentityCache:
+    def __init__(self, ttl: float = LINE_IDENTITY_TTL, max_entries: int = LINE_IDENTITY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, LineIdentity]]" = OrderedDict()
+        self._generation = 0  # 每次作廢 +1；查詢期間有作廢就不寫回
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    def _get(self, line_user_id: str) -> Tuple[Optional[LineIdentity], int]:
+        with self._lock:
+            hit = self._entries.get(line_user_id)
+            if hit and hit[0] > time.monotonic():
+                self._entries.move_to_end(line_user_id)
+                self._counters["hits"] += 1
+                return hit[1], self._generation
+            self._entries.pop(line_user_id, None)
+            self._counters["misses"] += 1
+            return None, self._generation
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def _put(self, ident: LineIdentity, version: int) -> None:
+        with self._lock:
+            if self._generation != version:
+                return
+            self._entries[ident.line_user_id] = (time.monotonic() + self.ttl, ident)
+            self._entries.move_to_end(ident.line_user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    # fresh=True：略過快取直接查（寫入前的存在檢查用，避免多程序下拿到舊的「未綁定」）
+    def resolve(self, db: Session, line_user_id: Optional[str],
+                fresh: bool = False) -> LineIdentity:
+        lid = (line_user_id or "").strip()
+        if not lid:
+            return _empty("")
+        ident, version = self._get(lid) if not fresh else (None, self.generation())
+        if ident is None:
+            ident = _from_row(lid, db.execute(_SQL, {"lid": lid}).first())
+            self._put(ident, version)
+        return ident
+
+    async def resolve_async(self, db: AsyncSession, line_user_id: Optional[str],
+                            fresh: bool = False) -> LineIdentity:
+        lid = (line_user_id or "").strip()
+        if not lid:
+            return _empty("")
+        ident, version = self._get(lid) if not fresh else (None, self.generation())
+        if ident is None:
+            ident = _from_row(lid, (await db.execute(_SQL, {"lid": lid})).first())
+            self._put(ident, version)
+        return ident
+
+    def invalidate(self, line_user_id: Optional[str] = None) -> None:
+        """line_user_id=None 代表全部清空。"""
+        with self._lock:
+            self._counters["invalidations"] += 1
+            self._generation += 1
+            if line_user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(line_user_id.strip(), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "ttl_seconds": self.ttl}
+
+
+line_identity = LineIdentityCache()
+
+
+def invalidate_line_identity(line_user_id: Optional[str] = None) -> None:
+    line_identity.invalidate(line_user_id)
@@ -1,26 +1,329 @@
 # api/services/line_service.py
+# -*- coding: utf-8 -*-
+"""
+LINE 主動推播
+- 單一長駐 httpx.AsyncClient（連線池 + keep-alive），不再每則訊息重新握手
+- 推播先進佇列；短暫等待（LINE_PUSH_LINGER_MS）後把內容相同的訊息併成 multicast（每次最多 500 人）
+- token bucket 控制每秒請求數；429 依 Retry-After 全域暫停，5xx / 連線錯誤以指數退避重試
+  （同一請求重試沿用 X-Line-Retry-Key，LINE 回 409 代表先前已送達）
+- LINE_API_BASE 可指向本機 mock server（見 api/scripts/bench_line_push.py）
+"""
 
-import httpx
+import asyncio
+import json
 import os
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Set
+from uuid import uuid4
 
-class LineService:
-    def __init__(self):
-        self.channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+import httpx
 
-    async def push_text(self, user_id: str, text: str):
-        headers = {
-            "Authorization": f"Bearer {self.channel_access_token}",
-            "Content-Type": "application/json"
+LINE_API_BASE = os.getenv("LINE_API_BASE", "https://api.line.me").rstrip("/")
+LINE_PUSH_RATE = float(os.getenv("LINE_PUSH_RATE", "50"))          # 每秒請求數
+LINE_PUSH_BURST = int(os.getenv("LINE_PUSH_BURST", "50"))
+LINE_PUSH_LINGER_MS = int(os.getenv("LINE_PUSH_LINGER_MS", "50"))
+LINE_PUSH_CONCURRENCY = int(os.getenv("LINE_PUSH_CONCURRENCY", "8"))
+LINE_PUSH_MAX_RETRIES = int(os.getenv("LINE_PUSH_MAX_RETRIES", "5"))
+LINE_PUSH_QUEUE_MAX = int(os.getenv("LINE_PUSH_QUEUE_MAX", "10000"))
+MULTICAST_MAX_RECIPIENTS = 500
+_BATCH_MAX = 5000
+_LATENCY_SAMPLES = 1024
+
+
+class TokenBucket:
+    """每秒補 rate 個、最多存 burst 個；pause() 讓所有請求等到指定時間之後。"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None  # 在事件迴圈內才建立（3.9 的 Lock 會綁定建立時的 loop）
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _Push(NamedTuple):
+    to: str
+    key: str                    # messages 的 JSON，相同內容才能併成 multicast
+    messages: List[Dict[str, Any]]
+    future: "asyncio.Future[None]"
+    enqueued: float
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    return min(30.0, 0.5 * (2 ** attempt))
+
+
+def _chunks(items: List[_Push]) -> List[List[_Push]]:
+    """每組最多 500 人且收件人不重複（同一人同內容兩次就分到下一組）。"""
+    chunks: List[List[_Push]] = []
+    members: List[Set[str]] = []
+    for p in items:
+        for chunk, seen in zip(chunks, members):
+            if len(chunk) < MULTICAST_MAX_RECIPIENTS and p.to not in seen:
+                chunk.append(p)
+                seen.add(p.to)
+                break
+        else:
+            chunks.append([p])
+            members.append({p.to})
+    return chunks
+
+
+def _fail(items: List[_Push], exc: Optional[BaseException] = None) -> None:
+    for p in items:
+        if not p.future.done():
+            p.future.set_exception(exc or RuntimeError("LINE 推播佇列已關閉"))
+
+
+def _percentiles(samples: Deque[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "p95": None, "max": None}
+    s = sorted(samples)
+    return {"p50": round(s[len(s) // 2], 2), "p95": round(s[min(len(s) - 1, int(len(s) * 0.95))], 2),
+            "max": round(s[-1], 2)}
+
+
+class LinePushClient:
+    def __init__(self, base_url: str = LINE_API_BASE, token: Optional[str] = None,
+                 rate: float = LINE_PUSH_RATE, burst: int = LINE_PUSH_BURST,
+                 linger_ms: int = LINE_PUSH_LINGER_MS, concurrency: int = LINE_PUSH_CONCURRENCY,
+                 max_retries: int = LINE_PUSH_MAX_RETRIES, queue_max: int = LINE_PUSH_QUEUE_MAX,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url.rstrip("/")
+        self.token = token if token is not None else os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+        self.linger = linger_ms / 1000.0
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(0, max_retries)
+        self.queue_max = queue_max
+        self.bucket = TokenBucket(rate, burst)
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._queue: Optional["asyncio.Queue[_Push]"] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._inflight: Dict[asyncio.Task, List[_Push]] = {}  # 送出中的請求 -> 該請求的訊息
+        self._holding: List[_Push] = []  # dispatcher 已從佇列取出、尚未交給 _send 的訊息（linger 期間）
+        self._counters: Dict[str, int] = {
+            "enqueued": 0, "delivered": 0, "failed": 0, "requests": 0, "push_requests": 0,
+            "multicast_requests": 0, "retries": 0, "throttled": 0,
         }
+        self._queue_ms: Deque[float] = deque(maxlen=_LATENCY_SAMPLES)
+        self._request_ms: Deque[float] = deque(maxlen=_LATENCY_SAMPLES)
+        self._total_ms: Deque[float] = deque(maxlen=_LATENCY_SAMPLES)
 
-        payload = {
-            "to": user_id,
-            "messages": [{
-                "type": "text",
-                "text": text
-            }]
+    # ---- 生命週期 ----
+    def start(self) -> None:
+        """在事件迴圈內呼叫；重複呼叫無副作用。"""
+        if self._dispatcher is not None and not self._dispatcher.done():
+            return
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"},
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            transport=self._transport,
+        )
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch_loop())
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        """先盡量送完佇列與進行中的請求，逾時則取消並讓等待者收到例外。"""
+        if self._dispatcher is None:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while (self._queue.qsize() or self._holding or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._dispatcher.cancel()
+        inflight = dict(self._inflight)
+        for t in inflight:
+            t.cancel()
+        await asyncio.gather(self._dispatcher, *inflight, return_exceptions=True)
+        # 被取消的請求（包含還沒開始執行的）與佇列剩下的都以例外結束
+        for chunk in inflight.values():
+            _fail(chunk)
+        while not self._queue.empty():
+            _fail([self._queue.get_nowait()])
+        await self._client.aclose()
+        self._dispatcher = self._client = None
+
+    # ---- 對外 ----
+    async def enqueue(self, to: str, messages: List[Dict[str, Any]]) -> "asyncio.Future[None]":
+        """放進佇列（滿了就等），回傳送達 / 失敗時完成的 future。"""
+        if self._dispatcher is None or self._dispatcher.done():
+            self.start()
+        fut = asyncio.get_running_loop().create_future()
+        key = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+        await self._queue.put(_Push(to, key, messages, fut, time.monotonic()))
+        self._counters["enqueued"] += 1
+        return fut
+
+    async def push_messages(self, to: str, messages: List[Dict[str, Any]]) -> None:
+        await (await self.enqueue(to, messages))
+
+    async def push_text(self, to: str, text: str) -> None:
+        await self.push_messages(to, [{"type": "text", "text": text}])
+
+    # ---- 內部 ----
+    async def _dispatch_loop(self) -> None:
+        try:
+            await self._dispatch_batches()
+        except asyncio.CancelledError:
+            # stop() 逾時取消：手上這批不會再送，讓等待者收到例外而不是永遠卡住
+            _fail(self._holding)
+            self._holding = []
+            raise
+
+    async def _dispatch_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._holding = [await self._queue.get()]
+            deadline = loop.time() + self.linger
+            while len(batch) < _BATCH_MAX:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            groups: Dict[str, List[_Push]] = {}
+            for p in batch:
+                groups.setdefault(p.key, []).append(p)
+            chunks = [chunk for items in groups.values() for chunk in _chunks(items)]
+            for i, chunk in enumerate(chunks):
+                await self._sem.acquire()
+                task = loop.create_task(self._send(chunk))
+                self._inflight[task] = chunk
+                task.add_done_callback(self._on_done)
+                self._holding = [p for rest in chunks[i + 1:] for p in rest]
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._inflight.pop(task, None)
+        self._sem.release()
+
+    async def _send(self, chunk: List[_Push]) -> None:
+        started = time.monotonic()
+        for p in chunk:
+            self._queue_ms.append((started - p.enqueued) * 1000)
+        messages = chunk[0].messages
+        try:
+            if len(chunk) == 1:
+                self._counters["push_requests"] += 1
+                await self._post("/v2/bot/message/push", {"to": chunk[0].to, "messages": messages})
+            else:
+                self._counters["multicast_requests"] += 1
+                await self._post("/v2/bot/message/multicast", {"to": [p.to for p in chunk], "messages": messages})
+        except Exception as e:
+            self._counters["failed"] += len(chunk)
+            print(f">> LINE push failed ({len(chunk)} recipients): {e!r}")
+            for p in chunk:
+                if not p.future.done():
+                    p.future.set_exception(e)
+            return
+        done = time.monotonic()
+        self._counters["delivered"] += len(chunk)
+        for p in chunk:
+            self._total_ms.append((done - p.enqueued) * 1000)
+            if not p.future.done():
+                p.future.set_result(None)
+
+    async def _post(self, path: str, body: Dict[str, Any]) -> None:
+        headers = {"X-Line-Retry-Key": str(uuid4())}
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            self._counters["requests"] += 1
+            t0 = time.monotonic()
+            try:
+                resp = await self._client.post(path, json=body, headers=headers)
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    raise
+                delay = _backoff(attempt)
+            else:
+                self._request_ms.append((time.monotonic() - t0) * 1000)
+                if resp.status_code == 409 and attempt > 0:
+                    return  # 同一個 retry key 已被接受過
+                if resp.status_code == 429:
+                    self._counters["throttled"] += 1
+                    delay = _retry_after(resp) or _backoff(attempt)
+                    self.bucket.pause(delay)
+                elif resp.status_code >= 500:
+                    delay = _backoff(attempt)
+                else:
+                    resp.raise_for_status()
+                    return
+                if attempt >= self.max_retries:
+                    resp.raise_for_status()
+            self._counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "inflight": len(self._inflight),
+            "queue_ms": _percentiles(self._queue_ms),
+            "request_ms": _percentiles(self._request_ms),
+            "end_to_end_ms": _percentiles(self._total_ms),
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post("https://api.line.me/v2/bot/message/push", headers=headers, json=payload)
-            response.raise_for_status()
+
+line_push = LinePushClient()
+
+
+def start_line_push() -> None:
+    """在 app startup 呼叫；同一程序只啟動一次。"""
+    line_push.start()
+
+
+async def stop_line_push() -> None:
+    await line_push.stop()
+
+
+class LineService:
+    """相容舊介面；實際經由 line_push 佇列送出。"""
+
+    def __init__(self):
+        self.channel_access_token = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
+
+    async def push_text(self, user_id: str, text: str):
+        await line_push.push_text(user_id, text)
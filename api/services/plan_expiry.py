@@ -0,0 +1,143 @@
+# api/services/plan_expiry.py
+# -*- coding: utf-8 -*-
+"""
+付費方案到期：在 paid_until 當下把 login_users.tenant_status 翻成 FALSE（取代每小時跑的 expire_tenants.py）
+- 啟動時與每 PLAN_EXPIRY_RELOAD_SECONDS 秒，把 paid_until 落在 [過去, 現在 + 2 × 週期] 的租戶排入 TimerWheel
+- 方案快照（tenant_meta.plan_status_cache）讀到 paid_until 時也會即時排入，升級 / 手動改期不必等下次載入
+- 觸發時以條件式 UPDATE 翻轉（now() >= paid_until 才動），多個 worker 同時跑或期限被延長都不會誤翻
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+try:
+    from api.database import ENGINE
+    from api.tenant_meta import invalidate_tenant_meta, plan_status_cache
+    from api.utils.timer_wheel import TimerWheel
+except ImportError:
+    from database import ENGINE  # type: ignore
+    from tenant_meta import invalidate_tenant_meta, plan_status_cache  # type: ignore
+    from utils.timer_wheel import TimerWheel  # type: ignore
+
+PLAN_EXPIRY_ENABLED = os.getenv("PLAN_EXPIRY_ENABLED", "1").strip().lower() in ("1", "true", "yes", "on")
+PLAN_EXPIRY_TICK_SECONDS = float(os.getenv("PLAN_EXPIRY_TICK_SECONDS", "1"))
+PLAN_EXPIRY_SLOTS = int(os.getenv("PLAN_EXPIRY_SLOTS", "3600"))
+PLAN_EXPIRY_RELOAD_SECONDS = float(os.getenv("PLAN_EXPIRY_RELOAD_SECONDS", "3600"))
+
+# 與 expire_tenants.py 原本的條件相同；client_ids 為 NULL 代表全部
+EXPIRE_SQL = text("""
+    UPDATE login_users
+    SET tenant_status = FALSE
+    WHERE plan_type <> 'unpaid'
+      AND tenant_status = TRUE
+      AND paid_until IS NOT NULL
+      AND now() >= paid_until
+      AND (CAST(:cids AS text[]) IS NULL OR client_id = ANY(CAST(:cids AS text[])))
+    RETURNING client_id
+""")
+
+_UPCOMING_SQL = text("""
+    SELECT client_id, paid_until
+    FROM login_users
+    WHERE plan_type <> 'unpaid'
+      AND tenant_status = TRUE
+      AND paid_until IS NOT NULL
+      AND paid_until < now() + make_interval(secs => :horizon)
+      AND (CAST(:cids AS text[]) IS NULL OR client_id = ANY(CAST(:cids AS text[])))
+""")
+
+
+def expire_due(client_ids: Optional[List[str]] = None) -> List[str]:
+    """翻轉已到期的租戶並作廢快取；回傳實際翻轉的 client_id。"""
+    with ENGINE.begin() as conn:
+        expired = [r[0] for r in conn.execute(EXPIRE_SQL, {"cids": client_ids})]
+    for cid in expired:
+        invalidate_tenant_meta(cid)
+    return expired
+
+
+class PlanExpiryScheduler:
+    def __init__(self, tick: float = PLAN_EXPIRY_TICK_SECONDS, slots: int = PLAN_EXPIRY_SLOTS,
+                 reload_seconds: float = PLAN_EXPIRY_RELOAD_SECONDS):
+        self.wheel = TimerWheel(tick=tick, slots=slots)
+        self.reload_seconds = reload_seconds
+        self._counters: Dict[str, Any] = {"reloads": 0, "fired": 0, "expired": 0, "rescheduled": 0, "errors": 0,
+                                          "last_expired_at": None}
+
+    def schedule(self, client_id: str, paid_until: datetime) -> None:
+        self.wheel.schedule(client_id, paid_until.timestamp())
+
+    def reload(self, client_ids: Optional[List[str]] = None) -> int:
+        """從 DB 排入即將（或已經）到期的租戶。"""
+        with ENGINE.connect() as conn:
+            rows = conn.execute(_UPCOMING_SQL, {"horizon": self.reload_seconds * 2, "cids": client_ids}).fetchall()
+        for cid, paid_until in rows:
+            self.schedule(cid, paid_until)
+        if client_ids is None:
+            self._counters["reloads"] += 1
+        return len(rows)
+
+    def fire(self, client_ids: List[str]) -> List[str]:
+        """處理到期的計時器；尚未真正到期的（DB 時鐘較慢、期限剛被延長）重新排程。"""
+        self._counters["fired"] += len(client_ids)
+        expired = expire_due(client_ids)
+        self._counters["expired"] += len(expired)
+        if expired:
+            self._counters["last_expired_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        done = set(expired)
+        rest = [cid for cid in client_ids if cid not in done]
+        if rest:
+            self._counters["rescheduled"] += self.reload(rest)
+        return expired
+
+    async def run(self) -> None:
+        reload_at = 0.0
+        while True:
+            try:
+                if time.monotonic() >= reload_at:
+                    reload_at = time.monotonic() + 60  # 失敗時一分鐘後再試
+                    await asyncio.to_thread(self.reload)
+                    reload_at = time.monotonic() + self.reload_seconds
+                due = [cid for cid, _ in self.wheel.advance()]
+                if due:
+                    await asyncio.to_thread(self.fire, due)
+            except Exception as e:
+                self._counters["errors"] += 1
+                print(f">> plan expiry failed: {e!r}")
+            await asyncio.sleep(max(0.0, self.wheel.next_tick_at() - time.time()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._counters, "enabled": PLAN_EXPIRY_ENABLED, "pending": len(self.wheel),
+                "tick_seconds": self.wheel.tick}
+
+
+plan_expiry = PlanExpiryScheduler()
+
+_runner: Optional[asyncio.Task] = None
+
+
+def start_plan_expiry() -> None:
+    """在 app startup 呼叫；PLAN_EXPIRY_ENABLED=0 時不啟動（改由排程跑 expire_tenants.py）。"""
+    global _runner
+    if not PLAN_EXPIRY_ENABLED:
+        return
+    plan_status_cache.on_paid_until = plan_expiry.schedule
+    if _runner is None or _runner.done():
+        _runner = asyncio.get_running_loop().create_task(plan_expiry.run())
+
+
+async def stop_plan_expiry() -> None:
+    global _runner
+    plan_status_cache.on_paid_until = None
+    if _runner is not None:
+        _runner.cancel()
+        try:
+            await _runner
+        except (asyncio.CancelledError, Exception):
+            pass
+        _runner = None
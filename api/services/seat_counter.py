@@ -0,0 +1,143 @@
+# api/services/seat_counter.py
+# -*- coding: utf-8 -*-
+"""
+事務所席次（login_users.current_users）
+- 計數由 client_line_users 的觸發器維護（api/migrations/04_current_users_counter.sql），
+  由部署時的 api/scripts/migrate.py 安裝；請求路徑只確認已安裝
+- bind_seat()：鎖住事務所那一列 → 判斷上限 → 寫入綁定，全部在同一個語句內完成，不再 COUNT(*)
+- 上限取 max_users；NULL 代表不限
+"""
+
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+try:
+    from api.schema_registry import schema_registry
+    from api.services.line_identity import invalidate_line_identity
+    from api.tenant_meta import invalidate_plan_status
+except ImportError:
+    from schema_registry import schema_registry  # type: ignore
+    from services.line_identity import invalidate_line_identity  # type: ignore
+    from tenant_meta import invalidate_plan_status  # type: ignore
+
+MIGRATION = Path(__file__).resolve().parents[1] / "migrations" / "04_current_users_counter.sql"
+
+
+class SeatUsage(NamedTuple):
+    client_id: str
+    client_name: Optional[str]
+    plan_type: Optional[str]
+    limit: Optional[int]
+    usage: int
+
+    @property
+    def available(self) -> Optional[int]:
+        return None if self.limit is None else max(0, self.limit - self.usage)
+
+    @property
+    def is_full(self) -> bool:
+        return self.limit is not None and self.usage >= self.limit
+
+
+class BindResult(NamedTuple):
+    seats: Optional[SeatUsage]  # None：找不到事務所或未啟用
+    already: bool               # 原本就是啟用中的綁定
+    bound: bool                 # 這次有寫入（新綁定或重新啟用）
+
+
+_INSTALLED_SQL = text(
+    "SELECT 1 FROM pg_trigger WHERE tgname = 'trg_client_line_users_seats' AND NOT tgisinternal"
+)
+
+
+def _installed(engine: Engine) -> bool:
+    with engine.connect() as conn:
+        return conn.execute(_INSTALLED_SQL).first() is not None
+
+
+def install_seat_counter(engine: Engine) -> None:
+    """部署時執行（會鎖 client_line_users 並回填計數）；已安裝則略過"""
+    if _installed(engine):
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(MIGRATION.read_text(encoding="utf-8"))
+
+
+def ensure_seat_counter(engine: Engine) -> None:
+    """只確認觸發器已安裝（每個程序查一次）；未安裝丟 MigrationMissing"""
+    schema_registry.require(engine, "seat_counter_trigger", lambda: _installed(engine), "seat_counter")
+
+
+# 已啟用的綁定不在 CTE 裡先查（語句快照看不到同時進行、剛 commit 的綁定），
+# 改由 ON CONFLICT 判斷：衝突列已啟用就不更新、ins 為空，再以新語句確認是否已綁定
+_BIND_SQL = text("""
+    WITH t AS (
+        SELECT client_id, client_name, plan_type::text AS plan_type, max_users,
+               COALESCE(current_users, 0) AS usage
+        FROM login_users
+        WHERE client_id = :cid AND is_active IS TRUE
+        FOR UPDATE
+    ), ins AS (
+        INSERT INTO client_line_users (client_id, client_name, line_user_id, user_role, is_active, bound_at)
+        SELECT t.client_id, t.client_name, :lid, :role, TRUE, NOW()
+        FROM t
+        WHERE t.max_users IS NULL OR t.usage < t.max_users
+        ON CONFLICT (client_id, line_user_id)
+        DO UPDATE SET client_name = EXCLUDED.client_name,
+                      user_role   = EXCLUDED.user_role,
+                      is_active   = TRUE,
+                      bound_at    = NOW()
+        WHERE client_line_users.is_active IS NOT TRUE
+        RETURNING 1
+    )
+    SELECT t.client_id, t.client_name, t.plan_type, t.max_users, t.usage,
+           EXISTS (SELECT 1 FROM ins) AS bound
+    FROM t
+""")
+
+_ACTIVE_SQL = text("""
+    SELECT 1 FROM client_line_users
+    WHERE client_id = :cid AND line_user_id = :lid AND is_active IS TRUE
+""")
+
+
+def bind_seat(db: Session, client_id: str, line_user_id: str, role: str) -> BindResult:
+    """佔用一個席次並綁定；額滿或已綁定時不寫入。會 commit。"""
+    ensure_seat_counter(db.get_bind())
+    row = db.execute(_BIND_SQL, {"cid": client_id, "lid": line_user_id, "role": role}).first()
+    # 沒寫入：可能額滿，也可能原本（或同時另一個請求剛）已綁定；新語句的快照看得到已 commit 的綁定
+    already = bool(row and not row.bound and db.execute(
+        _ACTIVE_SQL, {"cid": client_id, "lid": line_user_id}).first())
+    db.commit()
+    if not row:
+        return BindResult(None, False, False)
+    if row.bound:
+        invalidate_line_identity(line_user_id)
+        invalidate_plan_status(client_id)
+    # t 是寫入前的值；這次新增的那一席由觸發器加上
+    usage = int(row.usage) + (1 if row.bound else 0)
+    seats = SeatUsage(row.client_id, row.client_name, row.plan_type, row.max_users, usage)
+    return BindResult(seats, already, bool(row.bound))
+
+
+def get_seat_usage(db: Session, client_id: Optional[str] = None,
+                   client_name: Optional[str] = None) -> Optional[SeatUsage]:
+    """依 client_id 或 client_name（去頭尾空白比對）讀取席次。"""
+    ensure_seat_counter(db.get_bind())
+    if client_id:
+        where, params = "client_id = :v", {"v": client_id}
+    else:
+        where, params = "btrim(client_name) = :v", {"v": (client_name or "").strip()}
+    row = db.execute(text(f"""
+        SELECT client_id, client_name, plan_type::text AS plan_type, max_users, COALESCE(current_users, 0) AS usage
+        FROM login_users
+        WHERE {where}
+        LIMIT 1
+    """), params).first()
+    if not row:
+        return None
+    return SeatUsage(row.client_id, row.client_name, row.plan_type, row.max_users, int(row.usage))
@@ -0,0 +1,216 @@
+# api/services/session_store.py
+# -*- coding: utf-8 -*-
+"""
+LINE 數字選單的會話暫存（「?」→「1」→「2」）
+- memory（預設）：程序內 TTL + LRU，選單往返完全不寫 DB
+- postgres：沿用 user_query_sessions；過期資料改由背景任務定期一次清除，不再每則訊息 DELETE
+以環境變數 USER_SESSION_BACKEND=memory|postgres 切換；多程序部署請用 postgres。
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import text
+
+SESSION_BACKEND = os.getenv("USER_SESSION_BACKEND", "memory").strip().lower()
+SESSION_TTL_MINUTES = int(os.getenv("UQS_TTL_MINUTES", "30"))
+SESSION_MAX_USERS = int(os.getenv("USER_SESSION_MAX_USERS", "10000"))
+SESSION_SWEEP_SECONDS = int(os.getenv("USER_SESSION_SWEEP_SECONDS", "300"))
+
+
+class SessionStore(ABC):
+    """介面：同一使用者可有多個 scope；load_last 回傳最新且未過期的一筆。"""
+
+    @abstractmethod
+    async def save(self, line_user_id: str, scope: str, payload: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def load_last(self, line_user_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def consume_all(self, line_user_id: str) -> None:
+        ...
+
+    @abstractmethod
+    async def sweep(self) -> int:
+        """清除過期資料，回傳清除筆數。"""
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl_minutes: int = SESSION_TTL_MINUTES, max_users: int = SESSION_MAX_USERS):
+        self.ttl = ttl_minutes * 60
+        self.max_users = max(1, max_users)
+        self._lock = threading.Lock()
+        # line_user_id -> {scope: (到期 monotonic, created_at, payload)}
+        self._data: "OrderedDict[str, Dict[str, Tuple[float, datetime, Dict[str, Any]]]]" = OrderedDict()
+        self._counters: Dict[str, int] = {"saves": 0, "hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    async def save(self, line_user_id: str, scope: str, payload: Dict[str, Any]) -> None:
+        entry = (time.monotonic() + self.ttl, datetime.now(timezone.utc), payload)
+        with self._lock:
+            self._data.setdefault(line_user_id, {})[scope] = entry
+            self._data.move_to_end(line_user_id)
+            self._counters["saves"] += 1
+            while len(self._data) > self.max_users:
+                self._data.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    async def load_last(self, line_user_id: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            scopes = self._data.get(line_user_id)
+            live = {s: e for s, e in (scopes or {}).items() if e[0] > now}
+            if scopes is not None and len(live) != len(scopes):
+                self._counters["expired"] += len(scopes) - len(live)
+                if live:
+                    self._data[line_user_id] = live
+                else:
+                    del self._data[line_user_id]
+            if not live:
+                self._counters["misses"] += 1
+                return None
+            self._data.move_to_end(line_user_id)
+            self._counters["hits"] += 1
+            scope, (_, created_at, payload) = max(live.items(), key=lambda kv: kv[1][1])
+        return {"scope": scope, "payload": payload, "created_at": created_at}
+
+    async def consume_all(self, line_user_id: str) -> None:
+        with self._lock:
+            self._data.pop(line_user_id, None)
+
+    async def sweep(self) -> int:
+        now = time.monotonic()
+        removed = 0
+        with self._lock:
+            for lid in list(self._data):
+                scopes = self._data[lid]
+                live = {s: e for s, e in scopes.items() if e[0] > now}
+                removed += len(scopes) - len(live)
+                if live:
+                    self._data[lid] = live
+                else:
+                    del self._data[lid]
+            self._counters["expired"] += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", **self._counters, "users": len(self._data),
+                    "max_users": self.max_users, "ttl_minutes": self.ttl // 60}
+
+
+class PostgresSessionStore(SessionStore):
+    """user_query_sessions；過期判斷放在讀取條件，清除交給 sweep()。"""
+
+    def __init__(self, ttl_minutes: int = SESSION_TTL_MINUTES):
+        self.ttl_minutes = ttl_minutes
+        self._counters: Dict[str, int] = {"saves": 0, "hits": 0, "misses": 0, "swept": 0}
+
+    @staticmethod
+    def _engine():
+        try:
+            from api.database import get_async_engine
+        except ImportError:
+            from database import get_async_engine  # type: ignore
+        return get_async_engine()
+
+    async def save(self, line_user_id: str, scope: str, payload: Dict[str, Any]) -> None:
+        async with self._engine().begin() as conn:
+            # 同一交易內先刪同 scope 舊資料再新增（不可寫成 CTE：未被引用的 DELETE 會在 INSERT 之後才執行）
+            await conn.execute(text(
+                "DELETE FROM user_query_sessions WHERE line_user_id = :lid AND scope = :scope"
+            ), {"lid": line_user_id, "scope": scope})
+            await conn.execute(text("""
+                INSERT INTO user_query_sessions (line_user_id, session_key, scope, payload_json)
+                VALUES (:lid, :skey, :scope, :payload)
+            """), {"lid": line_user_id, "skey": str(uuid4()), "scope": scope,
+                   "payload": json.dumps(payload, ensure_ascii=False)})
+        self._counters["saves"] += 1
+
+    async def load_last(self, line_user_id: str) -> Optional[Dict[str, Any]]:
+        # 註：asyncpg 型別較嚴格，TTL 以 make_interval(mins => int) 帶入
+        async with self._engine().connect() as conn:
+            row = (await conn.execute(text("""
+                SELECT scope, payload_json, created_at
+                FROM user_query_sessions
+                WHERE line_user_id = :lid
+                  AND created_at >= NOW() - make_interval(mins => :ttl)
+                ORDER BY created_at DESC
+                LIMIT 1
+            """), {"lid": line_user_id, "ttl": self.ttl_minutes})).first()
+        if not row:
+            self._counters["misses"] += 1
+            return None
+        self._counters["hits"] += 1
+        scope, payload, created_at = row
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        return {"scope": scope, "payload": payload, "created_at": created_at}
+
+    async def consume_all(self, line_user_id: str) -> None:
+        async with self._engine().begin() as conn:
+            await conn.execute(text("DELETE FROM user_query_sessions WHERE line_user_id = :lid"),
+                               {"lid": line_user_id})
+
+    async def sweep(self) -> int:
+        async with self._engine().begin() as conn:
+            res = await conn.execute(text(
+                "DELETE FROM user_query_sessions WHERE created_at < NOW() - make_interval(mins => :ttl)"
+            ), {"ttl": self.ttl_minutes})
+        self._counters["swept"] += res.rowcount or 0
+        return res.rowcount or 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "postgres", **self._counters, "ttl_minutes": self.ttl_minutes}
+
+
+def _build_store() -> SessionStore:
+    if SESSION_BACKEND == "postgres":
+        return PostgresSessionStore()
+    return MemorySessionStore()
+
+
+session_store: SessionStore = _build_store()
+
+
+async def _sweep_loop(interval: int) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await session_store.sweep()
+        except Exception as e:
+            print(f">> session_store sweep failed: {e!r}")
+
+
+_sweeper: Optional[asyncio.Task] = None
+
+
+def start_session_sweeper(interval: int = SESSION_SWEEP_SECONDS) -> None:
+    """在 app startup 呼叫；同一程序只啟動一次。"""
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.get_running_loop().create_task(_sweep_loop(interval))
+
+
+async def stop_session_sweeper() -> None:
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        try:
+            await _sweeper
+        except (asyncio.CancelledError, Exception):
+            pass
+        _sweeper = None
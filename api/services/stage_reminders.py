@@ -0,0 +1,292 @@
+# api/services/stage_reminders.py
+# -*- coding: utf-8 -*-
+"""
+伺服器端期日提醒（取代桌面端開著才會掃的 DateReminderManager）
+- case_stage_events 由 case_records 觸發器維護（api/migrations/05_case_stage_events.sql），
+  由部署時的 api/scripts/migrate.py 安裝；請求路徑與排程只確認已安裝
+- 一次以 stage_date 範圍查詢找出所有租戶 [今天, 今天 + REMINDER_DAYS_AHEAD] 內尚未提醒的階段
+- 收件人：該事務所已綁定的律師 + 登錄姓名與當事人相同的已綁定用戶；經 line_push 佇列送出（同內容併成 multicast）
+- 認領（FOR UPDATE SKIP LOCKED + claimed_until 租約）在短交易內完成並 commit，等 LINE API 時不持有鎖與連線；
+  送達後以第二個短交易記 reminded_on（改期會重新提醒），失敗的釋放租約留待下一輪
+- REMINDER_ENABLED=1 才在 app 內定期執行；也可由排程呼叫 api/scripts/send_stage_reminders.py
+"""
+
+import asyncio
+import os
+import time
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+try:
+    from api.database import ENGINE, get_async_engine
+    from api.schema_registry import schema_registry
+    from api.services.line_service import line_push
+except ImportError:
+    from database import ENGINE, get_async_engine  # type: ignore
+    from schema_registry import schema_registry  # type: ignore
+    from services.line_service import line_push  # type: ignore
+
+REMINDER_ENABLED = os.getenv("REMINDER_ENABLED", "0").strip().lower() in ("1", "true", "yes", "on")
+REMINDER_INTERVAL_SECONDS = int(os.getenv("REMINDER_INTERVAL_SECONDS", "600"))
+REMINDER_DAYS_AHEAD = int(os.getenv("REMINDER_DAYS_AHEAD", "1"))
+REMINDER_TZ = os.getenv("REMINDER_TZ", "Asia/Taipei")
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "500"))
+# 認領後多久未回寫視為程序中斷，其他程序可重新認領
+REMINDER_LEASE_SECONDS = int(os.getenv("REMINDER_LEASE_SECONDS", "900"))
+
+MIGRATION = Path(__file__).resolve().parents[1] / "migrations" / "05_case_stage_events.sql"
+CLAIM_MIGRATION = Path(__file__).resolve().parents[1] / "migrations" / "07_case_stage_events_claim.sql"
+_WEEKDAYS = "一二三四五六日"
+
+
+_INSTALLED_SQL = text("""
+    SELECT to_regclass('case_records') IS NOT NULL AS has_cases,
+           EXISTS (SELECT 1 FROM pg_trigger
+                   WHERE tgrelid = to_regclass('case_records') AND tgname = 'trg_case_stage_events') AS installed,
+           EXISTS (SELECT 1 FROM pg_attribute
+                   WHERE attrelid = to_regclass('case_stage_events') AND attname = 'claimed_until'
+                     AND NOT attisdropped) AS has_claim
+""")
+
+
+def _installed(engine: Engine) -> bool:
+    with engine.connect() as conn:
+        row = conn.execute(_INSTALLED_SQL).first()
+    return bool(row.installed and row.has_claim)
+
+
+def install_stage_events(engine: Engine) -> None:
+    """部署時執行（05 會鎖 case_records 並全部重算）；已安裝的部分略過，沒有 case_records 則不做事"""
+    with engine.connect() as conn:
+        row = conn.execute(_INSTALLED_SQL).first()
+    if not row.has_cases:
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if not row.installed:
+            conn.exec_driver_sql(MIGRATION.read_text(encoding="utf-8"))
+        if not row.has_claim:
+            conn.exec_driver_sql(CLAIM_MIGRATION.read_text(encoding="utf-8"))
+
+
+def ensure_stage_events(engine: Engine) -> None:
+    """只確認觸發器已安裝（每個程序查一次）；未安裝丟 MigrationMissing"""
+    schema_registry.require(engine, "case_stage_events", lambda: _installed(engine), "stage_events")
+
+
+# ---- 查詢 ----
+_TODAY = "(now() AT TIME ZONE :tz)::date"
+
+_CALENDAR_SQL = text(f"""
+    SELECT client_id, case_id, stage, stage_date, stage_time, stage_date - {_TODAY} AS days_until,
+           client, case_type, case_number, court, division
+    FROM case_stage_events
+    WHERE client_id = :cid
+      AND stage_date BETWEEN {_TODAY} AND {_TODAY} + CAST(:days AS integer)
+    ORDER BY stage_date, stage_time NULLS LAST
+""")
+
+_DUE_WHERE = f"""
+    stage_date BETWEEN {_TODAY} AND {_TODAY} + CAST(:days AS integer)
+      AND reminded_on IS DISTINCT FROM stage_date
+      AND client_id IS NOT NULL
+      AND (claimed_until IS NULL OR claimed_until < now())
+"""
+
+# dry-run 只讀不認領
+_DUE_SQL = text(f"""
+    SELECT case_pk, client_id, case_id, stage, stage_date, stage_time, stage_date - {_TODAY} AS days_until,
+           client, case_type, case_number, court, division
+    FROM case_stage_events
+    WHERE {_DUE_WHERE}
+    ORDER BY stage_date, stage_time NULLS LAST
+    LIMIT :batch
+""")
+
+# 認領：鎖住的列寫上租約後隨交易 commit，其他程序的 _DUE_WHERE 會略過
+_CLAIM_SQL = text(f"""
+    WITH due AS (
+        SELECT case_pk, stage FROM case_stage_events
+        WHERE {_DUE_WHERE}
+        ORDER BY stage_date, stage_time NULLS LAST
+        LIMIT :batch
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE case_stage_events e
+    SET claimed_until = now() + make_interval(secs => :lease)
+    FROM due
+    WHERE e.case_pk = due.case_pk AND e.stage = due.stage
+    RETURNING e.case_pk, e.client_id, e.case_id, e.stage, e.stage_date, e.stage_time,
+              e.stage_date - {_TODAY} AS days_until,
+              e.client, e.case_type, e.case_number, e.court, e.division
+""")
+
+_RECIPIENTS_SQL = text("""
+    SELECT u.client_id, u.line_user_id, upper(COALESCE(u.user_role, '')) AS role,
+           btrim(COALESCE(p.expected_name, u.user_name, '')) AS name
+    FROM client_line_users u
+    LEFT JOIN pending_line_users p ON p.line_user_id = u.line_user_id AND p.status = 'registered'
+    WHERE u.client_id = ANY(:cids) AND u.is_active IS NOT FALSE
+""")
+
+# 記下實際提醒的日期：發送期間若改期，stage_date 已是新日期，仍會重新提醒
+_MARK_SQL = text("""
+    UPDATE case_stage_events SET reminded_on = :stage_date, reminded_at = now(), claimed_until = NULL
+    WHERE case_pk = :case_pk AND stage = :stage
+""")
+
+_RELEASE_SQL = text("""
+    UPDATE case_stage_events SET claimed_until = NULL
+    WHERE case_pk = :case_pk AND stage = :stage
+""")
+
+
+def upcoming_stage_events(db, client_id: str, days_ahead: int = 7) -> List[Dict[str, Any]]:
+    """事務所行事曆：今天起 days_ahead 天內的階段（走 ix_case_stage_events_client）。db 為同步 Session / Connection。"""
+    ensure_stage_events(db.get_bind() if hasattr(db, "get_bind") else db.engine)
+    rows = db.execute(_CALENDAR_SQL, {"cid": client_id, "days": days_ahead, "tz": REMINDER_TZ}).mappings().all()
+    return [dict(r) for r in rows]
+
+
+def format_reminder(ev: Dict[str, Any]) -> str:
+    d: date = ev["stage_date"]
+    days = int(ev["days_until"])
+    when = "今天" if days == 0 else "明天" if days == 1 else f"{days} 天後"
+    time_part = f" {ev['stage_time']}" if ev.get("stage_time") else ""
+    lines = [
+        f"⏰ 期日提醒（{when}）",
+        "────────────────────",
+        f"📅 {d.isoformat()}（{_WEEKDAYS[d.weekday()]}）{time_part}",
+        f"📍 階段：{ev['stage']}",
+        f"👤 當事人：{ev.get('client') or '-'}",
+        f"📌 案件編號：{ev.get('case_number') or ev['case_id']}",
+    ]
+    if ev.get("court"):
+        lines.append(f"法院：{ev['court']}" + (f" {ev['division']}" if ev.get("division") else ""))
+    lines.append("────────────────────")
+    lines.append("💡 輸入「?」可查詢案件詳情")
+    return "\n".join(lines)
+
+
+def _recipients_for(ev: Dict[str, Any], firm_users: List[Dict[str, Any]]) -> List[str]:
+    client = (ev.get("client") or "").strip()
+    out: List[str] = []
+    seen: Set[str] = set()
+    for u in firm_users:
+        if u["role"] == "LAWYER" or (client and u["name"] == client):
+            if u["line_user_id"] not in seen:
+                seen.add(u["line_user_id"])
+                out.append(u["line_user_id"])
+    return out
+
+
+async def _deliver(message: str, line_user_ids: List[str]) -> int:
+    if not line_user_ids:
+        return 0
+    results = await asyncio.gather(*(line_push.push_text(lid, message) for lid in line_user_ids),
+                                   return_exceptions=True)
+    return sum(1 for r in results if not isinstance(r, Exception))
+
+
+_stats: Dict[str, Any] = {"runs": 0, "events": 0, "messages": 0, "failed_events": 0,
+                          "last_run_at": None, "last_duration_ms": None}
+
+
+async def run_once(days_ahead: int = REMINDER_DAYS_AHEAD, dry_run: bool = False) -> Dict[str, int]:
+    """處理目前所有到期提醒；dry_run 只列出不發送、不標記。"""
+    await asyncio.to_thread(ensure_stage_events, ENGINE)
+    t0 = time.monotonic()
+    totals = {"events": 0, "messages": 0, "failed_events": 0}
+    params = {"days": days_ahead, "tz": REMINDER_TZ, "batch": REMINDER_BATCH, "lease": REMINDER_LEASE_SECONDS}
+    engine = get_async_engine()
+    while True:
+        # 第一個短交易：認領 + 讀收件人，commit 後才開始發送
+        async with engine.begin() as conn:
+            due = [dict(r) for r in (await conn.execute(_DUE_SQL if dry_run else _CLAIM_SQL, params)).mappings().all()]
+            if not due:
+                break
+            firms: Dict[str, List[Dict[str, Any]]] = {}
+            cids = sorted({ev["client_id"] for ev in due})
+            for u in (await conn.execute(_RECIPIENTS_SQL, {"cids": cids})).mappings().all():
+                firms.setdefault(u["client_id"], []).append(dict(u))
+
+        # UPDATE ... RETURNING 不保證順序
+        due.sort(key=lambda ev: (ev["stage_date"], ev["stage_time"] is None, ev["stage_time"] or ""))
+        plan = [(ev, format_reminder(ev), _recipients_for(ev, firms.get(ev["client_id"], []))) for ev in due]
+        if dry_run:
+            for ev, message, lids in plan:
+                print(f"• {ev['client_id']} {ev['case_id']} {ev['stage']} {ev['stage_date']} → {len(lids)} 人")
+            totals["events"] += len(plan)
+            break
+
+        sent: List[int] = [0] * len(plan)
+        try:
+            sent = await asyncio.gather(*(_deliver(message, lids) for _, message, lids in plan))
+        finally:
+            # 第二個短交易：沒有收件人也標記，避免每輪重掃；全部失敗（或被取消）的釋放租約留待下一輪
+            done, failed = [], []
+            for (ev, _, lids), n in zip(plan, sent):
+                key = {"case_pk": ev["case_pk"], "stage": ev["stage"]}
+                if n or not lids:
+                    done.append({**key, "stage_date": ev["stage_date"]})
+                else:
+                    failed.append(key)
+            async with engine.begin() as conn:
+                if done:
+                    await conn.execute(_MARK_SQL, done)
+                if failed:
+                    await conn.execute(_RELEASE_SQL, failed)
+        totals["events"] += len(done)
+        totals["messages"] += sum(sent)
+        totals["failed_events"] += len(failed)
+        if len(due) < REMINDER_BATCH or failed:
+            break
+
+    if dry_run:
+        return totals
+    _stats["runs"] += 1
+    for k, v in totals.items():
+        _stats[k] += v
+    _stats["last_run_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    _stats["last_duration_ms"] = round((time.monotonic() - t0) * 1000, 1)
+    return totals
+
+
+def stage_reminder_stats() -> Dict[str, Any]:
+    return {**_stats, "enabled": REMINDER_ENABLED, "interval_seconds": REMINDER_INTERVAL_SECONDS,
+            "days_ahead": REMINDER_DAYS_AHEAD}
+
+
+async def _reminder_loop(interval: int) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_once()
+        except Exception as e:
+            print(f">> stage reminders failed: {e!r}")
+
+
+_runner: Optional[asyncio.Task] = None
+
+
+def start_stage_reminders(interval: int = REMINDER_INTERVAL_SECONDS) -> None:
+    """在 app startup 呼叫；REMINDER_ENABLED 未開啟時不做事。"""
+    global _runner
+    if not REMINDER_ENABLED:
+        return
+    if _runner is None or _runner.done():
+        _runner = asyncio.get_running_loop().create_task(_reminder_loop(interval))
+
+
+async def stop_stage_reminders() -> None:
+    global _runner
+    if _runner is not None:
+        _runner.cancel()
+        try:
+            await _runner
+        except (asyncio.CancelledError, Exception):
+            pass
+        _runner = None
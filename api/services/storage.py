@@ -1,5 +1,23 @@
 # api/services/storage.py
+# -*- coding: utf-8 -*-
+"""
+S3 儲存
+- s3_put_bytes：小檔 / 已在記憶體的內容
+- s3_put_stream：從檔案物件（UploadFile 的 spool）分段讀取，以 multipart upload 並行上傳；
+  同一次上傳最多 S3_UPLOAD_CONCURRENCY 段在傳、1 段在讀，邊讀邊算 SHA-256 與大小
+- presign_upload / complete_presigned：桌面端直接 PUT 到 S3（單檔或 multipart），API 只簽網址與事後驗證；
+  list_uploaded_parts / presign_parts：中斷後從 S3 已收到的分段接續
+  未完成的 multipart 請在 bucket 設 AbortIncompleteMultipartUpload 生命週期規則清掉
+- copy_object / sha256_of_object：內容定址去重（services/file_store.py）搬移與驗證物件
+- S3_ENDPOINT_URL 可指向 MinIO / moto 等相容服務
+"""
+
+import hashlib
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional
+
 import boto3
 from botocore.config import Config
 
@@ -8,21 +26,283 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_DEFAULT_REGION    = os.getenv("AWS_DEFAULT_REGION", "ap-northeast-1")
 S3_BUCKET             = os.getenv("S3_BUCKET")
 S3_PREFIX             = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL       = os.getenv("S3_ENDPOINT_URL") or None
 
-_s3 = boto3.client(
-    "s3",
-    region_name=AWS_DEFAULT_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    config=Config(signature_version="s3v4"),
-)
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 限制：除最後一段外每段至少 5 MiB
+S3_PART_SIZE = max(MIN_PART_SIZE, int(float(os.getenv("S3_PART_SIZE_MB", "8")) * 1024 * 1024))
+S3_UPLOAD_CONCURRENCY = max(1, int(os.getenv("S3_UPLOAD_CONCURRENCY", "4")))
+S3_UPLOAD_THREADS = max(1, int(os.getenv("S3_UPLOAD_THREADS", "16")))  # 全程序共用的上傳執行緒
+S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES_SECONDS", "3600"))
+MAX_PARTS = 10000
+MAX_COPY_BYTES = 5 * 1024 ** 3   # 單次 CopyObject 上限
 
-def s3_put_bytes(client_id: str, key: str, data: bytes, content_type: str = "application/octet-stream") -> str:
-    """上傳 bytes 到 S3，回傳 s3 路徑。"""
-    if not S3_BUCKET:
-        raise RuntimeError("S3_BUCKET not set")
+_s3 = None
+_s3_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"uploads": 0, "multipart": 0, "parts": 0, "bytes": 0, "aborted": 0,
+                          "buffered_parts": 0, "peak_buffered_parts": 0}
+
+
+def _client():
+    # 第一次用到才建立（測試時可先啟動 moto 再呼叫）
+    global _s3
+    if _s3 is None:
+        with _s3_lock:
+            if _s3 is None:
+                _s3 = boto3.client(
+                    "s3",
+                    region_name=AWS_DEFAULT_REGION,
+                    endpoint_url=S3_ENDPOINT_URL,
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    config=Config(signature_version="s3v4", max_pool_connections=S3_UPLOAD_THREADS),
+                )
+    return _s3
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _s3_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=S3_UPLOAD_THREADS, thread_name_prefix="s3-part")
+    return _pool
+
+
+def tenant_key(client_id: str, key: str) -> str:
     prefix = (S3_PREFIX or "").rstrip("/")
     tenant_prefix = f"{prefix}/{client_id}".lstrip("/")
-    full_key = f"{tenant_prefix}/{key}".lstrip("/")
-    _s3.put_object(Bucket=S3_BUCKET, Key=full_key, Body=data, ContentType=content_type)
-    return f"s3://{S3_BUCKET}/{full_key}"
+    return f"{tenant_prefix}/{key}".lstrip("/")
+
+
+def _bucket() -> str:
+    if not S3_BUCKET:
+        raise RuntimeError("S3_BUCKET not set")
+    return S3_BUCKET
+
+
+def s3_put_bytes(client_id: str, key: str, data: bytes, content_type: str = "application/octet-stream") -> str:
+    """上傳 bytes 到 S3，回傳 s3 路徑。"""
+    bucket = _bucket()
+    full_key = tenant_key(client_id, key)
+    _client().put_object(Bucket=bucket, Key=full_key, Body=data, ContentType=content_type)
+    return f"s3://{bucket}/{full_key}"
+
+
+class StoredObject(NamedTuple):
+    bucket: str
+    key: str
+    size: int
+    sha256: str
+    parts: int      # 0 代表單次 put_object
+    etag: Optional[str]
+
+    @property
+    def url(self) -> str:
+        return f"s3://{self.bucket}/{self.key}"
+
+
+def _buffered(delta: int) -> None:
+    with _stats_lock:
+        _stats["buffered_parts"] += delta
+        if _stats["buffered_parts"] > _stats["peak_buffered_parts"]:
+            _stats["peak_buffered_parts"] = _stats["buffered_parts"]
+
+
+def s3_put_stream(client_id: str, key: str, fileobj: BinaryIO,
+                  content_type: str = "application/octet-stream",
+                  part_size: int = S3_PART_SIZE, concurrency: int = S3_UPLOAD_CONCURRENCY) -> StoredObject:
+    """
+    從 fileobj 目前位置讀到結尾並上傳（同步；async 路由請包 run_in_threadpool）。
+    不超過一段的檔案直接 put_object；失敗時會 abort multipart，不留下未完成的分段。
+    """
+    bucket = _bucket()
+    full_key = tenant_key(client_id, key)
+    part_size = max(MIN_PART_SIZE, int(part_size))
+    s3 = _client()
+    digest = hashlib.sha256()
+    size = 0
+
+    first = fileobj.read(part_size)
+    digest.update(first)
+    size += len(first)
+    if len(first) < part_size:
+        resp = s3.put_object(Bucket=bucket, Key=full_key, Body=first, ContentType=content_type)
+        _count(size, parts=0)
+        return StoredObject(bucket, full_key, size, digest.hexdigest(), 0, resp.get("ETag"))
+
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=full_key, ContentType=content_type)["UploadId"]
+    slots = threading.BoundedSemaphore(max(1, concurrency))
+    futures: List[Any] = []
+
+    def _send(number: int, body: bytes) -> Dict[str, Any]:
+        try:
+            etag = s3.upload_part(Bucket=bucket, Key=full_key, UploadId=upload_id,
+                                  PartNumber=number, Body=body)["ETag"]
+            return {"PartNumber": number, "ETag": etag}
+        finally:
+            _buffered(-1)
+            slots.release()
+
+    try:
+        chunk, number = first, 1
+        while chunk:
+            slots.acquire()  # 在傳的段數到上限就等，讀取端不會跑在前面
+            _buffered(1)
+            try:
+                futures.append(_executor().submit(_send, number, chunk))
+            except BaseException:
+                _buffered(-1)
+                slots.release()
+                raise
+            chunk = None  # 交給上傳執行緒後就放掉參考
+            if futures[-1].done() and futures[-1].exception():
+                break  # 已有分段失敗，不必讀完
+            chunk = fileobj.read(part_size)
+            digest.update(chunk)
+            size += len(chunk)
+            number += 1
+        parts = [f.result() for f in futures]
+        resp = s3.complete_multipart_upload(Bucket=bucket, Key=full_key, UploadId=upload_id,
+                                            MultipartUpload={"Parts": parts})
+    except BaseException:
+        for f in futures:
+            if f.cancel():
+                _buffered(-1)
+        wait(futures)  # 等在傳的分段結束再 abort，避免 abort 後又寫入
+        try:
+            s3.abort_multipart_upload(Bucket=bucket, Key=full_key, UploadId=upload_id)
+        except Exception as e:
+            print(f"❌ abort multipart 失敗: {e}")
+        with _stats_lock:
+            _stats["aborted"] += 1
+        raise
+    _count(size, parts=len(parts))
+    return StoredObject(bucket, full_key, size, digest.hexdigest(), len(parts), resp.get("ETag"))
+
+
+def _count(size: int, parts: int) -> None:
+    with _stats_lock:
+        _stats["uploads"] += 1
+        _stats["bytes"] += size
+        if parts:
+            _stats["multipart"] += 1
+            _stats["parts"] += parts
+
+
+# ---- 直傳（presigned URL）----
+def presign_upload(full_key: str, size: int, content_type: str = "application/octet-stream",
+                   part_size: int = S3_PART_SIZE, expires: int = S3_PRESIGN_EXPIRES) -> Dict[str, Any]:
+    """
+    size 不超過一段 → {"mode": "put", "url", "headers"}；
+    否則建立 multipart → {"mode": "multipart", "upload_id", "part_size", "parts": [{"part_number", "url"}]}
+    """
+    bucket = _bucket()
+    s3 = _client()
+    headers = {"Content-Type": content_type}
+    if size <= part_size:
+        url = s3.generate_presigned_url(
+            "put_object", ExpiresIn=expires,
+            Params={"Bucket": bucket, "Key": full_key, "ContentType": content_type},
+        )
+        return {"mode": "put", "url": url, "headers": headers, "expires_in": expires}
+
+    part_size = max(MIN_PART_SIZE, int(part_size), -(-size // MAX_PARTS))
+    count = -(-size // part_size)
+    upload_id = s3.create_multipart_upload(Bucket=bucket, Key=full_key, ContentType=content_type)["UploadId"]
+    parts = [
+        {"part_number": n, "url": s3.generate_presigned_url(
+            "upload_part", ExpiresIn=expires,
+            Params={"Bucket": bucket, "Key": full_key, "UploadId": upload_id, "PartNumber": n},
+        )}
+        for n in range(1, count + 1)
+    ]
+    return {"mode": "multipart", "upload_id": upload_id, "part_size": part_size, "parts": parts,
+            "expires_in": expires}
+
+
+def presign_parts(full_key: str, upload_id: str, part_numbers: List[int],
+                  expires: int = S3_PRESIGN_EXPIRES) -> List[Dict[str, Any]]:
+    """替既有 multipart 重新簽指定分段的網址（續傳用；原網址可能已過期）"""
+    bucket = _bucket()
+    s3 = _client()
+    return [
+        {"part_number": n, "url": s3.generate_presigned_url(
+            "upload_part", ExpiresIn=expires,
+            Params={"Bucket": bucket, "Key": full_key, "UploadId": upload_id, "PartNumber": n},
+        )}
+        for n in part_numbers
+    ]
+
+
+def list_uploaded_parts(full_key: str, upload_id: str) -> Optional[List[Dict[str, Any]]]:
+    """S3 已收到的分段 [{"part_number", "etag", "size"}]；multipart 已完成 / abort / 不存在時回傳 None"""
+    s3 = _client()
+    parts: List[Dict[str, Any]] = []
+    kwargs: Dict[str, Any] = {"Bucket": _bucket(), "Key": full_key, "UploadId": upload_id}
+    while True:
+        try:
+            resp = s3.list_parts(**kwargs)
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("NoSuchUpload", "404"):
+                return None
+            raise
+        parts.extend({"part_number": p["PartNumber"], "etag": p["ETag"], "size": p["Size"]}
+                     for p in resp.get("Parts", []))
+        if not resp.get("IsTruncated"):
+            return parts
+        kwargs["PartNumberMarker"] = resp["NextPartNumberMarker"]
+
+
+def head_object(full_key: str) -> Optional[Dict[str, Any]]:
+    try:
+        resp = _client().head_object(Bucket=_bucket(), Key=full_key)
+    except Exception as e:
+        if getattr(e, "response", {}).get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return {"size": int(resp["ContentLength"]), "etag": resp.get("ETag"), "content_type": resp.get("ContentType")}
+
+
+def complete_presigned(full_key: str, upload_id: Optional[str] = None,
+                       parts: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+    """multipart 先以 client 回報的 ETag 完成（S3 會逐段比對），再 HEAD 確認物件存在；不存在回 None。"""
+    ordered: List[Dict[str, Any]] = []
+    if upload_id:
+        ordered = sorted(({"PartNumber": int(p["part_number"]), "ETag": p["etag"]} for p in parts or []),
+                         key=lambda p: p["PartNumber"])
+        _client().complete_multipart_upload(Bucket=_bucket(), Key=full_key, UploadId=upload_id,
+                                            MultipartUpload={"Parts": ordered})
+    info = head_object(full_key)
+    if info:
+        _count(info["size"], parts=len(ordered))
+    return info
+
+
+def delete_object(full_key: str) -> None:
+    _client().delete_object(Bucket=_bucket(), Key=full_key)
+
+
+def copy_object(src_key: str, dst_key: str) -> None:
+    """同 bucket 內伺服器端複製（不經本程序；大小需 ≤ MAX_COPY_BYTES）"""
+    bucket = _bucket()
+    _client().copy_object(Bucket=bucket, Key=dst_key, CopySource={"Bucket": bucket, "Key": src_key})
+
+
+def sha256_of_object(full_key: str, chunk_size: int = MIN_PART_SIZE) -> str:
+    """串流讀回物件算 SHA-256（驗證 client 回報的雜湊用，記憶體只佔一個 chunk）"""
+    body = _client().get_object(Bucket=_bucket(), Key=full_key)["Body"]
+    digest = hashlib.sha256()
+    try:
+        for chunk in iter(lambda: body.read(chunk_size), b""):
+            digest.update(chunk)
+    finally:
+        body.close()
+    return digest.hexdigest()
+
+
+def storage_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return {**_stats, "part_size": S3_PART_SIZE, "concurrency": S3_UPLOAD_CONCURRENCY}
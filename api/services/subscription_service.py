@@ -13,6 +13,8 @@ from api.models_control import (
     PlanType, UserStatus
 )
 from api.constants.plans import canonical_plan, plan_limit
+from api.services.line_identity import line_identity
+from api.tenant_meta import get_plan_status, invalidate_tenant_meta
 
 
 class SubscriptionService:
@@ -44,13 +46,12 @@ class SubscriptionService:
             bool: 是付費用戶返回 True，否則返回 False
         """
         try:
-            tenant_user = db.query(TenantUser).filter(
-                and_(
-                    TenantUser.user_id == user_id,
-                    TenantUser.status == "active"  # ✅ 改為字串比較
-                )
-            ).first()
-            return tenant_user is not None
+            # 綁定與方案都走快取；方案快照在 paid_until 當下失效
+            ident = line_identity.resolve(db, user_id)
+            if not ident.is_bound:
+                return False
+            plan = get_plan_status(ident.client_id)
+            return plan is not None and plan.is_paid
         except Exception as e:
             print(f"❌ 檢查付費用戶失敗: {e}")
             return False
@@ -134,21 +135,13 @@ class SubscriptionService:
             Dict: 方案狀態資訊
         """
         try:
-            tenant = db.query(Tenant).filter(Tenant.schema_name == client_id).first()
-            if not tenant:
+            # 方案與人數讀快照（current_users 由觸發器維護），不再逐次 COUNT 與回寫
+            plan = get_plan_status(client_id)
+            if not plan:
                 return {"success": False, "message": "租戶不存在"}
 
-            # 計算實際用戶數
-            current_paid_users = db.query(TenantUser).filter(
-                and_(
-                    TenantUser.client_id == client_id,
-                    TenantUser.status == UserStatus.ACTIVE
-                )
-            ).count()
-
-            # 更新租戶的用戶數
-            tenant.current_users = current_paid_users
-            db.commit()
+            current_paid_users = plan.current_users
+            limit = plan.max_users or 0
 
             pending_users = db.query(PendingUser).filter(
                 and_(
@@ -159,15 +152,17 @@ class SubscriptionService:
 
             return {
                 "success": True,
-                "tenant_name": tenant.name,
-                "plan_type": tenant.plan_type.value,
-                "plan_limit": tenant.plan_limit,
+                "tenant_name": plan.client_name,
+                "plan_type": plan.plan_type,
+                "plan_limit": limit,
                 "current_users": current_paid_users,
                 "pending_users": pending_users,
-                "available_slots": max(0, tenant.plan_limit - current_paid_users),
-                "usage_percentage": round((current_paid_users / tenant.plan_limit) * 100, 1),
-                "is_plan_full": current_paid_users >= tenant.plan_limit,
-                "is_active": tenant.is_active
+                "available_slots": max(0, limit - current_paid_users),
+                "usage_percentage": round((current_paid_users / limit) * 100, 1) if limit else 0.0,
+                "is_plan_full": current_paid_users >= limit,
+                "is_active": plan.is_active,
+                "is_paid": plan.is_paid,
+                "paid_until": plan.paid_until.isoformat() if plan.paid_until else None
             }
 
         except Exception as e:
@@ -221,6 +216,7 @@ class SubscriptionService:
 
             db.add(history)
             db.commit()
+            invalidate_tenant_meta(client_id)
 
             return {
                 "success": True,
@@ -503,6 +499,7 @@ class SubscriptionService:
 
             # 檢查是否有待審核用戶可以自動啟用
             auto_promoted = self._auto_promote_pending_user(client_id, db)
+            invalidate_tenant_meta(client_id)  # 含方案快照；自動提升後再作廢，人數才是最新
 
             return {
                 "success": True,
@@ -6,6 +6,11 @@ from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from sqlalchemy import create_engine, text
 from api.database import Base, DATABASE_URL
 from api.models_cases import CaseRecord  # 讓 ORM 知道要建哪些索引/表
+from api.tenant_db import tenant_engines
+from api.tenant_meta import invalidate_tenant_meta
+from api.schema_registry import schema_registry
+from api.case_partitions import ensure_case_partition
+from api.services.case_search import create_trgm_indexes
 
 # ------------------ 工具 ------------------
 
@@ -109,6 +114,23 @@ def _migrate_case_records_columns(engine, schema: str):
     if "created_at" not in cols:
         raise RuntimeError(f"[migrate] created_at still missing in {schema}. Actual columns: {cols}")
 
+def _ensure_trgm_extension(root_engine):
+    """pg_trgm 一個 DB 只能裝一次；回傳所在 schema（沒有權限安裝則回傳 None）。"""
+    with root_engine.begin() as cx:
+        found = cx.execute(text(
+            "SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace "
+            "WHERE e.extname = 'pg_trgm'"
+        )).scalar()
+    if found:
+        return found
+    try:
+        with root_engine.begin() as cx:
+            cx.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public"))
+        return "public"
+    except Exception as e:
+        print(f"[tenant] pg_trgm unavailable, case search falls back to ILIKE: {e}")
+        return None
+
 # ------------------ 對外主流程 ------------------
 
 def ensure_tenant_schema(client_id: str) -> str:
@@ -119,7 +141,8 @@ def ensure_tenant_schema(client_id: str) -> str:
       2) fallback 建表（若不存在）
       3) migrate 補欄位
       4) ORM 建索引/約束
-      5) 回寫 login_users.tenant_db_url
+      5) 案件搜尋用 pg_trgm GIN 索引（租戶 schema；控制庫由部署時的 migrate.py 建）
+      6) 回寫 login_users.tenant_db_url
     回傳：schema_url
     """
     schema = _schema_name(client_id)
@@ -149,6 +172,11 @@ def ensure_tenant_schema(client_id: str) -> str:
     _set_search_path(tenant_engine, schema)
     Base.metadata.create_all(bind=tenant_engine, tables=[CaseRecord.__table__])
 
+    # 3.5) 案件搜尋索引：只建租戶 schema（新表，CONCURRENTLY）；
+    #      控制庫共用 case_records 的索引由部署時的 api/scripts/migrate.py 建立，不在這裡擋所有租戶的寫入
+    if _ensure_trgm_extension(root_engine):
+        create_trgm_indexes(tenant_engine)
+
     # 4) 回寫 URL 到 login_users（用 client_id 當 key）
     with root_engine.begin() as cx:
         cx.execute(
@@ -160,6 +188,17 @@ def ensure_tenant_schema(client_id: str) -> str:
             {"u": schema_url, "cid": client_id}
         )
 
+    # 5) 控制庫的 case_records 若已分割，先為新租戶建好分割
+    ensure_case_partition(root_engine, client_id)
+
+    # 註冊表內舊的租戶連線池作廢；bootstrap 用的臨時 engine 一併釋放
+    invalidate_tenant_meta(client_id)
+    tenant_engines.invalidate(client_id)
+    # schema 剛被建立/遷移：該租戶的就緒檢查重新啟用
+    schema_registry.rearm(client_id)
+    tenant_engine.dispose()
+    root_engine.dispose()
+
     # 讓你在 log 看得見（可留可拿掉）
     print(f"[tenant] schema={schema}")
     print(f"[tenant] schema_url={schema_url}")
@@ -11,6 +11,7 @@ from typing import Optional, Dict, Any, List
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, func
 from api.models_control import TenantUser, Tenant
+from api.tenant_meta import get_plan_status
 import uuid
 import qrcode
 import io
@@ -262,16 +263,17 @@ class TenantBusinessService:
             Optional[Dict]: 方案上限資訊
         """
         try:
-            tenant = db.query(Tenant).filter(Tenant.schema_name == client_id).first()
-            if not tenant:
+            # 讀方案快照，升級 / 移除用戶時作廢，付費中的在 paid_until 當下到期
+            plan = get_plan_status(client_id)
+            if not plan:
                 return None
 
             return {
                 'client_id': client_id,
-                'client_name': tenant.name,
-                'user_limit': tenant.plan_limit,
-                'plan_type': getattr(tenant, 'plan_type', 'unknown'),
-                'is_active': getattr(tenant, 'is_active', True)
+                'client_name': plan.client_name,
+                'user_limit': plan.max_users,
+                'plan_type': plan.plan_type or 'unknown',
+                'is_active': plan.is_active
             }
 
         except Exception as e:
@@ -0,0 +1,351 @@
+# api/tenant_meta.py
+# -*- coding: utf-8 -*-
+"""
+租戶中繼資料 TTL 快取（login_users 的 tenant_db_url / client_name / 方案狀態）
+- 全程序共用，命中時不需再查控制庫
+- tenant_bootstrap 改寫 tenant_db_url、方案異動時須呼叫 invalidate_tenant_meta()
+- 另含暗號對照表（secret_code → client_id / client_name），同樣由 invalidate_tenant_meta() 作廢
+- 方案快照（PlanSnapshot）在 paid_until 當下到期，不必等 TTL；到期後的 DB 狀態由 services/plan_expiry 翻轉
+"""
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+TENANT_META_TTL = float(os.getenv("TENANT_META_TTL_SECONDS", "300"))
+TENANT_META_NEG_TTL = float(os.getenv("TENANT_META_NEG_TTL_SECONDS", "15"))  # 查無資料的快取時間
+TENANT_META_MAX_ENTRIES = int(os.getenv("TENANT_META_MAX_ENTRIES", "2000"))
+
+
+class TenantMeta(NamedTuple):
+    client_id: str
+    client_name: Optional[str]
+    tenant_db_url: Optional[str]
+    plan_type: Optional[str]
+    is_active: bool
+    tenant_status: bool
+
+
+_SQL = text("""
+    SELECT client_id, client_name, tenant_db_url, plan_type::text, is_active, tenant_status
+    FROM login_users
+    WHERE client_id = :cid
+    LIMIT 1
+""")
+
+
+class TenantMetaCache:
+    def __init__(self, ttl: float = TENANT_META_TTL, negative_ttl: float = TENANT_META_NEG_TTL,
+                 max_entries: int = TENANT_META_MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        # LRU：查無資料的 client_id 也會佔位，需有上限
+        self._data: "OrderedDict[str, Tuple[float, Optional[TenantMeta]]]" = OrderedDict()
+        self._version = 0
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    def _load(self, client_id: str) -> Optional[TenantMeta]:
+        try:
+            from api.database import engine
+        except ImportError:
+            from database import engine  # type: ignore
+        with engine.connect() as conn:
+            row = conn.execute(_SQL, {"cid": client_id}).fetchone()
+        if not row:
+            return None
+        return TenantMeta(
+            client_id=row[0],
+            client_name=row[1],
+            tenant_db_url=row[2],
+            plan_type=row[3],
+            is_active=bool(row[4]),
+            tenant_status=bool(row[5]),
+        )
+
+    def get(self, client_id: str) -> Optional[TenantMeta]:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(client_id)
+            if hit and hit[0] > now:
+                self._data.move_to_end(client_id)
+                self._counters["hits"] += 1
+                return hit[1]
+            self._counters["misses"] += 1
+            version = self._version
+
+        meta = self._load(client_id)
+        ttl = self.ttl if meta else self.negative_ttl
+        with self._lock:
+            if version == self._version:  # 載入期間被作廢就不寫入
+                self._data[client_id] = (time.monotonic() + ttl, meta)
+                self._data.move_to_end(client_id)
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+                    self._counters["evictions"] += 1
+        return meta
+
+    def invalidate(self, client_id: Optional[str] = None) -> None:
+        with self._lock:
+            self._version += 1
+            self._counters["invalidations"] += 1
+            if client_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(client_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._data), "max_entries": self.max_entries,
+                    "ttl_seconds": self.ttl}
+
+
+tenant_meta_cache = TenantMetaCache()
+
+
+def get_tenant_meta(client_id: str) -> Optional[TenantMeta]:
+    if not client_id:
+        return None
+    return tenant_meta_cache.get(client_id)
+
+
+def invalidate_tenant_meta(client_id: Optional[str] = None) -> None:
+    """client_id=None 代表全部清空。"""
+    tenant_meta_cache.invalidate(client_id)
+    plan_status_cache.invalidate(client_id)
+    secret_code_map.invalidate()
+
+
+# ---- 方案快照（plan_type / 人數上限 / 是否在付費期間）----
+PLAN_STATUS_TTL = float(os.getenv("PLAN_STATUS_TTL_SECONDS", "60"))
+
+
+class PlanSnapshot(NamedTuple):
+    client_id: str
+    client_name: Optional[str]
+    plan_type: Optional[str]
+    user_status: Optional[str]
+    max_users: Optional[int]
+    current_users: int          # 僅供顯示；席次上限由 bind_seat 在交易內即時檢查
+    is_active: bool
+    tenant_status: bool         # 已套用 paid_until：過期即為 False，不必等 DB 翻轉
+    paid_until: Optional[datetime]
+
+    @property
+    def is_paid(self) -> bool:
+        return self.tenant_status
+
+
+_PLAN_SQL = text("""
+    SELECT client_id, client_name, plan_type::text, user_status, max_users, COALESCE(current_users, 0),
+           is_active, tenant_status AND (paid_until IS NULL OR paid_until > now()), paid_until
+    FROM login_users
+    WHERE client_id = :cid
+    LIMIT 1
+""")
+
+
+class PlanStatusCache:
+    """以 client_id 為鍵；付費中的租戶在 min(TTL, paid_until) 到期。"""
+
+    def __init__(self, ttl: float = PLAN_STATUS_TTL, negative_ttl: float = TENANT_META_NEG_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._data: Dict[str, Tuple[float, bool, Optional[PlanSnapshot]]] = {}
+        self._version = 0
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "invalidations": 0, "paid_until_expiries": 0}
+        # services/plan_expiry 啟動時設定：讀到 paid_until 就排入 timer wheel
+        self.on_paid_until: Optional[Callable[[str, datetime], None]] = None
+
+    def _load(self, client_id: str) -> Optional[PlanSnapshot]:
+        try:
+            from api.database import engine
+        except ImportError:
+            from database import engine  # type: ignore
+        with engine.connect() as conn:
+            row = conn.execute(_PLAN_SQL, {"cid": client_id}).fetchone()
+        if not row:
+            return None
+        return PlanSnapshot(
+            client_id=row[0],
+            client_name=row[1],
+            plan_type=row[2],
+            user_status=row[3],
+            max_users=row[4],
+            current_users=int(row[5]),
+            is_active=bool(row[6]),
+            tenant_status=bool(row[7]),
+            paid_until=row[8],
+        )
+
+    def _expires_at(self, snap: Optional[PlanSnapshot]) -> Tuple[float, bool]:
+        now = time.monotonic()
+        if snap is None:
+            return now + self.negative_ttl, False
+        if snap.tenant_status and snap.paid_until is not None:
+            left = (snap.paid_until - datetime.now(timezone.utc)).total_seconds()
+            if left < self.ttl:
+                return now + max(0.0, left), True
+        return now + self.ttl, False
+
+    def get(self, client_id: str) -> Optional[PlanSnapshot]:
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(client_id)
+            if hit and hit[0] > now:
+                self._counters["hits"] += 1
+                return hit[2]
+            if hit and hit[1]:
+                self._counters["paid_until_expiries"] += 1
+            self._counters["misses"] += 1
+            version = self._version
+
+        snap = self._load(client_id)
+        expires, at_paid_until = self._expires_at(snap)
+        with self._lock:
+            if version == self._version:  # 載入期間被作廢就不寫入
+                self._data[client_id] = (expires, at_paid_until, snap)
+        hook = self.on_paid_until
+        if hook and snap and snap.tenant_status and snap.paid_until is not None:
+            hook(client_id, snap.paid_until)
+        return snap
+
+    def invalidate(self, client_id: Optional[str] = None) -> None:
+        with self._lock:
+            self._version += 1
+            self._counters["invalidations"] += 1
+            if client_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(client_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._data), "ttl_seconds": self.ttl}
+
+
+plan_status_cache = PlanStatusCache()
+
+
+def get_plan_status(client_id: Optional[str]) -> Optional[PlanSnapshot]:
+    if not client_id:
+        return None
+    return plan_status_cache.get(client_id)
+
+
+def invalidate_plan_status(client_id: Optional[str] = None) -> None:
+    """只作廢方案快照（例如席次變動），不動暗號對照表。"""
+    plan_status_cache.invalidate(client_id)
+
+
+# ---- 暗號（secret_code）對照表 ----
+# login_users 筆數不多，整份載入記憶體；非暗號的訊息直接在記憶體判定，不查資料庫
+SECRET_MAP_TTL = float(os.getenv("SECRET_CODE_MAP_TTL_SECONDS", "60"))
+
+_ZERO_WIDTH_RE = re.compile(r"[\u200B-\u200D\uFEFF]")
+
+
+def normalize_secret_code(raw: Optional[str]) -> Optional[str]:
+    """寫入與比對共用：去除零寬字元、全形轉半形（NFKC）、去頭尾空白；空字串視為 None。"""
+    if raw is None:
+        return None
+    s = unicodedata.normalize("NFKC", _ZERO_WIDTH_RE.sub("", str(raw))).strip()
+    return s or None
+
+
+class SecretEntry(NamedTuple):
+    client_id: str
+    client_name: Optional[str]
+    is_active: bool
+
+
+_SECRET_SQL = text("""
+    SELECT secret_code, client_id, client_name, is_active
+    FROM login_users
+    WHERE secret_code IS NOT NULL
+""")
+
+
+class SecretCodeMap:
+    def __init__(self, ttl: float = SECRET_MAP_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._codes: Dict[str, SecretEntry] = {}
+        self._expires = 0.0
+        self._generation = 0  # 每次作廢 +1；載入期間被作廢就不發布（那批資料可能是異動前讀的）
+        self._counters: Dict[str, int] = {"hits": 0, "rejects": 0, "refreshes": 0, "stale_refreshes": 0,
+                                          "invalidations": 0}
+
+    def is_fresh(self) -> bool:
+        return self._expires > time.monotonic()
+
+    def refresh(self) -> None:
+        with self._refresh_lock:
+            if self.is_fresh():  # 另一條執行緒剛載入完
+                return
+            try:
+                from api.database import engine
+            except ImportError:
+                from database import engine  # type: ignore
+            for _ in range(3):  # 載入期間被作廢就重查；連續被作廢則保持過期，下次再載
+                with self._lock:
+                    generation = self._generation
+                with engine.connect() as conn:
+                    rows = conn.execute(_SECRET_SQL).fetchall()
+                codes: Dict[str, SecretEntry] = {}
+                for code, cid, name, active in rows:
+                    key = normalize_secret_code(code)  # 舊資料可能尚未正規化
+                    if key:
+                        codes[key] = SecretEntry(cid, name, bool(active))
+                with self._lock:
+                    if generation != self._generation:
+                        self._counters["stale_refreshes"] += 1
+                        continue
+                    self._codes = codes
+                    self._expires = time.monotonic() + self.ttl
+                    self._counters["refreshes"] += 1
+                    return
+
+    def lookup(self, raw: Optional[str], active_only: bool = False) -> Optional[SecretEntry]:
+        code = normalize_secret_code(raw)
+        if not code:
+            return None
+        if not self.is_fresh():
+            self.refresh()
+        with self._lock:
+            entry = self._codes.get(code)
+            if entry is None or (active_only and not entry.is_active):
+                self._counters["rejects"] += 1
+                return None
+            self._counters["hits"] += 1
+            return entry
+
+    async def lookup_async(self, raw: Optional[str], active_only: bool = False) -> Optional[SecretEntry]:
+        """async 路由用：對照表過期時才到 threadpool 重新載入。"""
+        if not self.is_fresh() and normalize_secret_code(raw):
+            from starlette.concurrency import run_in_threadpool
+            await run_in_threadpool(self.refresh)
+        return self.lookup(raw, active_only)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._expires = 0.0
+            self._generation += 1
+            self._counters["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "codes": len(self._codes), "ttl_seconds": self.ttl}
+
+
+secret_code_map = SecretCodeMap()
@@ -0,0 +1,99 @@
+# api/utils/file_stream.py
+# -*- coding: utf-8 -*-
+"""
+本機檔案下載回應（支援 HTTP Range，手機網路斷線後可續傳）
+- 只支援單一區段（bytes=a-b / bytes=a- / bytes=-n）；多區段視為沒有 Range，回整個檔案（RFC 9110 允許）
+- If-Range 與目前的 ETag / Last-Modified 不符時忽略 Range（檔案已改過，不能接著舊的續傳）
+- ASGI server 提供 http.response.zerocopy 擴充時交給 server 用 sendfile 直接送 fd；
+  否則（例如 uvicorn）在執行緒池以 RANGE_READ_BLOCK 分塊讀，記憶體只佔一塊
+"""
+
+import os
+from email.utils import formatdate
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+RANGE_READ_BLOCK = 256 * 1024
+
+
+def file_etag(st: os.stat_result) -> str:
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """回傳 [start, end]（含 end）；沒有或不支援的 Range 回 None；無法滿足丟 ValueError"""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[6:].strip().partition("-")
+    try:
+        if not first:              # bytes=-n：最後 n 個位元組
+            n = int(last)
+            if n <= 0 or size == 0:
+                raise ValueError(header)
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except (TypeError, ValueError):
+        raise ValueError(header)
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """以 stat 結果建立；呼叫端先處理 Range 解析失敗（416）"""
+
+    def __init__(self, path: str, st: os.stat_result, filename: str,
+                 media_type: str = "application/octet-stream", range_header: Optional[str] = None,
+                 if_range: Optional[str] = None, method: str = "GET", inline: bool = False):
+        self.path = path
+        self.send_body = method.upper() != "HEAD"
+        etag = file_etag(st)
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+        if if_range and if_range.strip() not in (etag, last_modified):
+            range_header = None
+
+        size = st.st_size
+        span = parse_range(range_header, size)
+        self.offset, self.count = (span[0], span[1] - span[0] + 1) if span else (0, size)
+
+        disposition = "inline" if inline else "attachment"
+        headers: Dict[str, str] = {
+            "accept-ranges": "bytes",
+            "content-length": str(self.count),
+            "etag": etag,
+            "last-modified": last_modified,
+            "content-disposition": f"{disposition}; filename*=utf-8''{quote(filename)}",
+        }
+        if span:
+            headers["content-range"] = f"bytes {span[0]}-{span[1]}/{size}"
+        super().__init__(status_code=206 if span else 200, headers=headers, media_type=media_type)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        f = await anyio.to_thread.run_sync(open, self.path, "rb")
+        try:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopy", "file": f,
+                            "offset": self.offset, "count": self.count, "more_body": False})
+                return
+            await anyio.to_thread.run_sync(f.seek, self.offset)
+            left = self.count
+            while left > 0:
+                block: Any = await anyio.to_thread.run_sync(f.read, min(RANGE_READ_BLOCK, left))
+                if not block:  # 檔案在傳送途中被截短
+                    break
+                left -= len(block)
+                await send({"type": "http.response.body", "body": block, "more_body": left > 0})
+            if left > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await anyio.to_thread.run_sync(f.close)
@@ -0,0 +1,62 @@
+# api/utils/render_cache.py
+# -*- coding: utf-8 -*-
+"""
+案件文字渲染快取（LINE 案件詳情 / 進度歷程）
+- 鍵：(種類, 案件識別)；版本：(updated_at, 樣板版本)。版本不同即視為未命中並覆寫，
+  同一案件只保留最新一份，不需要另外作廢
+- 不依賴 DB / FastAPI，API（user_routes）與桌面端（CaseDisplayFormatter）共用
+- 改了輸出格式就把呼叫端的 *_TEMPLATE_VERSION +1
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "5000"))
+
+
+class RenderCache:
+    def __init__(self, max_entries: int = RENDER_CACHE_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        # (kind, key) -> ((updated_at, template_version), text)
+        self._entries: "OrderedDict[Tuple[str, Hashable], Tuple[Tuple[Any, int], str]]" = OrderedDict()
+        self._counters: Dict[str, int] = {"hits": 0, "misses": 0, "bypass": 0, "evictions": 0}
+
+    def render(self, kind: str, key: Optional[Hashable], updated_at: Any, template_version: int,
+               build: Callable[[], str]) -> str:
+        """命中直接回傳；否則呼叫 build() 並存入。key 或 updated_at 為空時不快取。"""
+        if key is None or updated_at is None:
+            with self._lock:
+                self._counters["bypass"] += 1
+            return build()
+
+        slot, version = (kind, key), (updated_at, template_version)
+        with self._lock:
+            hit = self._entries.get(slot)
+            if hit and hit[0] == version:
+                self._entries.move_to_end(slot)
+                self._counters["hits"] += 1
+                return hit[1]
+            self._counters["misses"] += 1
+
+        out = build()
+        with self._lock:
+            self._entries[slot] = (version, out)
+            self._entries.move_to_end(slot)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "max_entries": self.max_entries}
+
+
+render_cache = RenderCache()
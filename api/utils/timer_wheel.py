@@ -0,0 +1,76 @@
+# api/utils/timer_wheel.py
+# -*- coding: utf-8 -*-
+"""
+Hashed timer wheel：大量「某時刻觸發一次」的計時器，排入 / 取消 / 每格推進都是 O(1)
+- 每個 key 只保留一個計時器，重新排程會取代舊的
+- 超過一圈的計時器記剩餘圈數；到期判斷以格為單位（精度 = tick 秒），不會提早觸發
+- 只是資料結構：不開執行緒、不碰 asyncio，由呼叫端定期呼叫 advance()
+"""
+
+import math
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 1.0, slots: int = 3600, clock=time.time):
+        self.tick = float(tick)
+        self.slots = max(1, int(slots))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._wheel: List[Dict[Hashable, Tuple[int, Any]]] = [{} for _ in range(self.slots)]  # key -> (圈數, payload)
+        self._where: Dict[Hashable, int] = {}
+        self._cursor = 0
+        self._now_tick = math.floor(clock() / self.tick)  # 游標目前對應的時間（以 tick 計）
+
+    def schedule(self, key: Hashable, deadline: float, payload: Any = None) -> None:
+        """deadline 為 epoch 秒；已經過了的在下一格觸發。"""
+        with self._lock:
+            self._remove(key)
+            ticks = max(1, math.ceil(deadline / self.tick) - self._now_tick)
+            slot = (self._cursor + ticks) % self.slots
+            self._wheel[slot][key] = ((ticks - 1) // self.slots, payload)
+            self._where[key] = slot
+
+    def cancel(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._remove(key)
+
+    def _remove(self, key: Hashable) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        self._wheel[slot].pop(key, None)
+        return True
+
+    def advance(self, now: Optional[float] = None) -> List[Tuple[Hashable, Any]]:
+        """推進到 now（預設目前時間），回傳這段期間到期的 (key, payload)。"""
+        target = math.floor((self._clock() if now is None else now) / self.tick)
+        fired: List[Tuple[Hashable, Any]] = []
+        with self._lock:
+            while self._now_tick < target:
+                self._now_tick += 1
+                self._cursor = (self._cursor + 1) % self.slots
+                bucket = self._wheel[self._cursor]
+                for key, (rounds, payload) in list(bucket.items()):
+                    if rounds:
+                        bucket[key] = (rounds - 1, payload)
+                    else:
+                        del bucket[key]
+                        del self._where[key]
+                        fired.append((key, payload))
+        return fired
+
+    def next_tick_at(self) -> float:
+        """下一格的 epoch 時間，驅動迴圈用來決定要睡多久。"""
+        with self._lock:
+            return (self._now_tick + 1) * self.tick
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._where
@@ -3,9 +3,10 @@
 與 CaseOverviewWindow._on_upload_to_database 相容的上傳器
 - 非同步上傳（thread）
 - 進度回呼（progress_callback）
-- 批次上傳 + 簡易重試
+- NDJSON 串流上傳；連線中斷時向伺服器查詢游標，從已提交的行繼續（不重頭來）
+- 伺服器不支援串流時退回批次上傳 + 簡易重試
 - 支援 CaseData 物件或 dict
-端點：POST {API_BASE_URL}/api/cases/upsert  -> public.case_records
+端點：POST {API_BASE_URL}/api/cases/upsert/ndjson（退路：/api/cases/upsert）-> public.case_records
 """
 
 from __future__ import annotations
@@ -14,6 +15,7 @@ import os
 import json
 import threading
 import time
+import uuid
 import requests
 
 API_DEFAULT = os.getenv("API_BASE_URL", "https://law-controller-4a92b3cfcb5d.herokuapp.com").rstrip("/")
@@ -94,6 +96,7 @@ class CaseDatabaseUploader:
             self._session.headers.update({"Authorization": f"Bearer {self.token}"})
 
         self._upsert_url = f"{self.api_base}/api/cases/upsert"
+        self._ndjson_url = f"{self.api_base}/api/cases/upsert/ndjson"
 
     # ========= 對外介面，與 CaseOverviewWindow 相容 =========
     def upload_cases_async(
@@ -104,8 +107,9 @@ class CaseDatabaseUploader:
         complete_callback: Callable[[bool, Dict[str, Any]], None],
         chunk_size: int = 100,
         per_chunk_retry: int = 2,
+        stream: bool = True,
     ) -> None:
-        """啟動背景執行緒，非同步上傳"""
+        """啟動背景執行緒，非同步上傳（stream=False 則直接用批次上傳）"""
         self._cancel = False
         self._uploaded_count = 0
         self._failed_count = 0
@@ -116,7 +120,7 @@ class CaseDatabaseUploader:
             self.token = token
             self._session.headers["Authorization"] = f"Bearer {token}"
 
-        args = (cases, user_data, progress_callback, complete_callback, chunk_size, per_chunk_retry)
+        args = (cases, user_data, progress_callback, complete_callback, chunk_size, per_chunk_retry, stream)
         self._thread = threading.Thread(target=self._worker, args=args, daemon=True)
         self._thread.start()
 
@@ -138,6 +142,7 @@ class CaseDatabaseUploader:
         complete_cb: Callable[[bool, Dict[str, Any]], None],
         chunk_size: int,
         per_chunk_retry: int,
+        stream: bool = True,
     ) -> None:
         try:
             total = len(cases)
@@ -169,6 +174,18 @@ class CaseDatabaseUploader:
                 complete_cb(False, {"message": "沒有有效案件（缺少 case_id）"})
                 return
 
+            if stream:
+                result = self._upload_ndjson(normalized, progress_cb, chunk_size, per_chunk_retry)
+                if result is not None:
+                    if self._cancel:
+                        progress_cb(100, "已取消上傳")
+                        complete_cb(False, {"message": "用戶取消", **result})
+                        return
+                    progress_cb(100, "上傳完成")
+                    complete_cb(True, result)
+                    return
+                # 伺服器尚未支援 NDJSON → 批次上傳
+
             # 批次上傳
             batches = [normalized[i:i + max(1, chunk_size)] for i in range(0, len(normalized), max(1, chunk_size))]
             total_batches = len(batches)
@@ -201,6 +218,97 @@ class CaseDatabaseUploader:
         except Exception as e:
             complete_cb(False, {"message": f"例外：{e}"})
 
+    def _upload_ndjson(
+        self,
+        rows: List[JsonDict],
+        progress_cb: Callable[[int, str], None],
+        chunk_size: int,
+        retry: int,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        以 NDJSON 串流送出；伺服器每 chunk_size 行 commit 一次並記錄游標。
+        中斷後以 upload_id 查游標，從該行接續。伺服器不支援時回傳 None。
+        """
+        total = len(rows)
+        lines = [json.dumps(d, ensure_ascii=False).encode("utf-8") + b"\n" for d in rows]
+        upload_id = uuid.uuid4().hex
+        cursor = 0
+        errors: List[str] = []
+        last_err = ""
+        attempt = 0
+
+        def body(start: int):
+            for i in range(start, total):
+                if self._cancel:
+                    return  # 提早結束 body；伺服器會提交已收到的行
+                if (i - start) % max(1, chunk_size) == 0:
+                    progress_cb(min(99, int(i / total * 100)), f"已送出 {i}/{total} 筆")
+                yield lines[i]
+
+        while cursor < total and not self._cancel:
+            try:
+                resp = self._session.post(
+                    self._ndjson_url,
+                    params={"upload_id": upload_id, "start": cursor, "chunk_size": chunk_size},
+                    data=body(cursor),
+                    headers={"Content-Type": "application/x-ndjson"},
+                    timeout=(10, 120),
+                )
+                if resp.status_code in (404, 405, 415) and cursor == 0:
+                    return None
+                if 200 <= resp.status_code < 300:
+                    data = resp.json()
+                    advanced = int(data.get("cursor", cursor)) > cursor
+                    cursor = int(data.get("cursor", cursor))
+                    errors.extend(data.get("errors") or [])
+                    self._uploaded_count = int(data.get("uploaded", 0))
+                    self._failed_count = int(data.get("failed", 0))
+                    if advanced:
+                        attempt = 0
+                        continue
+                    last_err = "伺服器游標未前進"
+                if resp.status_code == 409:
+                    # 游標落後伺服器：以伺服器為準
+                    cursor = int(((resp.json() or {}).get("detail") or {}).get("cursor", 0))
+                    continue
+                last_err = f"HTTP {resp.status_code} {resp.text[:200]}"
+            except requests.RequestException as e:
+                last_err = f"{type(e).__name__}: {e}"
+
+            attempt += 1
+            if attempt > retry:
+                break
+            time.sleep(1.2 * attempt)
+            cursor = self._fetch_cursor(upload_id, cursor)
+            progress_cb(min(99, int(cursor / total * 100)), f"連線中斷，從第 {cursor + 1} 筆續傳")
+
+        result: Dict[str, Any] = {
+            "total": total,
+            "uploaded": self._uploaded_count,
+            "failed": self._failed_count,
+            "upload_id": upload_id,
+            "errors": errors,
+        }
+        if cursor < total and not self._cancel:
+            # 重試用盡：未送達的行視為失敗
+            self._failed_count = total - self._uploaded_count
+            result.update(failed=self._failed_count, message=last_err)
+        return result
+
+    def _fetch_cursor(self, upload_id: str, fallback: int) -> int:
+        try:
+            resp = self._session.get(f"{self._ndjson_url}/{upload_id}", timeout=10)
+            if resp.status_code == 200:
+                data = resp.json()
+                self._uploaded_count = int(data.get("uploaded", self._uploaded_count))
+                self._failed_count = int(data.get("failed", self._failed_count))
+                return int(data.get("cursor", fallback))
+            if resp.status_code == 404:
+                return 0  # 伺服器還沒建立游標（第一次請求就失敗）
+        except requests.RequestException:
+            pass
+        return fallback
+
     def _post_upsert_with_retry(self, payload: List[JsonDict], retry: int) -> (bool, str):
         for attempt in range(retry + 1):
             try:
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+案件檔案上傳引擎（UploadFileDialog 使用）
+- 背景執行緒 + 有上限的 worker pool（UPLOAD_WORKERS 個檔案同時傳），Tk 主執行緒不會卡住
+- 直傳 S3：by-hash 已有相同內容就跳過 → presign → 分段 PUT → complete
+- 每段 PUT 以檔案區段串流送出（不整段讀進記憶體），失敗自動重試
+- 中斷後同一個 engine 再 start()：已完成的檔案略過；分段上傳中的檔案向
+  /api/files/presign/resume 查詢 S3 已收到的分段，從下一段接續（不重頭來）
+- 進度以 dispatch（對話框傳入 window.after）送回 UI：單檔 on_file(task)、整體 on_total(sent, total)
+端點：{API_BASE_URL}/api/files/by-hash|presign|presign/resume|complete
+"""
+
+from __future__ import annotations
+
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+
+API_DEFAULT = os.getenv("API_BASE_URL", "https://law-controller-4a92b3cfcb5d.herokuapp.com").rstrip("/")
+UPLOAD_WORKERS = max(1, int(os.getenv("UPLOAD_WORKERS", "3")))
+PART_RETRY = max(0, int(os.getenv("UPLOAD_PART_RETRY", "3")))
+PART_TIMEOUT = (10, 300)      # (連線, 讀取) 秒；直傳不受 Heroku 30 秒限制
+PROGRESS_INTERVAL = 0.2       # 同一檔案的進度最多每 0.2 秒回報一次
+READ_BLOCK = 256 * 1024
+
+# FileTask.state
+PENDING, HASHING, UPLOADING, DONE, FAILED = "pending", "hashing", "uploading", "done", "failed"
+
+Fallback = Callable[[str, str, str, Dict[str, str]], Tuple[bool, str]]
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Expired(Exception):
+    """multipart 已被 S3 清掉（完成 / abort / 生命週期規則），只能從頭傳"""
+
+
+class FileTask:
+    """單一檔案的上傳狀態；engine 保留到下次 start()，用來略過已完成 / 接續分段"""
+
+    def __init__(self, index: int, path: str):
+        self.index = index
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.size = 0
+        self.mtime = 0.0
+        self.sha256: Optional[str] = None
+        self.state = PENDING
+        self.sent = 0
+        self.detail = ""
+        # 分段上傳中的狀態（續傳用）
+        self.key: Optional[str] = None
+        self.upload_id: Optional[str] = None
+        self.part_size = 0
+        self.etags: Dict[int, str] = {}
+
+    @property
+    def percent(self) -> int:
+        if self.state == DONE:
+            return 100
+        return int(self.sent * 100 / self.size) if self.size else 0
+
+    def reset_multipart(self) -> None:
+        self.key, self.upload_id, self.part_size, self.etags = None, None, 0, {}
+
+
+class _PartReader:
+    """檔案的一個區段，當成有長度的檔案物件交給 requests（送 Content-Length，不用 chunked）"""
+
+    def __init__(self, f, offset: int, length: int, on_read: Callable[[int], None]):
+        f.seek(offset)
+        self._f = f
+        self._left = length
+        self._on_read = on_read
+
+    def __len__(self) -> int:
+        return self._left
+
+    def read(self, n: int = -1) -> bytes:
+        if self._left <= 0:
+            return b""
+        n = self._left if n is None or n < 0 else min(n, self._left)
+        data = self._f.read(n)
+        self._left -= len(data)
+        self._on_read(len(data))
+        return data
+
+
+class FileUploadEngine:
+    def __init__(self, api_base: Optional[str] = None, headers: Optional[Dict[str, str]] = None,
+                 workers: int = UPLOAD_WORKERS, fallback: Optional[Fallback] = None,
+                 dispatch: Optional[Callable[[Callable[[], Any]], Any]] = None):
+        self.api_base = (api_base or API_DEFAULT).rstrip("/")
+        self.headers = dict(headers or {})
+        self.workers = max(1, workers)
+        self.fallback = fallback          # 後端沒有 presign 端點時改走舊的 /api/files/upload
+        self.dispatch = dispatch or (lambda fn: fn())
+        self.tasks: Dict[str, FileTask] = {}
+        self._cancel = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._session.headers.update(self.headers)
+
+    # ========= 對外介面 =========
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, paths: List[str], client_id: str, case_id: str,
+              on_file: Optional[Callable[[FileTask], None]] = None,
+              on_total: Optional[Callable[[int, int], None]] = None,
+              on_complete: Optional[Callable[[List[FileTask]], None]] = None) -> None:
+        """背景上傳 paths；已完成且檔案未變動的會略過。回呼都經 dispatch 送回 UI 執行緒"""
+        if self.running:
+            return
+        self._cancel.clear()
+        tasks = [self._task_for(i, p) for i, p in enumerate(paths)]
+        args = (tasks, client_id, case_id, on_file, on_total, on_complete)
+        self._thread = threading.Thread(target=self._worker, args=args, daemon=True)
+        self._thread.start()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def summary(self) -> Dict[str, int]:
+        tasks = list(self.tasks.values())
+        return {"total": len(tasks),
+                "uploaded": sum(t.state == DONE for t in tasks),
+                "failed": sum(t.state == FAILED for t in tasks)}
+
+    # ========= 內部實作 =========
+    def _task_for(self, index: int, path: str) -> FileTask:
+        try:
+            st = os.stat(path)
+            size, mtime = st.st_size, st.st_mtime
+        except OSError:
+            size, mtime = 0, 0.0
+        task = self.tasks.get(path)
+        if task is None or (task.size, task.mtime) != (size, mtime):
+            task = FileTask(index, path)  # 新檔案或檔案已改過：重新來
+            task.size, task.mtime = size, mtime
+            self.tasks[path] = task
+        task.index = index
+        return task
+
+    def _worker(self, tasks, client_id, case_id, on_file, on_total, on_complete) -> None:
+        total = sum(t.size for t in tasks)
+        last: Dict[int, float] = {}
+
+        def report(task: FileTask, force: bool = False) -> None:
+            now = time.monotonic()
+            with self._lock:
+                if not force and now - last.get(task.index, 0.0) < PROGRESS_INTERVAL:
+                    return
+                last[task.index] = now
+                sent = sum(t.size if t.state == DONE else t.sent for t in tasks)
+            if on_file:
+                self.dispatch(lambda: on_file(task))
+            if on_total:
+                self.dispatch(lambda: on_total(sent, total))
+
+        def run(task: FileTask) -> None:
+            if self._cancel.is_set():
+                return
+            try:
+                task.detail = self._upload(task, client_id, case_id, report)
+                task.state = DONE
+            except _Cancelled:
+                task.state, task.detail = FAILED, "已取消"
+            except Exception as e:
+                task.state, task.detail = FAILED, f"{type(e).__name__}: {e}"
+                print(f"檔案上傳失敗: {task.filename} - {task.detail}")
+            report(task, force=True)
+
+        todo = [t for t in tasks if t.state != DONE]
+        for t in tasks:
+            report(t, force=True)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="file-upload") as pool:
+            list(pool.map(run, todo))
+        if on_complete:
+            self.dispatch(lambda: on_complete(tasks))
+
+    def _url(self, path: str) -> str:
+        return f"{self.api_base}/api/files/{path}"
+
+    def _upload(self, task: FileTask, client_id: str, case_id: str, report) -> str:
+        if task.sha256 is None:
+            task.state = HASHING
+            report(task, force=True)
+            task.sha256 = self._hash(task.path)
+        task.state = UPLOADING
+        task.sent = 0
+        report(task, force=True)
+
+        content_type = mimetypes.guess_type(task.filename)[0] or "application/octet-stream"
+        body = {"client_id": client_id, "case_id": case_id, "filename": task.filename, "size": task.size,
+                "content_type": content_type, "sha256": task.sha256,
+                "uploaded_by": os.getenv("UPLOADER_NAME", "desktop-app")}
+
+        if task.upload_id:
+            try:
+                plan = self._resume(task, client_id)
+                return self._send_parts(task, plan, body, report)
+            except _Expired:
+                task.reset_multipart()
+
+        known = self._call("head", self._url(f"by-hash/{task.sha256}"), params={"client_id": client_id}, timeout=15)
+        if known.status_code == 200:
+            done = self._call("post", self._url("complete"), json=body, timeout=60)
+            if 200 <= done.status_code < 300:
+                return "dedup, 0 bytes sent"
+            if done.status_code != 404:  # 404：內容剛好被刪掉，照常上傳
+                raise RuntimeError(f"complete HTTP {done.status_code} {done.text[:200]}")
+
+        resp = self._call("post", self._url("presign"), timeout=30, json={
+            k: body[k] for k in ("client_id", "case_id", "filename", "size", "content_type", "sha256")})
+        if resp.status_code in (404, 405):
+            if not self.fallback:
+                raise RuntimeError("後端不支援直傳")
+            ok, detail = self.fallback(task.path, client_id, case_id, self.headers)
+            if not ok:
+                raise RuntimeError(detail)
+            return detail
+        if not 200 <= resp.status_code < 300:
+            raise RuntimeError(f"presign HTTP {resp.status_code} {resp.text[:200]}")
+        plan = resp.json()
+
+        if plan["mode"] == "exists":
+            self._complete(body)
+            return "dedup, 0 bytes sent"
+        if plan["mode"] == "put":
+            self._put(task, plan["url"], 0, task.size, plan.get("headers") or {}, report)
+            self._complete({**body, "key": plan["key"]})
+            return "direct, 1 part"
+
+        task.key, task.upload_id, task.part_size = plan["key"], plan["upload_id"], int(plan["part_size"])
+        return self._send_parts(task, plan, body, report)
+
+    def _send_parts(self, task: FileTask, plan: Dict[str, Any], body: Dict[str, Any], report) -> str:
+        for p in plan.get("done") or []:
+            task.etags[int(p["part_number"])] = p["etag"]
+        task.sent = min(task.size, len(task.etags) * task.part_size)
+        report(task, force=True)
+        for part in plan["parts"]:
+            n = int(part["part_number"])
+            if n in task.etags:
+                continue
+            offset = (n - 1) * task.part_size
+            length = min(task.part_size, task.size - offset)
+            task.etags[n] = self._put(task, part["url"], offset, length, {}, report)
+        try:
+            self._complete({**body, "key": task.key, "upload_id": task.upload_id,
+                            "parts": [{"part_number": n, "etag": e} for n, e in sorted(task.etags.items())]})
+        except _Expired:
+            task.reset_multipart()
+            raise
+        parts = len(task.etags)
+        task.reset_multipart()
+        return f"direct, {parts} part(s)"
+
+    def _resume(self, task: FileTask, client_id: str) -> Dict[str, Any]:
+        resp = self._call("post", self._url("presign/resume"), timeout=30, json={
+            "client_id": client_id, "key": task.key, "upload_id": task.upload_id,
+            "size": task.size, "part_size": task.part_size})
+        if resp.status_code in (404, 405):
+            raise _Expired()
+        if not 200 <= resp.status_code < 300:
+            raise RuntimeError(f"resume HTTP {resp.status_code} {resp.text[:200]}")
+        task.etags = {}  # 以 S3 實際收到的為準
+        return resp.json()
+
+    def _put(self, task: FileTask, url: str, offset: int, length: int, headers: Dict[str, str], report) -> str:
+        """PUT 一個區段，失敗重試；成功後這段的位元組才算進 task.sent。回傳 ETag"""
+        base = task.sent
+        last_err = ""
+        for attempt in range(PART_RETRY + 1):
+            if self._cancel.is_set():
+                raise _Cancelled()
+            sent = [0]
+
+            def on_read(n: int) -> None:
+                if self._cancel.is_set():
+                    raise _Cancelled()
+                sent[0] += n
+                task.sent = base + sent[0]
+                report(task)
+
+            try:
+                with open(task.path, "rb") as f:
+                    # 不走 session：presigned URL 不能帶 API 的 Authorization
+                    resp = requests.put(url, data=_PartReader(f, offset, length, on_read),
+                                        headers=headers, timeout=PART_TIMEOUT)
+                if 200 <= resp.status_code < 300:
+                    task.sent = base + length
+                    report(task, force=True)
+                    return resp.headers.get("ETag", "")
+                if resp.status_code == 404:
+                    raise _Expired()
+                last_err = f"S3 HTTP {resp.status_code}"
+            except requests.RequestException as e:
+                last_err = f"{type(e).__name__}: {e}"
+            task.sent = base
+            report(task, force=True)
+            if attempt < PART_RETRY:
+                time.sleep(1.2 * (attempt + 1))
+        raise RuntimeError(last_err)
+
+    def _complete(self, body: Dict[str, Any]) -> None:
+        resp = self._call("post", self._url("complete"), json=body, timeout=60)
+        if 200 <= resp.status_code < 300:
+            return
+        if body.get("upload_id") and resp.status_code in (400, 404) and "NoSuchUpload" in resp.text:
+            raise _Expired()
+        raise RuntimeError(f"complete HTTP {resp.status_code} {resp.text[:200]}")
+
+    def _call(self, method: str, url: str, **kwargs) -> requests.Response:
+        """API 呼叫：連線錯誤與 5xx 重試"""
+        for attempt in range(PART_RETRY + 1):
+            if self._cancel.is_set():
+                raise _Cancelled()
+            try:
+                resp = self._session.request(method, url, **kwargs)
+                if resp.status_code < 500 or attempt == PART_RETRY:
+                    return resp
+            except requests.RequestException:
+                if attempt == PART_RETRY:
+                    raise
+            time.sleep(1.2 * (attempt + 1))
+        raise RuntimeError("unreachable")
+
+    def _hash(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                if self._cancel.is_set():
+                    raise _Cancelled()
+                digest.update(chunk)
+        return digest.hexdigest()
@@ -12,6 +12,14 @@ import os
 from typing import List, Tuple
 from datetime import datetime
 
+try:
+    from api.utils.render_cache import render_cache
+except ImportError:
+    render_cache = None
+
+# 進度歷程輸出格式有改動時 +1，讓快取內的舊文字失效
+TIMELINE_TEMPLATE_VERSION = 1
+
 class CaseDisplayFormatter:
     """案件顯示格式化器"""
 
@@ -66,7 +74,7 @@ class CaseDisplayFormatter:
 
             # 完整進度階段歷程
             if include_progress_timeline:
-                response += CaseDisplayFormatter._format_progress_timeline_without_status(case)
+                response += CaseDisplayFormatter._cached_progress_timeline(case)
             else:
                 response += f"\n📊 當前狀態：{case.progress}\n"
                 if case.progress_date:
@@ -169,6 +177,19 @@ class CaseDisplayFormatter:
             print(f"格式化資料夾結構失敗: {e}")
             return f"\\n📁 案件資料夾：\\n❌ 顯示資料夾資訊時發生錯誤\\n"
 
+    @staticmethod
+    def _cached_progress_timeline(case) -> str:
+        """進度歷程依 (case_id, updated_date, 樣板版本) 快取；CaseData 每次修改都會更新 updated_date"""
+        if render_cache is None:
+            return CaseDisplayFormatter._format_progress_timeline_without_status(case)
+        return render_cache.render(
+            "desktop_progress_timeline",
+            getattr(case, 'case_id', None),
+            getattr(case, 'updated_date', None),
+            TIMELINE_TEMPLATE_VERSION,
+            lambda: CaseDisplayFormatter._format_progress_timeline_without_status(case),
+        )
+
     @staticmethod
     def _format_progress_timeline_without_status(case) -> str:
         """格式化進度時間軸（移除當前狀態摘要）"""
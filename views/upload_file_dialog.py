@@ -5,7 +5,9 @@
 views/upload_file_dialog.py
 雲端檔案上傳對話框（最小變更版）
 - 將原本本機 shutil.copy2() 流程，改為呼叫後端 API 上傳到雲端
-- 端點：POST /api/files/upload  (multipart/form-data)
+- 直傳：POST /api/files/presign 取得 presigned URL → 直接 PUT 到 S3（大檔分段）→ POST /api/files/complete 登錄
+  檔案內容不經過 API dyno；後端沒有 presign 端點時退回 POST /api/files/upload（multipart/form-data）
+- 上傳在背景執行（controllers/file_upload_engine.py）：多檔並行、逐檔與整體進度、失敗後重試只補傳未完成的
 - 自動夾帶 JWT：優先取 start_local.current_user_data['token']；其次取環境變數 API_BEARER_TOKEN
 """
 
@@ -18,6 +20,7 @@ from typing import Callable, Optional, Dict, Any, List
 import requests  # ✅ 新增：雲端上傳使用
 
 from config.settings import AppConfig
+from controllers.file_upload_engine import DONE, FAILED, HASHING, UPLOADING, FileTask, FileUploadEngine
 from models.case_model import CaseData
 from views.base_window import BaseWindow
 
@@ -60,7 +63,7 @@ except ImportError as e:
 
 # === 雲端上傳 API 設定 ===
 API_BASE_URL = os.getenv("API_BASE_URL", "https://law-controller-4a92b3cfcb5d.herokuapp.com")
-UPLOAD_ENDPOINT = f"{API_BASE_URL}/api/files/upload"   # 後端檔案上傳端點
+UPLOAD_ENDPOINT = f"{API_BASE_URL}/api/files/upload"   # 後端檔案上傳端點（舊版，經 API 轉送）
 
 def _get_bearer_token_from_runtime() -> str:
     """
@@ -101,12 +104,13 @@ class UploadFileDialog(BaseWindow):
         self.folder_manager = folder_manager
         self.on_upload_complete = on_upload_complete
         self.selected_files: List[str] = []
+        self._engine: Optional[FileUploadEngine] = None
 
         # 準備顯示用的資料夾選項（仍保留 UI，但不再做本機複製）
         self.folder_options = self._get_unified_folder_options()
         self.folder_var = tk.StringVar()
 
-        super().__init__(title="上傳檔案", width=350, height=450, resizable=False, parent=parent)
+        super().__init__(title="上傳檔案", width=350, height=500, resizable=False, parent=parent)
 
         # 🔥 統一的視窗置頂處理
         self._setup_window_topmost()
@@ -269,13 +273,25 @@ class UploadFileDialog(BaseWindow):
         # 檔案操作按鈕
         self._create_file_operation_buttons(file_frame)
 
+        # 上傳進度（整體）
+        self.progress_var = tk.StringVar(value="")
+        self.progress_bar = ttk.Progressbar(file_frame, orient="horizontal", mode="determinate", maximum=100)
+        self.progress_bar.pack(fill='x', pady=(10, 0))
+        tk.Label(
+            file_frame,
+            textvariable=self.progress_var,
+            bg=AppConfig.COLORS['window_bg'],
+            fg=AppConfig.COLORS['text_color'],
+            font=AppConfig.FONTS.get('text') or AppConfig.FONTS.get('default')
+        ).pack(anchor='w')
+
     def _create_file_operation_buttons(self, parent):
         """建立檔案操作按鈕"""
         file_btn_frame = tk.Frame(parent, bg=AppConfig.COLORS['window_bg'])
         file_btn_frame.pack(fill='x')
 
         # 新增檔案
-        add_file_btn = tk.Button(
+        self.add_file_btn = tk.Button(
             file_btn_frame,
             text='選擇檔案',
             command=self._select_files_with_topmost,
@@ -285,10 +301,10 @@ class UploadFileDialog(BaseWindow):
             width=10,
             height=1
         )
-        add_file_btn.pack(side='left', padx=(0, 5))
+        self.add_file_btn.pack(side='left', padx=(0, 5))
 
         # 移除檔案
-        remove_file_btn = tk.Button(
+        self.remove_file_btn = tk.Button(
             file_btn_frame,
             text='移除',
             command=self._remove_selected_file,
@@ -298,10 +314,10 @@ class UploadFileDialog(BaseWindow):
             width=8,
             height=1
         )
-        remove_file_btn.pack(side='left', padx=5)
+        self.remove_file_btn.pack(side='left', padx=5)
 
         # 清空
-        clear_files_btn = tk.Button(
+        self.clear_files_btn = tk.Button(
             file_btn_frame,
             text='清空',
             command=self._clear_all_files,
@@ -311,7 +327,7 @@ class UploadFileDialog(BaseWindow):
             width=8,
             height=1
         )
-        clear_files_btn.pack(side='left', padx=5)
+        self.clear_files_btn.pack(side='left', padx=5)
 
     def _create_action_buttons(self, parent):
         """建立操作按鈕"""
@@ -319,7 +335,7 @@ class UploadFileDialog(BaseWindow):
         button_frame.pack(side='bottom', pady=20)
 
         # 上傳
-        upload_btn = tk.Button(
+        self.upload_btn = tk.Button(
             button_frame,
             text='開始上傳',
             command=self._start_upload_with_topmost,
@@ -329,13 +345,13 @@ class UploadFileDialog(BaseWindow):
             width=10,
             height=1
         )
-        upload_btn.pack(side='left', padx=5)
+        self.upload_btn.pack(side='left', padx=5)
 
         # 取消
         cancel_btn = tk.Button(
             button_frame,
             text='取消',
-            command=self.close,
+            command=self._cancel_and_close,
             bg=AppConfig.COLORS['button_bg'],
             fg=AppConfig.COLORS['button_fg'],
             font=AppConfig.FONTS.get('button') or AppConfig.FONTS.get('default'),
@@ -376,6 +392,12 @@ class UploadFileDialog(BaseWindow):
             self._restore_topmost_immediately()
             UnifiedMessageDialog.show_error(self.window, f"選擇檔案時發生錯誤：{str(e)}")
 
+    def _cancel_and_close(self):
+        """取消（上傳中則中止；分段上傳的進度留在 S3，重新上傳時可接續）"""
+        if self._engine is not None:
+            self._engine.cancel()
+        self.close()
+
     def _remove_selected_file(self):
         """移除選中的檔案"""
         selection = self.file_listbox.curselection()
@@ -391,6 +413,7 @@ class UploadFileDialog(BaseWindow):
 
     def _update_file_list_display(self):
         """更新檔案列表顯示"""
+        self.upload_btn.configure(text='開始上傳')
         self.file_listbox.delete(0, tk.END)
         for file_path in self.selected_files:
             self.file_listbox.insert(tk.END, os.path.basename(file_path))
@@ -415,9 +438,9 @@ class UploadFileDialog(BaseWindow):
     # ==================== 雲端上傳核心 ====================
 
     def _execute_file_upload(self, selected_folder: str):
-        """呼叫後端 /api/files/upload 將檔案上傳到雲端資料庫"""
-        success_count = 0
-        error_files: List[str] = []
+        """背景上傳（FileUploadEngine）；進度經 window.after 回到這裡更新，失敗後再按一次只補傳未完成的"""
+        if self._engine is not None and self._engine.running:
+            return
 
         # 從案件資料取 client_id / case_id（大小寫兼容）
         client_id = getattr(self.case_data, "client_id", "") or getattr(self.case_data, "clientId", "") or ""
@@ -427,53 +450,102 @@ class UploadFileDialog(BaseWindow):
             self._show_topmost_message("error", "缺少 client_id 或 case_id，無法上傳。\n請確認案件資料是否完整。")
             return
 
-        # 自動取得 JWT
-        token = _get_bearer_token_from_runtime()
-        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        if self._engine is None:
+            # 自動取得 JWT
+            token = _get_bearer_token_from_runtime()
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+            self._engine = FileUploadEngine(
+                api_base=API_BASE_URL, headers=headers, fallback=self._upload_via_api,
+                dispatch=self._dispatch_to_ui,
+            )
 
-        for file_path in self.selected_files:
-            try:
-                filename = os.path.basename(file_path)
-                with open(file_path, "rb") as f:
-                    files = {"file": (filename, f)}
-                    data = {
-                            "client_id": client_id,
-                            "case_id": case_id,
-                            "uploaded_by": os.getenv("UPLOADER_NAME", "desktop-app"),
-                            "client_name": getattr(self.case_data, "client_name", None),
-                            "case_type": getattr(self.case_data, "case_type", None),
-                            "progress": getattr(self.case_data, "progress", None),
-                            "court": getattr(self.case_data, "court", None),
-                            "division": getattr(self.case_data, "division", None),
-                            "metadata": json.dumps({
-                                "progress_stages": getattr(self.case_data, "progress_stages", {}) or {},
-                                "progress_notes": getattr(self.case_data, "progress_notes", {}) or {},
-                                "progress_times": getattr(self.case_data, "progress_times", {}) or {},
-
-                            })
-                        }
-
-                    resp = requests.post(
-                        UPLOAD_ENDPOINT,
-                        data=data,
-                        files=files,
-                        headers=headers,
-                        timeout=60
-                    )
-
-                if 200 <= resp.status_code < 300:
-                    success_count += 1
-                    print(f"檔案上傳成功: {filename} -> {UPLOAD_ENDPOINT}")
-                else:
-                    error_files.append(f"{filename}: HTTP {resp.status_code} {resp.text}")
-                    print(f"檔案上傳失敗: {filename} - {resp.text}")
+        self._set_uploading(True)
+        self._engine.start(
+            list(self.selected_files), client_id, case_id,
+            on_file=self._on_file_progress,
+            on_total=self._on_total_progress,
+            on_complete=lambda tasks: self._on_upload_finished(tasks, selected_folder),
+        )
 
-            except Exception as file_error:
-                error_files.append(f"{os.path.basename(file_path)}: {str(file_error)}")
-                print(f"檔案上傳例外: {file_path} - {file_error}")
+    def _dispatch_to_ui(self, fn: Callable[[], Any]):
+        """背景執行緒 → Tk 主執行緒；視窗已關閉就丟掉這次回報"""
+        try:
+            self.window.after(0, fn)
+        except (tk.TclError, RuntimeError, AttributeError):
+            pass
+
+    def _set_uploading(self, uploading: bool):
+        state = 'disabled' if uploading else 'normal'
+        for btn in (self.upload_btn, self.add_file_btn, self.remove_file_btn, self.clear_files_btn):
+            btn.configure(state=state)
+
+    def _on_file_progress(self, task: FileTask):
+        """單檔進度：更新清單中那一列"""
+        if not self.window or not self.window.winfo_exists() or task.index >= self.file_listbox.size():
+            return
+        label = {
+            DONE: f"✓ {task.filename}",
+            FAILED: f"✗ {task.filename}",
+            HASHING: f"… {task.filename}（檢查中）",
+            UPLOADING: f"↑ {task.filename}（{task.percent}%）",
+        }.get(task.state, task.filename)
+        self.file_listbox.delete(task.index)
+        self.file_listbox.insert(task.index, label)
+
+    def _on_total_progress(self, sent: int, total: int):
+        if not self.window or not self.window.winfo_exists():
+            return
+        percent = int(sent * 100 / total) if total else 100
+        self.progress_bar["value"] = percent
+        self.progress_var.set(f"{percent}%（{sent / 1048576:.1f} / {total / 1048576:.1f} MB）")
 
+    def _on_upload_finished(self, tasks: List[FileTask], selected_folder: str):
+        if not self.window or not self.window.winfo_exists():
+            return
+        self._set_uploading(False)
+        success_count = sum(t.state == DONE for t in tasks)
+        error_files = [f"{t.filename}: {t.detail}" for t in tasks if t.state == FAILED]
+        for t in tasks:
+            if t.state == DONE:
+                print(f"檔案上傳成功: {t.filename} ({t.detail})")
+        if error_files:
+            self.upload_btn.configure(text='重試失敗')
         self._show_upload_result(success_count, error_files, selected_folder)
 
+    def _upload_via_api(self, file_path: str, client_id: str, case_id: str, headers: Dict[str, str]):
+        """舊流程：整個檔案 POST 給 /api/files/upload（後端沒有直傳端點時由 engine 在背景呼叫）"""
+        filename = os.path.basename(file_path)
+        with open(file_path, "rb") as f:
+            files = {"file": (filename, f)}
+            data = {
+                    "client_id": client_id,
+                    "case_id": case_id,
+                    "uploaded_by": os.getenv("UPLOADER_NAME", "desktop-app"),
+                    "client_name": getattr(self.case_data, "client_name", None),
+                    "case_type": getattr(self.case_data, "case_type", None),
+                    "progress": getattr(self.case_data, "progress", None),
+                    "court": getattr(self.case_data, "court", None),
+                    "division": getattr(self.case_data, "division", None),
+                    "metadata": json.dumps({
+                        "progress_stages": getattr(self.case_data, "progress_stages", {}) or {},
+                        "progress_notes": getattr(self.case_data, "progress_notes", {}) or {},
+                        "progress_times": getattr(self.case_data, "progress_times", {}) or {},
+
+                    })
+                }
+
+            resp = requests.post(
+                UPLOAD_ENDPOINT,
+                data=data,
+                files=files,
+                headers=headers,
+                timeout=60
+            )
+
+        if 200 <= resp.status_code < 300:
+            return True, UPLOAD_ENDPOINT
+        return False, f"HTTP {resp.status_code} {resp.text}"
+
     # ==================== 結果/訊息 ====================
 
     def _show_upload_result(self, success_count: int, error_files: List[str], selected_folder: str):